@@ -1,56 +1,220 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 import click
 
-from typing import Tuple
+from typing import Tuple, Dict
 
 import baka.core
 import baka.core.backend
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option('--project', type=click.Path(dir_okay=False, exists=True), help='Path to project file')
 @click.option('--artifacts', type=click.Path(file_okay=False, writable=True), help='Path to write build artifacts to')
 @click.option('--skip', default=None, multiple=True, help='Skip a job by its name')
 @click.option('--skip-environment', flag_value=True, help='Skip environment setup')
-@click.option('--backend', default='lxc', type=click.Choice(('lxc', 'docker',)), help='Container backend to use')
+@click.option('--backend', default='lxc', help='Container backend to use (lxc, docker, local or an installed plugin)')
 @click.option('--name', help='Container backend name')
-@click.option('--image', help='Container backend image')
-@click.option('--arch', help='Container backend arch')
+@click.option('--image', multiple=True, help='Container backend image, repeat it to build for several images')
+@click.option('--arch', multiple=True, help='Container backend arch, repeat it to build for several archs')
+@click.option('--max-parallel', default=2, type=click.IntRange(min=1),
+              help='Number of matrix combinations to build in parallel')
 @click.option('--persistent', flag_value=True, help='Set container persistent')
 @click.option('--nesting', flag_value=True, help='Allow container nesting (lxc only)')
-def cli(project: str = None, artifacts: str = None, skip: Tuple[str] = None, skip_environment: bool = False,
-        backend: str = 'lxc', name: str = None, image: str = None,
-        arch: str = None, persistent: bool = False, nesting: bool = False):
+@click.option('--session', flag_value=True, help='Run commands through a persistent exec session')
+@click.option('--docker-api', flag_value=True, help='Talk to the Docker daemon socket directly (docker only)')
+@click.option('--lxd-api', flag_value=True, help='Run commands and transfer files through the LXD API (lxc only)')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1), help='Number of jobs to run in parallel')
+@click.option('--pool', 'use_pool', flag_value=True, help='Take the container from the pool of prepared containers')
+@click.option('--pool-size', default=1, type=click.IntRange(min=0), help='Number of idle containers to keep pooled')
+@click.option('--pool-recycle', flag_value=True, help='Hand containers back to the pool instead of replacing them')
+@click.option('--snapshot-cache', flag_value=True, help='Launch from cached snapshots of prepared containers')
+@click.option('--no-cache', flag_value=True, help='Run all jobs, even if their inputs did not change')
+@click.option('--apt-cache', flag_value=True, help='Share downloaded packages between containers')
+@click.option('--apt-cache-dir', type=click.Path(file_okay=False), help='Host directory for shared packages')
+@click.option('--apt-update-ttl', default=60, type=click.IntRange(min=0),
+              help='Skip updating package lists fetched less than this many minutes ago')
+@click.option('--compress-transfers', flag_value=True, help='Compress the archives used to transfer directories')
+@click.option('--network-probe', multiple=True,
+              help='Network readiness check: route, dns[:HOST], url:URL or cmd:COMMAND (repeatable)')
+@click.option('--network-timeout', default=120, type=click.IntRange(min=1),
+              help='Seconds to wait for a network connection')
+@click.option('--quiet', '-q', flag_value=True, help='Only show the last output of failed jobs, log files are kept')
+@click.option('--profile', type=click.Path(dir_okay=False, writable=True),
+              help='Write a Chrome trace of the build to this file and print a summary')
+@click.pass_context
+def cli(ctx: click.Context, project: str = None, artifacts: str = None, skip: Tuple[str] = None,
+        skip_environment: bool = False, backend: str = 'lxc', name: str = None, image: Tuple[str] = None,
+        arch: Tuple[str] = None, max_parallel: int = 2, persistent: bool = False, nesting: bool = False,
+        session: bool = False, docker_api: bool = False, lxd_api: bool = False, jobs: int = 1,
+        use_pool: bool = False, pool_size: int = 1, pool_recycle: bool = False, snapshot_cache: bool = False,
+        no_cache: bool = False, apt_cache: bool = False, apt_cache_dir: str = None, apt_update_ttl: int = 60,
+        compress_transfers: bool = False, network_probe: Tuple[str] = None, network_timeout: int = 120,
+        quiet: bool = False, profile: str = None):
     """Baka a simple tool and library for continuous, clean builds.
 
     Baka was primarily created to be used in combination with Snapcraft.
     """
+    if not baka.core.backend.type_exists(backend):
+        raise click.ClickException('The requested container backend "{}" could not be found.'.format(backend))
+    if nesting and backend != 'lxc':
+        raise click.ClickException('Nesting is only supported in for LXC containers.')
+    if docker_api and backend != 'docker':
+        raise click.ClickException('The Docker Engine API can only be used by Docker containers.')
+    if lxd_api and backend != 'lxc':
+        raise click.ClickException('The LXD API can only be used by LXC containers.')
+    for spec in network_probe:
+        try:
+            baka.core.backend.probes.parse(spec)
+        except baka.core.backend.probes.ProbeError as e:
+            raise click.BadParameter(str(e), param_hint='--network-probe')
+    if use_pool and snapshot_cache:
+        raise click.ClickException('The container pool and the snapshot cache can not be used together.')
+    backend_options = {
+        'name': name,
+        'image': image[0] if image else None,
+        'arch': arch[0] if arch else None,
+        'ephemeral': not persistent,
+        'nesting': nesting,
+        'session': session,
+        'engine_api': docker_api,
+        'rest_api': lxd_api,
+        'apt_cache': apt_cache_dir or apt_cache,
+        'apt_update_ttl': apt_update_ttl,
+        'transfer_compression': 'gz' if compress_transfers else None,
+        'network_probes': list(network_probe) or None,
+        'network_timeout': network_timeout
+    }
+    ctx.obj = {
+        'backend': backend,
+        'backend_options': backend_options,
+        'pool_size': pool_size,
+        'pool_recycle': pool_recycle
+    }
+    if ctx.invoked_subcommand is not None:
+        return
     cwd = os.getcwd()
     if not project:
         project = os.path.join(cwd, 'baka.yml')
     if not os.path.isfile(project):
         raise click.ClickException('Project file "{}" does not exist.'.format(project))
-    if not baka.core.backend.type_exists(backend):
-        raise click.ClickException('The requested container backend "{}" could not be found.'.format(backend))
     if not artifacts:
         artifacts = os.path.join(cwd, '.baka')
     if not os.path.isdir(artifacts):
         os.makedirs(artifacts, exist_ok=True)
-    if nesting and backend != 'lxc':
-        raise click.ClickException('Nesting is only supported in for LXC containers.')
-    backend_options = {
-        'name': name,
-        'image': image,
-        'arch': arch,
-        'ephemeral': not persistent,
-        'nesting': nesting
-    }
-    baka.core.run_declarative(
-        project, backend_type=backend, backend_options=backend_options,
-        skip_jobs=skip, skip_environment=skip_environment, artifacts_path=artifacts
+    # Repeated options and the matrix section of the project build several combinations,
+    # options given on the command line replace the values of the project
+    overrides = {key: list(values) for key, values in (('image', image), ('arch', arch)) if values}
+    matrix = None
+    if baka.core.load_project(project, artifacts_path=artifacts).matrix or len(image) > 1 or len(arch) > 1:
+        matrix = overrides
+    if matrix is not None and use_pool:
+        raise click.ClickException('The container pool can not be used for matrix builds.')
+    container_pool = _container_pool(ctx.obj) if use_pool else None
+    snapshots = baka.core.SnapshotCache() if snapshot_cache else None
+    build_cache = baka.core.BuildCache(rebuild=no_cache)
+    tracer = baka.core.tracing.enable() if profile else None
+    # The output of every job phase is written to logs/JOB/PHASE.log
+    baka.core.logsink.enable(os.path.join(artifacts, 'logs'), quiet=quiet)
+    try:
+        if matrix is not None:
+            _run_matrix(project, matrix, backend, backend_options, skip, skip_environment, artifacts, jobs,
+                        max_parallel, snapshots, build_cache)
+        else:
+            baka.core.run_declarative(
+                project, backend_type=backend, backend_options=backend_options,
+                skip_jobs=skip, skip_environment=skip_environment, artifacts_path=artifacts,
+                parallel_jobs=jobs, pool=container_pool, snapshots=snapshots, build_cache=build_cache
+            )
+    finally:
+        baka.core.logsink.disable()
+        if tracer:
+            baka.core.tracing.disable()
+            tracer.write_chrome_trace(profile)
+            click.echo(tracer.format_summary(), err=True)
+            click.echo('Trace written to {}'.format(profile), err=True)
+
+
+def _run_matrix(project: str, matrix: Dict, backend: str, backend_options: Dict, skip: Tuple[str],
+                skip_environment: bool, artifacts: str, jobs: int, max_parallel: int,
+                snapshots: baka.core.SnapshotCache, build_cache: baka.core.BuildCache):
+    results = baka.core.run_matrix(
+        project, matrix, backend_type=backend, backend_options=backend_options,
+        skip_jobs=skip, skip_environment=skip_environment, artifacts_path=artifacts,
+        parallel_jobs=jobs, max_parallel=max_parallel, snapshots=snapshots, build_cache=build_cache
+    )
+    baka.core.logsink.flush()
+    click.echo(baka.core.format_report(results))
+    failed = [result for result in results if not result.success]
+    if failed:
+        raise click.ClickException('{} of {} combinations failed.'.format(len(failed), len(results)))
+
+
+def _container_pool(obj: Dict) -> baka.core.ContainerPool:
+    return baka.core.ContainerPool(
+        obj['backend'], obj['backend_options'],
+        size=obj['pool_size'], recycle=obj['pool_recycle']
+    )
+
+
+@cli.group()
+def pool():
+    """Manage the pool of prepared containers."""
+
+
+@pool.command('ls')
+@click.pass_obj
+def pool_ls(obj: Dict):
+    """List pooled containers."""
+    for key, entry in sorted(_container_pool(obj).containers().items()):
+        click.echo(key)
+        for status in ('idle', 'busy', 'creating'):
+            for name in entry.get(status, ()):
+                click.echo('  {} ({})'.format(name, status))
+
+
+@pool.command('fill')
+@click.pass_obj
+def pool_fill(obj: Dict):
+    """Create containers until --pool-size containers are idle."""
+    _container_pool(obj).fill()
+
+
+@pool.command('drain')
+@click.pass_obj
+def pool_drain(obj: Dict):
+    """Destroy all idle containers."""
+    _container_pool(obj).drain()
+
+
+@cli.group()
+def cache():
+    """Manage cached container snapshots."""
+
+
+@cache.command('ls')
+def cache_ls():
+    """List cached container snapshots."""
+    entries = baka.core.SnapshotCache().entries()
+    for key, entry in sorted(entries.items(), key=lambda item: -item[1]['last_used']):
+        click.echo('{}  {:<8} {:<32} {:>8.1f} MiB  last used {}'.format(
+            key[:12], entry['backend'], entry['image'], entry['size'] / 1024 / 1024,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used']))
+        ))
+
+
+@cache.command('prune')
+@click.option('--max-age', type=click.FloatRange(min=0), help='Remove snapshots unused for more days than this')
+@click.option('--max-size', type=click.FloatRange(min=0), help='Maximum total size of all snapshots in MiB')
+def cache_prune(max_age: float = None, max_size: float = None):
+    """Remove cached container snapshots, all of them if no limit is given."""
+    removed = baka.core.SnapshotCache().prune(
+        max_age=max_age * 24 * 60 * 60 if max_age is not None else None,
+        max_size=int(max_size * 1024 * 1024) if max_size is not None else None
     )
+    click.echo('Removed {} snapshot(s).'.format(len(removed)))
 
 
 if __name__ == '__main__':
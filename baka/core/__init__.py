@@ -8,3 +8,10 @@ from .project import Project
 from .run import run, run_declarative
 from .declarative import load_project
 from .sources import source_type
+from .scheduler import DependencyError
+from .pool import ContainerPool
+from .snapshots import SnapshotCache
+from .buildcache import BuildCache
+from .matrix import run_matrix, format_report
+from . import tracing
+from . import logsink
@@ -1,27 +1,91 @@
 # -*- coding: utf-8 -*-
 
-from typing import Type
+from types import ModuleType
+from typing import Dict, List, Type
+
+import importlib
+import sys
 
 from .base import BaseBackend, CommandResult, NotReadyError, NetworkError
-from .lxc import LXCBackend
-from .docker import DockerBackend
+from .session import ExecSession, SessionError
+from .probes import ReadinessProbe, ProbeError
 
 
+# Backends are imported on first use, their dependencies (e.g. pylxd) are not needed before.
+# Additional backends can be registered by other packages in the "baka.backends" entry point group.
 _type_map = {
-    'lxc': LXCBackend,
-    'docker': DockerBackend
-}
+    'lxc': 'baka.core.backend.lxc:LXCBackend',
+    'docker': 'baka.core.backend.docker:DockerBackend',
+    'local': 'baka.core.backend.local:LocalBackend'
+}  # type: Dict[str, str]
+
+_entry_point_group = 'baka.backends'
+_loaded = {}  # type: Dict[str, Type[BaseBackend]]
+_plugins = None  # type: Dict[str, str]
 
 
 class BackendNotFoundError(Exception):
     pass
 
 
-def type_exists(type_name: str) -> bool:
-    return type_name in _type_map.keys()
+def _plugin_map() -> Dict[str, str]:
+    global _plugins
+    if _plugins is None:
+        _plugins = {}
+        try:
+            from importlib import metadata
+        except ImportError:
+            # Python < 3.8
+            import pkg_resources
+            for entry_point in pkg_resources.iter_entry_points(_entry_point_group):
+                _plugins[entry_point.name] = '{}:{}'.format(entry_point.module_name, '.'.join(entry_point.attrs))
+            return _plugins
+        entry_points = metadata.entry_points()
+        if hasattr(entry_points, 'select'):
+            group = entry_points.select(group=_entry_point_group)
+        else:
+            group = entry_points.get(_entry_point_group, ())
+        for entry_point in group:
+            _plugins[entry_point.name] = entry_point.value
+    return _plugins
 
 
-def by_type(type_name: str) -> Type[BaseBackend]:
+def _target(type_name: str) -> str:
     if type_name in _type_map:
         return _type_map[type_name]
-    raise BackendNotFoundError('Container backend "{}" was requested but could not be found.'.format(type_name))
+    # Only look for plugins if the backend is not built-in
+    return _plugin_map().get(type_name)
+
+
+def types() -> List[str]:
+    return sorted(set(_type_map) | set(_plugin_map()))
+
+
+def type_exists(type_name: str) -> bool:
+    return _target(type_name) is not None
+
+
+def by_type(type_name: str) -> Type[BaseBackend]:
+    if type_name not in _loaded:
+        target = _target(type_name)
+        if target is None:
+            raise BackendNotFoundError(
+                'Container backend "{}" was requested but could not be found.'.format(type_name)
+            )
+        module_name, _, class_name = target.partition(':')
+        _loaded[type_name] = getattr(importlib.import_module(module_name), class_name)
+    return _loaded[type_name]
+
+
+class _Module(ModuleType):
+    # Keep the backend classes importable from this package without importing them eagerly.
+    # Module level __getattr__ needs Python 3.7, the class of a module can be replaced since 3.5.
+    def __getattr__(self, name: str):
+        if name == 'LXCBackend':
+            return by_type('lxc')
+        if name == 'DockerBackend':
+            return by_type('docker')
+        raise AttributeError('module {} has no attribute {}'.format(self.__name__, name))
+
+
+sys.modules[__name__].__class__ = _Module
@@ -1,4 +1,11 @@
+from typing import List
+
+import asyncio
+import os
 import platform
+import subprocess
+import sys
+import threading
 
 
 _debian_arch_map = {
@@ -13,8 +20,112 @@ _debian_arch_map = {
 
 
 def platform_architecture() -> str:
-    return platform.processor()
+    # The processor is unknown on some systems
+    return platform.processor() or platform.machine()
 
 
 def debian_architecture() -> str:
     return _debian_arch_map[platform_architecture()]
+
+
+if sys.version_info < (3, 8):
+    # Child watchers are gone in Python 3.14, newer versions do not need one
+    class _ThreadedChildWatcher(asyncio.AbstractChildWatcher):
+        """Waits for every child process in a thread of its own.
+
+        Before Python 3.8, the default child watcher relies on SIGCHLD handlers of
+        the main thread's loop, subprocesses of loops in other threads (e.g. parallel
+        matrix builds) are not reliably noticed. Like ThreadedChildWatcher of Python
+        3.8, this one works with any loop in any thread.
+        """
+        def add_child_handler(self, pid, callback, *args):
+            threading.Thread(target=self._wait, args=(pid, callback, args), daemon=True).start()
+
+        def remove_child_handler(self, pid):
+            return True
+
+        def attach_loop(self, loop):
+            pass
+
+        def close(self):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            pass
+
+        @staticmethod
+        def _wait(pid: int, callback, args):
+            try:
+                _, status = os.waitpid(pid, 0)
+            except ChildProcessError:
+                # Already reaped elsewhere, the exit code is unknown
+                return_code = 255
+            else:
+                return_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            # The loop's callback is thread-safe
+            callback(pid, return_code, *args)
+
+
+_watcher_lock = threading.Lock()
+_watcher_installed = False
+
+
+def _install_child_watcher():
+    global _watcher_installed
+    with _watcher_lock:
+        if not _watcher_installed:
+            asyncio.set_child_watcher(_ThreadedChildWatcher())
+            _watcher_installed = True
+
+
+def run_sync(coro):
+    """Run a coroutine in a new event loop, from any thread."""
+    if sys.version_info < (3, 8):
+        _install_child_watcher()
+    loop = asyncio.new_event_loop()
+    # Coroutines ask for the loop of the current thread, other threads have none by default
+    worker = threading.current_thread() is not threading.main_thread()
+    if worker:
+        asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        if worker:
+            asyncio.set_event_loop(None)
+        loop.close()
+
+
+async def check_call(args: List[str]):
+    proc = await asyncio.create_subprocess_exec(*args)
+    return_code = await proc.wait()
+    if return_code:
+        raise subprocess.CalledProcessError(return_code, args)
+
+
+async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, chunk_size: int = 256 * 1024) -> int:
+    """Copy everything from reader to writer, returns the number of bytes copied."""
+    count = 0
+    while True:
+        data = await reader.read(chunk_size)
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+        count += len(data)
+    writer.close()
+    return count
+
+
+def path_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            filename = os.path.join(root, name)
+            if not os.path.islink(filename):
+                size += os.path.getsize(filename)
+    return size
@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
 
-from typing import Dict, Callable, Iterable
+from typing import Dict, Callable, Iterable, Iterator, List, Optional, Tuple, Type, Union
 
 import abc
+import asyncio
+import codecs
+import contextlib
+import fcntl
+import functools
+import hashlib
+import json
 import pty
 import os
 import errno
-import select
+import re
+import selectors
+import shlex
 import subprocess
 import time
 
+from . import _utils
+from . import probes
+from .output import OutputBuffer
+from .. import paths
+from .. import tracing
+
 
 class CompatibilityError(Exception):
     pass
@@ -24,8 +39,16 @@ class NetworkError(Exception):
 
 
 class CommandResult:
-    def __init__(self, exit_code: int, output: str):
+    """Exit code and collected output of a command.
+
+    Large outputs are kept in a temporary file, use head, tail,
+    lines or search to inspect them without decoding all of it.
+    """
+    def __init__(self, exit_code: int, output: Union[str, OutputBuffer] = ''):
         self._exit_code = exit_code
+        if isinstance(output, str):
+            text, output = output, OutputBuffer()
+            output.append(text)
         self._output = output
 
     @property
@@ -34,14 +57,56 @@ class CommandResult:
 
     @property
     def output(self) -> str:
-        return self._output
+        return self._output.text()
+
+    @property
+    def output_size(self) -> int:
+        """Size of the encoded output in bytes."""
+        return self._output.size
+
+    def head(self, count: int = 10) -> List[str]:
+        return self._output.head(count)
+
+    def tail(self, count: int = 10) -> List[str]:
+        return self._output.tail(count)
+
+    def lines(self) -> Iterator[str]:
+        return self._output.lines()
+
+    def search(self, pattern: str, flags: int = 0) -> Iterator[str]:
+        """Lines of the output matching a regular expression."""
+        return self._output.search(pattern, flags)
+
+
+class OutputStream:
+    """Incrementally decodes a raw output stream and dispatches the text.
+
+    Multibyte sequences split across reads are reassembled,
+    not decodable data is replaced instead of dropped.
+    """
+    def __init__(self, callback: Callable=None, output: OutputBuffer=None):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._callback = callback
+        self._output = output
+
+    def feed(self, data: bytes, final: bool = False):
+        decoded = self._decoder.decode(data, final=final)
+        if not decoded:
+            return
+        if self._output is not None:
+            self._output.append(decoded)
+        if self._callback is not None:
+            self._callback(decoded)
 
 
 class BaseCommand(abc.ABC):
+    _min_read_size = 4096
+    _max_read_size = 256 * 1024
+
     def __init__(self, container_name: str, command: str, *args, path: str = None, envvars: Dict[str, str]=None,
-                 stdout: Callable=None, stderr: Callable=None, collect_output: bool = False):
+                 stdout: Callable=None, stderr: Callable=None, collect_output: bool = False, use_pty: bool = True):
         self._exit_code = -1
-        self._output = ''
+        self._output = OutputBuffer()
         self._collect_output = collect_output
         self._container_name = container_name
         self._command = command
@@ -50,6 +115,7 @@ class BaseCommand(abc.ABC):
         self._env = envvars or {}
         self._stdout = stdout
         self._stderr = stderr
+        self._use_pty = use_pty
 
     @abc.abstractmethod
     def _build_command(self) -> str:
@@ -57,74 +123,123 @@ class BaseCommand(abc.ABC):
 
     def run(self):
         cmd = self._build_command()
-        # Adopted from https://stackoverflow.com/a/31953436
-        masters, slaves = zip(pty.openpty(), pty.openpty())
-        proc = subprocess.Popen(
-            cmd, shell=True,
-            stdin=slaves[0], stdout=slaves[0], stderr=slaves[1]
-        )
-        for fd in slaves:
-            # We don't provide any input, thus close
-            os.close(fd)
-        readable = {
-            masters[0]: self._stdout,
-            masters[1]: self._stderr,
+        if self._use_pty:
+            # Adopted from https://stackoverflow.com/a/31953436
+            masters, slaves = zip(pty.openpty(), pty.openpty())
+            proc = subprocess.Popen(
+                cmd, shell=True,
+                stdin=slaves[0], stdout=slaves[0], stderr=slaves[1]
+            )
+            for fd in slaves:
+                # We don't provide any input, thus close
+                os.close(fd)
+            fds = masters
+        else:
+            proc = subprocess.Popen(
+                cmd, shell=True,
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            fds = (proc.stdout.fileno(), proc.stderr.fileno())
+        output = self._output if self._collect_output else None
+        streams = {
+            fds[0]: OutputStream(self._stdout, output),
+            fds[1]: OutputStream(self._stderr, output)
         }
-        while readable:
-            for fd in select.select(readable, [], [])[0]:
-                try:
-                    # Read available data
-                    data = os.read(fd, 1024)
-                except OSError as e:
-                    # EIO means EOF on some systems
-                    if e.errno != errno.EIO:
-                        raise
-                    del readable[fd]
-                else:
-                    # Reached EOF
-                    if not data:
-                        del readable[fd]
-                    else:
-                        try:
-                            decoded = data.decode()
-                            if self._collect_output:
-                                self._output += decoded
-                            f = readable[fd]
-                            if f is not None:
-                                f(decoded)
-                        except UnicodeDecodeError as e:
-                            # Ignore not decodable data with a warning
-                            print('Warning (detected not decodable data): ' + str(e))
+        self._read(streams)
         if proc.returncode:
             raise subprocess.CalledProcessError(proc.returncode, cmd)
-        for fd in masters:
-            os.close(fd)
+        if self._use_pty:
+            for fd in masters:
+                os.close(fd)
+        else:
+            proc.stdout.close()
+            proc.stderr.close()
         self._exit_code = proc.wait()
 
+    async def arun(self):
+        cmd = self._build_command()
+        proc = await asyncio.create_subprocess_shell(
+            cmd,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        output = self._output if self._collect_output else None
+        await asyncio.gather(
+            self._aread(proc.stdout, OutputStream(self._stdout, output)),
+            self._aread(proc.stderr, OutputStream(self._stderr, output))
+        )
+        self._exit_code = await proc.wait()
+
+    async def _aread(self, reader: asyncio.StreamReader, stream: OutputStream):
+        while True:
+            data = await reader.read(self._max_read_size)
+            if not data:
+                break
+            stream.feed(data)
+        stream.feed(b'', final=True)
+
+    def _read(self, streams: Dict[int, OutputStream]):
+        read_sizes = dict.fromkeys(streams, self._min_read_size)
+        with selectors.DefaultSelector() as selector:
+            for fd in streams:
+                selector.register(fd, selectors.EVENT_READ)
+            while selector.get_map():
+                for key, _ in selector.select():
+                    fd = key.fd
+                    size = read_sizes[fd]
+                    try:
+                        # Read available data
+                        data = os.read(fd, size)
+                    except OSError as e:
+                        # EIO means EOF on some systems
+                        if e.errno != errno.EIO:
+                            raise
+                        data = b''
+                    if not data:
+                        # Reached EOF
+                        selector.unregister(fd)
+                        streams[fd].feed(b'', final=True)
+                        continue
+                    # Adapt the read size to the output rate
+                    if len(data) == size:
+                        read_sizes[fd] = min(size * 2, self._max_read_size)
+                    elif len(data) < size // 4:
+                        read_sizes[fd] = max(size // 2, self._min_read_size)
+                    streams[fd].feed(data)
+
     @property
     def exit_code(self) -> int:
         return self._exit_code
 
     @property
     def output(self) -> str:
-        return self._output
+        return self._output.text()
 
     @property
     def result(self) -> CommandResult:
-        result = CommandResult(self._exit_code, self.output)
+        result = CommandResult(self._exit_code, self._output)
         return result
 
 
 class BaseBackend(metaclass=abc.ABCMeta):
+    _command_class = None  # type: Type[BaseCommand]
+
     def __init__(self, container, options: Dict=None):
         self._container = container
         self._ready = False
+        self._session = None
+        self._container_env = None
+        self._network_ready_time = None
+        self._transfer_stats = {
+            'pushed_bytes': 0,
+            'pulled_bytes': 0
+        }
         self._options = options or {}
-        # Apply default options
+        # Apply default options, callables are only evaluated when the option is missing
         default_options = self._default_options
         for def_key in default_options:
             if def_key not in self._options or self._options[def_key] is None:
-                self._options[def_key] = default_options[def_key]
+                default = default_options[def_key]
+                self._options[def_key] = default() if callable(default) else default
 
     @property
     @abc.abstractmethod
@@ -148,40 +263,138 @@ class BaseBackend(metaclass=abc.ABCMeta):
 
     @property
     def _default_options(self) -> Dict:
-        return {}
+        # Options every backend understands, backends add their own along with the name and image
+        return {
+            'arch': _utils.debian_architecture,
+            'ephemeral': True,
+            'nesting': False,
+            'session': False,
+            'prepare': True,
+            'mounts': None,
+            'apt_cache': None,
+            'apt_update_ttl': 60,
+            'bulk_transfer': True,
+            'transfer_compression': None,
+            'network_probes': None,
+            'network_timeout': 120
+        }
 
-    def _wait_for_network(self):
+    @tracing.traced('backend.network')
+    async def _wait_for_network(self):
         self.log('Waiting for a network connection ...')
-        connected = False
-        retry_count = 25
-        network_probe = 'import urllib.request; urllib.request.urlopen("{}", timeout=5)' \
-            .format('http://start.ubuntu.com/connectivity-check.html')
-        while not connected:
-            time.sleep(1)
-            try:
-                result = self.exec(
-                    'python3', '-c', "'" + network_probe + "'",
+        start = time.monotonic()
+        deadline = start + self._options['network_timeout']
+        probe_timeout = 10
+        for probe in probes.parse_all(self._options.get('network_probes')):
+            delay = 0.1
+            while True:
+                result = await self.aexec(
+                    'timeout', str(probe_timeout), 'sh', '-c', shlex.quote(probe.script),
                     collect_output=False, log_output=False
                 )
-                connected = result.exit_code == 0
-            except subprocess.CalledProcessError:
-                connected = False
-                retry_count -= 1
-                if retry_count == 0:
-                    raise NetworkError("No network connection")
-        self.log('Network connection established')
+                if result.exit_code == 0:
+                    break
+                if time.monotonic() + delay > deadline:
+                    raise NetworkError('No network connection ({} failed)'.format(probe.description))
+                # Back off exponentially
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5)
+        self._network_ready_time = time.monotonic() - start
+        self.log('Network connection established after {:.2f}s'.format(self._network_ready_time))
 
-    def _envvars(self) -> Dict[str, str]:
-        script = 'import os; print(repr(dict(os.environ)))'
-        result = self.exec(
-            'python3', '-c', "'" + script + "'",
-            expand_envvars=False, collect_output=True, log_output=False
-        )
-        envvars = eval(result.output)
-        return envvars
+    @property
+    def network_ready_time(self) -> Optional[float]:
+        """Seconds spent waiting for the network during initialization."""
+        return self._network_ready_time
+
+    _apt_archives_path = '/var/cache/apt/archives'
+
+    def _mounts(self) -> Dict[str, str]:
+        """Host directories to mount into the container, by container path."""
+        mounts = dict(self._options.get('mounts') or {})
+        apt_cache = self._apt_cache_path()
+        if apt_cache:
+            os.makedirs(apt_cache, exist_ok=True)
+            mounts[self._apt_archives_path] = apt_cache
+        return mounts
+
+    def _apt_cache_path(self) -> Optional[str]:
+        apt_cache = self._options.get('apt_cache')
+        if apt_cache is True:
+            # Packages differ between releases and architectures
+            apt_cache = paths.cache_path('apt', re.sub(r'[^\w.-]', '_', '{}-{}'.format(self.image, self.arch)))
+        return apt_cache or None
+
+    _apt_commands = ('apt', 'apt-get', 'aptitude')
+
+    @contextlib.contextmanager
+    def _apt_lock(self, command: str):
+        """Serialize package management commands in containers sharing the apt cache directory.
+
+        Containers building concurrently share the archives directory,
+        apt-get fails instead of waiting when another one holds its lock.
+        Commands run through a shell are not recognized.
+        """
+        apt_cache = self._apt_cache_path() if os.path.basename(command) in self._apt_commands else None
+        if not apt_cache:
+            yield
+            return
+        # The lock lives outside of the directory, it is mounted into containers
+        key = hashlib.sha256(os.path.realpath(apt_cache).encode()).hexdigest()[:16]
+        with open(os.path.join(paths.cache_path('apt-locks'), key), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def add_mounts(self, mounts: Dict[str, str]):
+        """Mount additional host directories, only effective before init."""
+        self._options['mounts'] = dict(self._options.get('mounts') or {}, **mounts)
+
+    # apt keeps the modification times of the servers on the package lists
+    _apt_update_stamp = '/var/cache/baka/apt-update-stamp'
+
+    async def _apt_update(self):
+        ttl = self._options.get('apt_update_ttl')
+        if ttl:
+            # Skip the update if the package lists were fetched recently
+            check = 'find {} -mmin -{} | grep -q .'.format(self._apt_update_stamp, ttl)
+            result = await self.aexec('sh', '-c', "'" + check + "'", log_output=False)
+            if result.exit_code == 0:
+                self.log('Package lists are up to date')
+                return
+        if (await self.aexec('apt-get', 'update')).exit_code != 0:
+            # Retry once, mirrors are occasionally out of sync
+            assert (await self.aexec('apt-get', 'update')).exit_code == 0
+        stamp = 'mkdir -p {} && touch {}'.format(os.path.dirname(self._apt_update_stamp), self._apt_update_stamp)
+        assert (await self.aexec('sh', '-c', "'" + stamp + "'", log_output=False)).exit_code == 0
+
+    _envvars_script = 'import os, json; print(json.dumps(dict(os.environ)))'
 
-    def _expand_envvars(self, envvars: Dict[str, str]) -> Dict[str, str]:
-        container_env = self._envvars()
+    def _envvars(self) -> Dict[str, str]:
+        # The container environment is captured once and reused
+        # until it is explicitly invalidated.
+        if self._container_env is None:
+            result = self.exec(
+                'python3', '-c', "'" + self._envvars_script + "'",
+                expand_envvars=False, collect_output=True, log_output=False, use_pty=False
+            )
+            self._container_env = json.loads(result.output)
+        return self._container_env
+
+    async def _aenvvars(self) -> Dict[str, str]:
+        if self._container_env is None:
+            result = await self.aexec(
+                'python3', '-c', "'" + self._envvars_script + "'",
+                expand_envvars=False, collect_output=True, log_output=False
+            )
+            self._container_env = json.loads(result.output)
+        return self._container_env
+
+    def invalidate_envvars(self):
+        self._container_env = None
+
+    def _expand_envvars(self, envvars: Dict[str, str], container_env: Dict[str, str]=None) -> Dict[str, str]:
+        if container_env is None:
+            container_env = self._envvars()
         # Expand a copy of the received dictionary
         # to avoid confusion.
         envvars = envvars.copy()
@@ -207,23 +420,290 @@ class BaseBackend(metaclass=abc.ABCMeta):
     def log(self, *fragments):
         self._container.log(*fragments)
 
-    @abc.abstractmethod
+    def _output_log(self) -> Callable:
+        # Bind the log prefix and channel of the calling thread, output
+        # callbacks may be invoked from other threads.
+        prefix = self._container.log_prefix
+        channel = self._container.log_channel
+
+        def log(text: str):
+            self._container.log_output(text, prefix=prefix, channel=channel)
+        return log
+
     def init(self):
+        _utils.run_sync(self.ainit())
+
+    @abc.abstractmethod
+    async def ainit(self):
         raise NotImplementedError()
 
     @abc.abstractmethod
     def destroy(self):
         raise NotImplementedError()
 
-    @abc.abstractmethod
     def exec(self, command, *args, path: str = None, envvars: Dict[str, str]=None,
-             expand_envvars: bool = True, collect_output: bool = False, log_output: bool = True) -> CommandResult:
+             expand_envvars: bool = True, collect_output: bool = False, log_output: bool = True,
+             use_pty: bool = True) -> CommandResult:
+        if expand_envvars and envvars:
+            envvars = self._expand_envvars(envvars)
+        stdout = self._output_log() if log_output else None
+        stderr = stdout
+        tracing.count('exec')
+        with self._apt_lock(command), tracing.span('exec', 'exec', command=command) as span:
+            if self._session is not None:
+                result = self._session.exec(
+                    ' '.join((command,) + args), path=path,
+                    envvars=self._session_envvars(path, envvars),
+                    stdout=stdout, stderr=stderr,
+                    collect_output=collect_output
+                )
+            else:
+                cmd = self._new_command(
+                    command, *args,
+                    path=path, envvars=envvars,
+                    stdout=stdout, stderr=stderr,
+                    collect_output=collect_output,
+                    use_pty=use_pty
+                )
+                cmd.run()
+                result = cmd.result
+            span.args['exit_code'] = result.exit_code
+        return result
+
+    async def aexec(self, command, *args, path: str = None, envvars: Dict[str, str]=None,
+                    expand_envvars: bool = True, collect_output: bool = False, log_output: bool = True,
+                    stdout: Callable=None, stderr: Callable=None) -> CommandResult:
+        """Asynchronously execute a command inside the container.
+
+        Output is streamed to the given stdout/stderr callbacks,
+        which default to the log if log_output is set.
+        """
+        if expand_envvars and envvars:
+            envvars = self._expand_envvars(envvars, await self._aenvvars())
+        if log_output:
+            stdout = stdout or self._output_log()
+            stderr = stderr or self._output_log()
+        tracing.count('exec')
+        with self._apt_lock(command), tracing.span('exec', 'exec', command=command) as span:
+            if self._session is not None:
+                loop = asyncio.get_event_loop()
+                result = await loop.run_in_executor(None, functools.partial(
+                    self._session.exec,
+                    ' '.join((command,) + args), path=path,
+                    envvars=self._session_envvars(path, envvars),
+                    stdout=stdout, stderr=stderr,
+                    collect_output=collect_output
+                ))
+            else:
+                cmd = self._new_command(
+                    command, *args,
+                    path=path, envvars=envvars,
+                    stdout=stdout, stderr=stderr,
+                    collect_output=collect_output
+                )
+                await cmd.arun()
+                result = cmd.result
+            span.args['exit_code'] = result.exit_code
+        return result
+
+    def _new_command(self, command: str, *args, **kwargs) -> BaseCommand:
+        return self._command_class(self.name, command, *args, **kwargs)
+
+    def publish(self, image: str) -> int:
+        return _utils.run_sync(self.apublish(image))
+
+    async def apublish(self, image: str) -> int:
+        """Store the current state of the container as a local image, returns the image size in bytes."""
         raise NotImplementedError()
 
-    @abc.abstractmethod
-    def push(self, source: str, dest: str):
+    @staticmethod
+    def delete_image(image: str):
         raise NotImplementedError()
 
+    @staticmethod
+    def snapshot_image(key: str) -> str:
+        """Name of the local image caching the snapshot with the given key."""
+        return 'baka-cache-{}'.format(key)
+
+    # Increase whenever _prepare or the helpers it uses change the prepared container
+    _prepare_version = 1
+
+    @property
+    def prepare_fingerprint(self) -> str:
+        """Identifies the steps used to prepare a fresh container."""
+        data = json.dumps({
+            'backend': type(self).__name__,
+            'version': self._prepare_version,
+            'image': self.image,
+            'arch': self.arch,
+            'prepare': bool(self._options.get('prepare')),
+            # Packages are kept in the container without the shared apt cache
+            'apt_cache': bool(self._options.get('apt_cache'))
+        }, sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _exec_argv(self) -> List[str]:
+        """Command line prefix to run a program inside the container with stdin attached."""
+        raise NotImplementedError()
+
+    # Whether commands of the backend set HOME to the requested path, sessions have to do the same
+    _path_is_home = False
+
+    def _session_envvars(self, path: str, envvars: Dict[str, str]) -> Dict[str, str]:
+        if self._path_is_home and path:
+            home = {'HOME': path}
+            home.update(envvars or {})
+            envvars = home
+        return envvars
+
+    def _open_session(self):
+        if not self._options.get('session'):
+            return
+        from .session import ExecSession
+        self.log('Opening exec session ...')
+        self._session = ExecSession(self._exec_argv())
+        self._session.open()
+
+    async def _aopen_session(self):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._open_session)
+
+    def _close_session(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    @property
+    def transfer_stats(self) -> Dict[str, int]:
+        return self._transfer_stats
+
+    def push(self, source: str, dest: str):
+        _utils.run_sync(self.apush(source, dest))
+
+    async def apush(self, source: str, dest: str):
+        pushed_bytes = self._transfer_stats['pushed_bytes']
+        with tracing.span('push', 'transfer', source=source) as span:
+            if self._options['bulk_transfer'] and os.path.isdir(source):
+                await self._apush_tar(source, dest)
+            else:
+                await self._apush_files(source, dest)
+                self._transfer_stats['pushed_bytes'] += _utils.path_size(source)
+            span.args['bytes'] = self._transfer_stats['pushed_bytes'] - pushed_bytes
+        tracing.count('pushed_bytes', span.args['bytes'])
+
     @abc.abstractmethod
+    async def _apush_files(self, source: str, dest: str):
+        raise NotImplementedError()
+
     def pull(self, source: str, dest: str):
+        _utils.run_sync(self.apull(source, dest))
+
+    async def apull(self, source: str, dest: str):
+        pulled_bytes = self._transfer_stats['pulled_bytes']
+        with tracing.span('pull', 'transfer', source=source) as span:
+            if self._options['bulk_transfer'] and os.path.isdir(dest):
+                await self._apull_tar(source, dest)
+            else:
+                await self._apull_files(source, dest)
+                self._transfer_stats['pulled_bytes'] += _utils.path_size(
+                    os.path.join(dest, os.path.basename(source)) if os.path.isdir(dest) else dest
+                )
+            span.args['bytes'] = self._transfer_stats['pulled_bytes'] - pulled_bytes
+        tracing.count('pulled_bytes', span.args['bytes'])
+
+    @abc.abstractmethod
+    async def _apull_files(self, source: str, dest: str):
         raise NotImplementedError()
+
+    def _tar_options(self) -> List[str]:
+        return ['-z'] if self._options.get('transfer_compression') == 'gz' else []
+
+    async def _apush_tar(self, source: str, dest: str):
+        # Stream a tar archive into a single exec channel
+        source = os.path.normpath(source)
+        self._transfer_stats['pushed_bytes'] += await self._atransfer_tar(
+            ['tar', '-c', *self._tar_options(), '-C', os.path.dirname(source), os.path.basename(source)],
+            [*self._exec_argv(), 'sh', '-c', 'mkdir -p "$0" && exec tar -x --no-same-owner {} -C "$0"'.format(
+                ' '.join(self._tar_options())
+            ), dest]
+        )
+
+    async def _apull_tar(self, source: str, dest: str):
+        source = os.path.normpath(source)
+        self._transfer_stats['pulled_bytes'] += await self._atransfer_tar(
+            [*self._exec_argv(), 'tar', '-c', *self._tar_options(),
+             '-C', os.path.dirname(source), os.path.basename(source)],
+            ['tar', '-x', '--no-same-owner', *self._tar_options(), '-C', dest]
+        )
+
+    @staticmethod
+    async def _atransfer_tar(tar_argv: List[str], untar_argv: List[str]) -> int:
+        """Pipe an archive from one tar process into another, returns the number of bytes transferred."""
+        processes = []
+        try:
+            tar = await asyncio.create_subprocess_exec(*tar_argv, stdout=subprocess.PIPE)
+            processes.append(tar)
+            untar = await asyncio.create_subprocess_exec(*untar_argv, stdin=subprocess.PIPE)
+            processes.append(untar)
+            try:
+                count = await _utils.pipe(tar.stdout, untar.stdin)
+            except ConnectionError:
+                # The extracting end exited early, its exit code tells why
+                return_code = await untar.wait()
+                if return_code:
+                    raise subprocess.CalledProcessError(return_code, 'tar -x')
+                raise
+            for proc, argv in ((tar, 'tar -c'), (untar, 'tar -x')):
+                return_code = await proc.wait()
+                if return_code:
+                    raise subprocess.CalledProcessError(return_code, argv)
+            return count
+        finally:
+            # Neither end is left running when the transfer fails partway
+            for proc in processes:
+                if proc.returncode is None:
+                    try:
+                        proc.kill()
+                    except ProcessLookupError:
+                        pass
+                # Pipes left open keep wait() from returning
+                if proc.stdin is not None:
+                    proc.stdin.close()
+                if proc.stdout is not None:
+                    await proc.stdout.read()
+                await proc.wait()
+
+    async def _astream_tar(self, source: str, send: Callable[[Iterator[bytes]], object]) -> Tuple[int, object]:
+        """Stream a tar archive of source to a blocking API call, returns the archive size and the call's result."""
+        source = os.path.normpath(source)
+        tar = subprocess.Popen(
+            ['tar', '-c', *self._tar_options(), '-C', os.path.dirname(source), os.path.basename(source)],
+            stdout=subprocess.PIPE
+        )
+        size = 0
+
+        def chunks():
+            nonlocal size
+            while True:
+                data = tar.stdout.read(256 * 1024)
+                if not data:
+                    break
+                size += len(data)
+                yield data
+        try:
+            result = await self._api(send, chunks())
+        except BaseException:
+            # The local end is not left running when the transfer fails partway
+            tar.kill()
+            raise
+        finally:
+            tar.stdout.close()
+            return_code = tar.wait()
+        if return_code:
+            raise subprocess.CalledProcessError(return_code, 'tar -c')
+        return size, result
+
+    async def _api(self, f, *args):
+        # Container API clients block, keep the event loop running
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(f, *args))
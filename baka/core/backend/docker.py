@@ -2,11 +2,15 @@
 
 from typing import Dict, List
 
+import asyncio
+import functools
 import os
 import subprocess
 
 from . import base
+from . import inventory
 from . import _utils
+from .. import tracing
 
 
 class DockerCommand(base.BaseCommand):
@@ -25,7 +29,42 @@ class DockerCommand(base.BaseCommand):
         return ' '.join(cmd)
 
 
+class DockerAPICommand(base.BaseCommand):
+    """Runs a command through the Engine API instead of the docker command line tool."""
+    def __init__(self, client, container_name: str, command: str, *args, **kwargs):
+        super().__init__(container_name, command, *args, **kwargs)
+        self._client = client
+
+    def _build_command(self) -> str:
+        bash_command = self._command + ' ' + ' '.join(self._args)
+        if self._path:
+            bash_command = 'cd {} && {}'.format(self._path, bash_command)
+        return bash_command
+
+    def run(self):
+        self._run(self._use_pty)
+
+    async def arun(self):
+        # Like the command line variant, asynchronous commands have separate output streams
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._run, False)
+
+    def _run(self, tty: bool):
+        output = self._output if self._collect_output else None
+        stdout = base.OutputStream(self._stdout, output)
+        stderr = base.OutputStream(self._stderr, output)
+        exec_id = self._client.exec_create(
+            self._container_name, ['bash', '-c', self._build_command()], self._env, tty=tty
+        )
+        self._client.exec_start(exec_id, tty, stdout.feed, stderr.feed)
+        stdout.feed(b'', final=True)
+        stderr.feed(b'', final=True)
+        self._exit_code = self._client.exec_exit_code(exec_id)
+
+
 class DockerBackend(base.BaseBackend):
+    _command_class = DockerCommand
+
     def __init__(self, container, options: Dict=None):
         super().__init__(container, options)
         self._name = self._options['name']
@@ -51,77 +90,171 @@ class DockerBackend(base.BaseBackend):
     def ephemeral(self) -> bool:
         return self._ephemeral
 
+    @property
+    def _client(self):
+        """Engine API client if enabled, the docker command line tool is used otherwise."""
+        if not self._options.get('engine_api'):
+            return None
+        from . import engine
+        return engine.client(self._options.get('docker_socket'))
+
+    @property
+    def _inventory(self) -> inventory.Inventory:
+        socket_path = None
+        if self._options.get('engine_api'):
+            from . import engine
+            socket_path = self._options.get('docker_socket') or engine.default_socket_path()
+        return inventory.get('docker', socket_path, functools.partial(self._forgiven_names, socket_path))
+
     @property
     def _default_options(self) -> Dict:
-        return {
-            'name': self._gen_name(),
+        options = super()._default_options
+        options.update({
+            'name': self._gen_name,
             'image': 'ubuntu:xenial',
-            'arch': _utils.debian_architecture(),
-            'ephemeral': True,
-            'nesting': False
-        }
+            'engine_api': False,
+            'docker_socket': None
+        })
+        return options
 
-    def init(self):
+    async def ainit(self):
+        self.invalidate_envvars()
         self.log('Checking for container ...')
-        # Find existing containers with the requested name
-        existing = self._name in self._forgiven_names()
         # Create container or use existing one
-        if existing:
+        if self._inventory.exists(self._name):
             self.log('Launching container ...')
         else:
             self.log('Creating and launching container ...')
-            cmd = ['docker', 'create', '-it', '--name', self._name]
-            if self._ephemeral:
-                if 'BAKA_DOCKER_NO_RM_OPTION' not in os.environ:
-                    cmd += ['--rm']
-            cmd += [self._image]
-            subprocess.check_call(cmd)
+            auto_remove = self._ephemeral and 'BAKA_DOCKER_NO_RM_OPTION' not in os.environ
+            binds = ['{}:{}'.format(source, path) for path, source in self._mounts().items()]
+            try:
+                with tracing.span('backend.create', image=self._image):
+                    if self._client:
+                        await self._api(self._client.create_container, self._name, self._image, binds, auto_remove)
+                    else:
+                        cmd = ['docker', 'create', '-it', '--name', self._name]
+                        if auto_remove:
+                            cmd += ['--rm']
+                        for bind in binds:
+                            cmd += ['--volume', bind]
+                        await _utils.check_call(cmd + [self._image])
+            except Exception:
+                self._inventory.discard(self._name)
+                raise
+            self._inventory.add(self._name)
         # Start the container (if not already running)
-        subprocess.check_call(['docker', 'start', self._name])
+        with tracing.span('backend.start'):
+            if self._client:
+                await self._api(self._client.start_container, self._name)
+            else:
+                await _utils.check_call(['docker', 'start', self._name])
         # Enable most actions
         self._ready = True
+        await self._aopen_session()
+        # Check for network connection
+        await self._wait_for_network()
         # Prepare system
-        self._prepare()
+        if self._options['prepare']:
+            with tracing.span('backend.prepare'):
+                await self._prepare()
 
     def destroy(self):
         self.log('Destroying ...')
-        subprocess.check_call(['docker', 'rm', '-f', self._name])
+        self._close_session()
+        self.invalidate_envvars()
+        if self._client:
+            self._client.remove_container(self._name)
+        else:
+            subprocess.check_call(['docker', 'rm', '-f', self._name])
+        self._inventory.discard(self._name)
         self._ready = False
 
-    def exec(self, command, *args, path: str = None, envvars: Dict[str, str]=None,
-             expand_envvars: bool = True, collect_output: bool = False, log_output: bool = True) -> base.CommandResult:
-        if expand_envvars and envvars:
-            envvars = self._expand_envvars(envvars)
-        stdout = self.log if log_output else None
-        stderr = self.log if log_output else None
-        cmd = DockerCommand(
-            self._name, command, *args,
-            path=path, envvars=envvars,
-            stdout=stdout, stderr=stderr,
-            collect_output=collect_output
-        )
-        cmd.run()
-        return cmd.result
-
-    def log(self, *fragments):
-        print(*fragments, end='' if fragments[-1].endswith('\n') else '\n')
-
-    def push(self, source: str, dest: str):
+    async def _apush_files(self, source: str, dest: str):
+        if self._client:
+            await self._apush_archive(source, dest)
+            return
         dest = dest.lstrip('/')
-        subprocess.check_call(['docker', 'cp', source, self._name + ':/' + dest])
+        await _utils.check_call(['docker', 'cp', source, self._name + ':/' + dest])
 
-    def pull(self, source: str, dest: str):
+    async def _apull_files(self, source: str, dest: str):
+        if self._client:
+            await self._apull_archive(source, dest)
+            return
         source = source.lstrip('/')
-        subprocess.check_call(['docker', 'cp', self._name + ':/' + source, dest])
+        await _utils.check_call(['docker', 'cp', self._name + ':/' + source, dest])
+
+    async def _apush_tar(self, source: str, dest: str):
+        if self._client:
+            self._transfer_stats['pushed_bytes'] += await self._apush_archive(source, dest)
+        else:
+            await super()._apush_tar(source, dest)
+
+    async def _apull_tar(self, source: str, dest: str):
+        if self._client:
+            self._transfer_stats['pulled_bytes'] += await self._apull_archive(source, dest)
+        else:
+            await super()._apull_tar(source, dest)
+
+    async def _apush_archive(self, source: str, dest: str) -> int:
+        # Archives are extracted into existing directories only
+        if not await self._api(self._client.archive_exists, self._name, dest):
+            assert (await self.aexec('mkdir', '-p', dest, log_output=False)).exit_code == 0
+        # The archive endpoint accepts compressed archives as well
+        size, _ = await self._astream_tar(source, functools.partial(self._client.put_archive, self._name, dest))
+        return size
+
+    async def _apull_archive(self, source: str, dest: str) -> int:
+        source = os.path.normpath(source)
+        if os.path.isdir(dest):
+            untar = subprocess.Popen(['tar', '-x', '--no-same-owner', '-C', dest], stdin=subprocess.PIPE)
+        else:
+            # Extract the single file to its new name
+            with open(dest, 'wb') as file:
+                untar = subprocess.Popen(['tar', '-x', '-O', os.path.basename(source)],
+                                         stdin=subprocess.PIPE, stdout=file)
+        try:
+            size = await self._api(self._client.get_archive, self._name, source, untar.stdin)
+        finally:
+            untar.stdin.close()
+            return_code = untar.wait()
+        if return_code:
+            raise subprocess.CalledProcessError(return_code, 'tar -x')
+        return size
 
-    def _prepare(self):
+    def _new_command(self, command: str, *args, **kwargs) -> base.BaseCommand:
+        if self._client:
+            return DockerAPICommand(self._client, self.name, command, *args, **kwargs)
+        return super()._new_command(command, *args, **kwargs)
+
+    async def apublish(self, image: str) -> int:
+        if self._client:
+            await self._api(self._client.commit, self._name, image)
+            return await self._api(self._client.image_size, image)
+        await _utils.check_call(['docker', 'commit', self._name, image])
+        size = subprocess.check_output(['docker', 'image', 'inspect', '-f', '{{.Size}}', image])
+        return int(size.decode().strip())
+
+    @staticmethod
+    def delete_image(image: str):
+        subprocess.check_call(['docker', 'rmi', image])
+
+    @staticmethod
+    def snapshot_image(key: str) -> str:
+        return 'baka-cache:{}'.format(key)
+
+    def _exec_argv(self) -> List[str]:
+        return ['docker', 'exec', '-i', self._name]
+
+    async def _prepare(self):
         self.log('Preparing system ...')
-        assert self.exec('mkdir', '-p', '/home/baka').exit_code == 0
+        assert (await self.aexec('mkdir', '-p', '/home/baka')).exit_code == 0
+        if self._apt_archives_path in self._mounts():
+            # Docker images delete downloaded packages after installation
+            assert (await self.aexec('rm', '-f', '/etc/apt/apt.conf.d/docker-clean')).exit_code == 0
         self.log('Updating and upgrading system ...')
-        assert self.exec('apt-get', 'update').exit_code == 0
-        assert self.exec('apt-get', 'update').exit_code == 0
+        await self._apt_update()
         # Make sure add-apt-repository and others are available
-        assert self.exec('apt-get', 'install', '-y', 'software-properties-common').exit_code == 0
+        assert (await self.aexec('apt-get', 'install', '-y', 'software-properties-common')).exit_code == 0
 
     @staticmethod
     def _existing_containers() -> List[Dict[str, str]]:
@@ -139,17 +272,14 @@ class DockerBackend(base.BaseBackend):
             })
         return containers
 
-    def _forgiven_names(self) -> List[str]:
-        names = []
-        for container in self._existing_containers():
-            names.append(container['name'])
-        return names
-
-    def _gen_name(self):
-        no = 0
-        forgiven = self._forgiven_names()
-        name = 'baka-whale-0'
-        while name in forgiven:
-            name = 'baka-whale-' + str(no)
-            no += 1
-        return name
+    @classmethod
+    def _forgiven_names(cls, socket_path: str = None) -> List[str]:
+        if socket_path:
+            from . import engine
+            # Container names are reported with a leading slash
+            containers = engine.client(socket_path).containers()
+            return [name.lstrip('/') for container in containers for name in container['Names']]
+        return [container['name'] for container in cls._existing_containers()]
+
+    def _gen_name(self) -> str:
+        return self._inventory.generate_name('baka-whale')
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Callable, Dict, IO, Iterable, List
+
+import contextlib
+import http.client
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import urllib.parse
+
+
+class EngineError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__('Docker Engine API error {}: {}'.format(status, message))
+        self.status = status
+        self.message = message
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str):
+        super().__init__('localhost')
+        self._socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._socket_path)
+        self.sock = sock
+
+
+# A reused connection may have been closed by the server while it was idle
+_stale_errors = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class EngineClient:
+    """Minimal client of the Docker Engine API on a unix socket.
+
+    Connections are kept alive and reused, a command costs a few
+    requests instead of starting the docker command line tool.
+    """
+    api_version = 'v1.25'
+    _chunk_size = 256 * 1024
+
+    def __init__(self, socket_path: str = None, pool_size: int = 4):
+        self._socket_path = socket_path or default_socket_path()
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._connections = 0
+
+    @property
+    def socket_path(self) -> str:
+        return self._socket_path
+
+    @property
+    def connections(self) -> int:
+        """Number of connections opened so far."""
+        return self._connections
+
+    def call(self, method: str, path: str, params: Dict=None, body: Any=None) -> Any:
+        """Send a request and return the decoded JSON response, if any."""
+        with self.stream(method, path, params, body) as response:
+            data = response.read()
+        if data and response.getheader('Content-Type', '').startswith('application/json'):
+            return json.loads(data.decode())
+        return data
+
+    @contextlib.contextmanager
+    def stream(self, method: str, path: str, params: Dict=None, body: Any=None, headers: Dict[str, str]=None):
+        """Send a request and yield the response for reading.
+
+        The body can be JSON data, bytes or an iterable of bytes which is sent chunked.
+        """
+        connection, response = self._request(method, path, params, body, headers)
+        if response.status >= 400:
+            message = self._error_message(response.read())
+            self._release(connection)
+            raise EngineError(response.status, message)
+        try:
+            yield response
+        except BaseException:
+            connection.close()
+            raise
+        if response.isclosed():
+            self._release(connection)
+        else:
+            # The response was not read completely
+            connection.close()
+
+    def containers(self) -> List[Dict]:
+        return self.call('GET', '/containers/json', {'all': 1})
+
+    def create_container(self, name: str, image: str, binds: List[str]=None, auto_remove: bool = False):
+        body = {
+            'Image': image,
+            'Tty': True,
+            'OpenStdin': True,
+            'HostConfig': {'Binds': binds or [], 'AutoRemove': auto_remove}
+        }
+        try:
+            self.call('POST', '/containers/create', {'name': name}, body)
+        except EngineError as e:
+            # Unlike the command line tool the API does not pull missing images
+            if e.status != 404:
+                raise
+            self.pull_image(image)
+            self.call('POST', '/containers/create', {'name': name}, body)
+
+    def start_container(self, name: str):
+        self.call('POST', '/containers/{}/start'.format(name))
+
+    def remove_container(self, name: str):
+        self.call('DELETE', '/containers/{}'.format(name), {'force': 1})
+
+    def pull_image(self, image: str):
+        repository, tag = split_image(image)
+        with self.stream('POST', '/images/create', {'fromImage': repository, 'tag': tag}) as response:
+            # Progress is reported as a stream of JSON objects, errors included
+            for line in response:
+                message = json.loads(line.decode()) if line.strip() else {}
+                if 'error' in message:
+                    raise EngineError(response.status, message['error'])
+
+    def commit(self, container: str, image: str):
+        repository, tag = split_image(image)
+        self.call('POST', '/commit', {'container': container, 'repo': repository, 'tag': tag})
+
+    def image_size(self, image: str) -> int:
+        return self.call('GET', '/images/{}/json'.format(image))['Size']
+
+    def exec_create(self, container: str, cmd: List[str], envvars: Dict[str, str]=None, tty: bool = False) -> str:
+        return self.call('POST', '/containers/{}/exec'.format(container), body={
+            'AttachStdin': False,
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Tty': tty,
+            'Cmd': cmd,
+            'Env': ['{}={}'.format(key, value) for key, value in (envvars or {}).items()]
+        })['Id']
+
+    def exec_start(self, exec_id: str, tty: bool = False, stdout: Callable=None, stderr: Callable=None):
+        """Start an exec instance and pass its output to the callbacks until it exits."""
+        # The connection is hijacked for the output stream and can not be reused
+        connection, response = self._request(
+            'POST', '/exec/{}/start'.format(exec_id), body={'Detach': False, 'Tty': tty},
+            headers={'Connection': 'Upgrade', 'Upgrade': 'tcp'}, reuse=False
+        )
+        try:
+            if response.status >= 400:
+                raise EngineError(response.status, self._error_message(response.read()))
+            if tty:
+                self._read_raw(response.fp, stdout)
+            else:
+                self._read_multiplexed(response.fp, stdout, stderr)
+        finally:
+            response.close()
+            connection.close()
+
+    def exec_exit_code(self, exec_id: str) -> int:
+        return self.call('GET', '/exec/{}/json'.format(exec_id))['ExitCode']
+
+    def archive_exists(self, container: str, path: str) -> bool:
+        try:
+            self.call('HEAD', '/containers/{}/archive'.format(container), {'path': path})
+        except EngineError as e:
+            if e.status == 404:
+                return False
+            raise
+        return True
+
+    def put_archive(self, container: str, path: str, chunks: Iterable[bytes]):
+        """Extract a tar archive into the directory path inside the container."""
+        self.call('PUT', '/containers/{}/archive'.format(container), {'path': path}, chunks)
+
+    def get_archive(self, container: str, path: str, fileobj: IO[bytes]) -> int:
+        """Write a tar archive of path inside the container to fileobj, returns its size."""
+        size = 0
+        with self.stream('GET', '/containers/{}/archive'.format(container), {'path': path}) as response:
+            while True:
+                data = response.read(self._chunk_size)
+                if not data:
+                    break
+                fileobj.write(data)
+                size += len(data)
+        return size
+
+    def _request(self, method: str, path: str, params: Dict=None, body: Any=None,
+                 headers: Dict[str, str]=None, reuse: bool = True):
+        url = '/{}{}'.format(self.api_version, path)
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        headers = dict(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif body is not None and not isinstance(body, bytes):
+            headers['Content-Type'] = 'application/x-tar'
+            # Python < 3.6 does not encode iterable bodies in chunks itself
+            headers['Transfer-Encoding'] = 'chunked'
+            body = _chunked(body)
+        connection, reused = self._acquire(reuse)
+        try:
+            connection.request(method, url, body=body, headers=headers)
+            return connection, connection.getresponse()
+        except _stale_errors:
+            connection.close()
+            # Only retry requests whose body has not been consumed
+            if not reused or not (body is None or isinstance(body, bytes)):
+                raise
+        connection, _ = self._acquire(reuse=False)
+        connection.request(method, url, body=body, headers=headers)
+        return connection, connection.getresponse()
+
+    def _acquire(self, reuse: bool = True):
+        if reuse:
+            try:
+                return self._idle.get_nowait(), True
+            except queue.Empty:
+                pass
+        self._connections += 1
+        return _UnixConnection(self._socket_path), False
+
+    def _release(self, connection: _UnixConnection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _read_raw(self, fp: IO[bytes], stdout: Callable):
+        while True:
+            data = fp.read1(self._chunk_size)
+            if not data:
+                break
+            if stdout is not None:
+                stdout(data)
+
+    @staticmethod
+    def _read_multiplexed(fp: IO[bytes], stdout: Callable, stderr: Callable):
+        # Frames start with a header of the stream type and the payload size
+        while True:
+            header = fp.read(8)
+            if len(header) < 8:
+                break
+            stream_type, size = struct.unpack('>BxxxL', header)
+            data = fp.read(size)
+            callback = stderr if stream_type == 2 else stdout
+            if callback is not None:
+                callback(data)
+
+    @staticmethod
+    def _error_message(data: bytes) -> str:
+        try:
+            return json.loads(data.decode())['message']
+        except (ValueError, KeyError, TypeError):
+            return data.decode(errors='replace').strip()
+
+
+def _chunked(chunks: Iterable[bytes]) -> Iterable[bytes]:
+    for chunk in chunks:
+        if chunk:
+            yield '{:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n'
+    yield b'0\r\n\r\n'
+
+
+def split_image(image: str):
+    """Repository and tag of an image name."""
+    repository, _, tag = image.rpartition(':')
+    if not repository or '/' in tag:
+        return image, 'latest'
+    return repository, tag
+
+
+def default_socket_path() -> str:
+    host = os.environ.get('DOCKER_HOST', '')
+    if host.startswith('unix://'):
+        return host[len('unix://'):]
+    return '/var/run/docker.sock'
+
+
+_clients = {}  # type: Dict[str, EngineClient]
+_clients_lock = threading.Lock()
+
+
+def client(socket_path: str = None) -> EngineClient:
+    """Client shared by all containers using the socket."""
+    socket_path = socket_path or default_socket_path()
+    with _clients_lock:
+        if socket_path not in _clients:
+            _clients[socket_path] = EngineClient(socket_path)
+        return _clients[socket_path]
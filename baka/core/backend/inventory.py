@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from typing import Callable, Dict, Iterable, Set, Tuple
+
+import threading
+import time
+
+
+class Inventory:
+    """Cached list of the container names known to a backend.
+
+    The names are listed once and reused until ttl seconds have passed.
+    Changes made by this process (created and destroyed containers) are
+    applied to the cached names, so there is no need to list again.
+    """
+    def __init__(self, list_names: Callable[[], Iterable[str]], ttl: float = 5):
+        self._list_names = list_names
+        self._ttl = ttl
+        self._names = None  # type: Set[str]
+        self._listed_at = 0
+        self._reserved = set()  # type: Set[str]
+        self._lock = threading.Lock()
+
+    def names(self) -> Set[str]:
+        with self._lock:
+            return set(self._current())
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            return name in self._current()
+
+    def generate_name(self, prefix: str) -> str:
+        """Returns the first free name "<prefix>-<number>".
+
+        The name is reserved, so concurrent calls never hand out the same name.
+        """
+        with self._lock:
+            taken = self._current() | self._reserved
+            no = 0
+            while '{}-{}'.format(prefix, no) in taken:
+                no += 1
+            name = '{}-{}'.format(prefix, no)
+            self._reserved.add(name)
+            return name
+
+    def add(self, name: str):
+        with self._lock:
+            if self._names is not None:
+                self._names.add(name)
+            self._reserved.discard(name)
+
+    def discard(self, name: str):
+        with self._lock:
+            if self._names is not None:
+                self._names.discard(name)
+            self._reserved.discard(name)
+
+    def invalidate(self):
+        with self._lock:
+            self._names = None
+
+    def _current(self) -> Set[str]:
+        if self._names is None or time.monotonic() - self._listed_at > self._ttl:
+            self._names = set(self._list_names())
+            self._listed_at = time.monotonic()
+        return self._names
+
+
+_inventories = {}  # type: Dict[Tuple[str, str], Inventory]
+_inventories_lock = threading.Lock()
+
+
+def get(backend_type: str, location: str, list_names: Callable[[], Iterable[str]]) -> Inventory:
+    """Returns the inventory shared by all backends of the given type using the same location.
+
+    The location tells apart container hosts, e.g. an endpoint, a socket or a root directory.
+    list_names is kept as long as the inventory, it should not refer to a backend.
+    """
+    key = (backend_type, location or '')
+    with _inventories_lock:
+        if key not in _inventories:
+            _inventories[key] = Inventory(list_names)
+        return _inventories[key]
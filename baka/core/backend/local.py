@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List
+
+import functools
+import os
+import re
+import shutil
+import tempfile
+
+from . import base
+from . import inventory
+from . import _utils
+from .. import paths
+from .. import tracing
+
+
+# Container paths used by baka, they are moved below the root of the local container
+_container_paths = re.compile(r'(?<![\w/])(/home/baka|/var/cache/baka)(?=/|\W|$)')
+
+
+class LocalCommand(base.BaseCommand):
+    def _build_command(self) -> str:
+        cmd = []
+        if self._path:
+            cmd += ['cd', self._path, '&&', 'env', 'HOME={}'.format(self._path)]
+        elif self._env:
+            cmd += ['env']
+        for env_var in self._env.keys():
+            val = self._env[env_var]
+            cmd += ['{}={}'.format(env_var, val)]
+        cmd += [self._command] + self._args
+        return ' '.join(cmd)
+
+
+class LocalBackend(base.BaseBackend):
+    """Runs commands as host processes inside a temporary directory tree.
+
+    There is no isolation, paths like /home/baka are moved below the root
+    directory of the container. Meant for tests and benchmarks of baka itself.
+    """
+    _command_class = LocalCommand
+    _path_is_home = True
+
+    def __init__(self, container, options: Dict=None):
+        super().__init__(container, options)
+        self._name = self._options['name']
+        self._image = self._options['image']
+        self._arch = self._options['arch']
+        self._ephemeral = self._options['ephemeral']
+        self._root = os.path.join(self._options['root'], self._name)
+        if self._options['nesting']:
+            raise base.CompatibilityError('Nesting is not supported by local containers.')
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def image(self) -> str:
+        return self._image
+
+    @property
+    def arch(self) -> str:
+        return self._arch
+
+    @property
+    def ephemeral(self) -> bool:
+        return self._ephemeral
+
+    @property
+    def root(self) -> str:
+        return self._root
+
+    @property
+    def _inventory(self) -> inventory.Inventory:
+        root = self._options.get('root') or self._default_root()
+        return inventory.get('local', root, functools.partial(self._forgiven_names, root))
+
+    @property
+    def _default_options(self) -> Dict:
+        options = super()._default_options
+        options.update({
+            'name': self._gen_name,
+            'image': 'host',
+            'root': self._default_root
+        })
+        return options
+
+    async def ainit(self):
+        self.invalidate_envvars()
+        self.log('Checking for container ...')
+        if os.path.isdir(self._root):
+            self.log('Launching container ...')
+        else:
+            self.log('Creating and launching container ...')
+            with tracing.span('backend.create', image=self._image):
+                image_path = self._image_path(self._image)
+                if os.path.isdir(image_path):
+                    shutil.copytree(image_path, self._root, symlinks=True)
+                else:
+                    os.makedirs(self._root)
+            self._inventory.add(self._name)
+        # Mount host directories
+        for path, source in self._mounts().items():
+            target = self.host_path(path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.islink(target):
+                os.remove(target)
+            if not os.path.exists(target):
+                os.symlink(source, target)
+        # Enable most actions
+        self._ready = True
+        await self._aopen_session()
+        # Prepare system
+        if self._options['prepare']:
+            with tracing.span('backend.prepare'):
+                await self._prepare()
+
+    def destroy(self):
+        self.log('Destroying ...')
+        self._close_session()
+        self.invalidate_envvars()
+        shutil.rmtree(self._root, ignore_errors=True)
+        self._inventory.discard(self._name)
+        self._ready = False
+
+    def host_path(self, path: str) -> str:
+        """The host path of a path inside the container."""
+        return os.path.join(self._root, os.path.normpath(path).lstrip('/'))
+
+    def exec(self, command, *args, path: str = None, envvars: Dict[str, str]=None, **kwargs) -> base.CommandResult:
+        command, args, path, envvars = self._rewrite(command, args, path, envvars)
+        return super().exec(command, *args, path=path, envvars=envvars, **kwargs)
+
+    async def aexec(self, command, *args, path: str = None, envvars: Dict[str, str]=None,
+                    **kwargs) -> base.CommandResult:
+        command, args, path, envvars = self._rewrite(command, args, path, envvars)
+        return await super().aexec(command, *args, path=path, envvars=envvars, **kwargs)
+
+    async def apush(self, source: str, dest: str):
+        await super().apush(source, self.host_path(dest))
+
+    async def apull(self, source: str, dest: str):
+        await super().apull(self.host_path(source), dest)
+
+    async def _apush_files(self, source: str, dest: str):
+        self._copy(source, dest)
+
+    async def _apull_files(self, source: str, dest: str):
+        self._copy(source, dest)
+
+    async def apublish(self, image: str) -> int:
+        image_path = self._image_path(image)
+        shutil.rmtree(image_path, ignore_errors=True)
+        shutil.copytree(self._root, image_path, symlinks=True)
+        return _utils.path_size(image_path)
+
+    @staticmethod
+    def delete_image(image: str):
+        shutil.rmtree(LocalBackend._image_path(image))
+
+    @staticmethod
+    def _image_path(image: str) -> str:
+        return os.path.join(paths.cache_path('local', 'images'), re.sub(r'[^\w.-]', '_', image))
+
+    def _exec_argv(self) -> List[str]:
+        return []
+
+    async def _prepare(self):
+        self.log('Preparing system ...')
+        assert (await self.aexec('mkdir', '-p', '/home/baka')).exit_code == 0
+
+    def _rewrite(self, command: str, args, path: str, envvars: Dict[str, str]):
+        def rewrite(value: str) -> str:
+            return _container_paths.sub(lambda match: self._root + match.group(0), value)
+        if envvars:
+            envvars = {key: rewrite(value) for key, value in envvars.items()}
+        return (
+            rewrite(command), tuple(rewrite(arg) for arg in args),
+            self.host_path(path) if path else path, envvars
+        )
+
+    @staticmethod
+    def _copy(source: str, dest: str):
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(os.path.normpath(source)))
+        else:
+            os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+        if os.path.isdir(source):
+            shutil.copytree(source, dest, symlinks=True)
+        else:
+            shutil.copy2(source, dest)
+
+    @staticmethod
+    def _default_root() -> str:
+        return os.path.join(tempfile.gettempdir(), 'baka-local')
+
+    @staticmethod
+    def _forgiven_names(root: str) -> List[str]:
+        return os.listdir(root) if os.path.isdir(root) else []
+
+    def _gen_name(self) -> str:
+        return self._inventory.generate_name('baka-local')
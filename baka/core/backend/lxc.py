@@ -2,11 +2,19 @@
 
 from typing import Dict, List
 
+import asyncio
+import functools
+import os
+import re
+import stat
 import subprocess
 import pylxd
 
 from . import base
+from . import inventory
+from . import rest
 from . import _utils
+from .. import tracing
 
 
 class LXCCommand(base.BaseCommand):
@@ -21,11 +29,49 @@ class LXCCommand(base.BaseCommand):
         return ' '.join(cmd)
 
 
+class LXDAPICommand(base.BaseCommand):
+    """Runs a command through the LXD API instead of the lxc command line tool.
+
+    The command line is interpreted by a shell inside the container.
+    """
+    def __init__(self, client: pylxd.Client, container_name: str, command: str, *args, **kwargs):
+        super().__init__(container_name, command, *args, **kwargs)
+        self._client = client
+
+    def _build_command(self) -> str:
+        return ' '.join([self._command] + self._args)
+
+    def run(self):
+        self._run(self._use_pty)
+
+    async def arun(self):
+        # Like the command line variant, asynchronous commands have separate output streams
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._run, False)
+
+    def _run(self, interactive: bool):
+        output = self._output if self._collect_output else None
+        stdout = base.OutputStream(self._stdout, output)
+        stderr = base.OutputStream(self._stderr, output)
+        envvars = dict(self._env)
+        if self._path:
+            # LXD starts commands in the home directory
+            envvars['HOME'] = self._path
+        self._exit_code = rest.execute(
+            self._client, self._container_name, ['sh', '-c', self._build_command()], envvars,
+            stdout=stdout.feed, stderr=stderr.feed, interactive=interactive
+        )
+        stdout.feed(b'', final=True)
+        stderr.feed(b'', final=True)
+
+
 class LXCBackend(base.BaseBackend):
+    _command_class = LXCCommand
+    _path_is_home = True
+
     def __init__(self, container, options: Dict=None):
-        # Initialize LXD client before base initialization
-        # to support _default_options
-        self._lxd = pylxd.Client()
+        # The LXD client is created on first use, possibly by _default_options
+        self._lxd_client = None
         super().__init__(container, options)
         self._lxd_container = None
         self._name = self._options['name']
@@ -50,110 +96,200 @@ class LXCBackend(base.BaseBackend):
     def ephemeral(self) -> bool:
         return self._ephemeral
 
+    @property
+    def _lxd(self) -> pylxd.Client:
+        if self._lxd_client is None:
+            self._lxd_client = pylxd.Client(endpoint=self._options.get('lxd_endpoint'))
+        return self._lxd_client
+
+    @property
+    def _inventory(self) -> inventory.Inventory:
+        endpoint = self._options.get('lxd_endpoint')
+        return inventory.get('lxc', endpoint, functools.partial(self._forgiven_names, endpoint))
+
     @property
     def _default_options(self) -> Dict:
-        return {
-            'name': self._gen_name(),
+        options = super()._default_options
+        options.update({
+            'name': self._gen_name,
             'image': 'ubuntu:xenial',
-            'arch': _utils.debian_architecture(),
-            'ephemeral': True,
-            'nesting': False
-        }
+            'rest_api': False,
+            'lxd_endpoint': None
+        })
+        return options
 
-    def init(self):
+    async def ainit(self):
+        self.invalidate_envvars()
         self.log('Checking for container ...')
-        # Find existing containers with the requested name
-        existing_containers = self._lxd.containers.all()
-        existing = list(filter(lambda c: c.name == self._name, existing_containers))
         # Create container or use existing one
-        if len(existing) > 0:
+        if self._inventory.exists(self._name):
             self.log('Launching container ...')
-            self._lxd_container = existing[0]
         else:
             self.log('Creating and launching container ...')
             cmd = [
                 'lxc', 'launch',
-                '{}/{}'.format(self._image, self._arch),
+                self._image_source(),
                 self._name
             ]
             if self._ephemeral:
                 cmd += ['-e']
             if self._nesting:
                 cmd += ['-c', 'security.nesting=true']
-            subprocess.check_call(cmd)
-            self._lxd_container = self._lxd.containers.get(self._name)
-        # Configure container
-        subprocess.check_call([
-            'lxc', 'config', 'set', self._name,
-            'environment.SNAPCRAFT_SETUP_CORE', '1'])
-        # Necessary to read asset files with non-ascii characters.
-        subprocess.check_call([
-            'lxc', 'config', 'set', self._name,
-            'environment.LC_ALL', 'C.UTF-8'])
-        # Make host user root inside container
-        subprocess.check_call([
-            'lxc', 'config', 'set', self._name,
-            'raw.idmap', 'both 1000 0'
-        ])
+            try:
+                with tracing.span('backend.create', image=self._image):
+                    await _utils.check_call(cmd)
+            except Exception:
+                self._inventory.discard(self._name)
+                raise
+            self._inventory.add(self._name)
+        self._lxd_container = await self._api(self._lxd.containers.get, self._name)
+        # Configure container, all settings are applied in a single update
+        self._lxd_container.config = dict(self._lxd_container.config, **{
+            'environment.SNAPCRAFT_SETUP_CORE': '1',
+            # Necessary to read asset files with non-ascii characters.
+            'environment.LC_ALL': 'C.UTF-8',
+            # Make host user root inside container
+            'raw.idmap': 'both 1000 0'
+        })
+        # Mount host directories
+        devices = dict(self._lxd_container.devices)
+        for path, source in self._mounts().items():
+            device = 'baka' + re.sub(r'[^\w]', '-', path)
+            devices[device] = {'type': 'disk', 'source': source, 'path': path}
+        self._lxd_container.devices = devices
+        with tracing.span('backend.configure'):
+            await self._api(self._lxd_container.save, True)
         # Start the container (if not already running)
-        self._lxd_container.start()
+        with tracing.span('backend.start'):
+            await self._api(self._lxd_container.start)
         # Enable most actions
         self._ready = True
+        await self._aopen_session()
         # Check for network connection
-        self._wait_for_network()
+        await self._wait_for_network()
         # Prepare system
-        self._prepare()
+        if self._options['prepare']:
+            with tracing.span('backend.prepare'):
+                await self._prepare()
 
     def destroy(self):
         self.log('Destroying ...')
-        subprocess.check_call(['lxc', 'delete', '-f', self._name])
+        self._close_session()
+        self.invalidate_envvars()
+        if self._options['rest_api']:
+            self._delete()
+        else:
+            subprocess.check_call(['lxc', 'delete', '-f', self._name])
+        self._inventory.discard(self._name)
         self._ready = False
 
-    def exec(self, command, *args, path: str = None, envvars: Dict[str, str]=None,
-             expand_envvars: bool = True, collect_output: bool = False, log_output: bool = True) -> base.CommandResult:
-        if expand_envvars and envvars:
-            envvars = self._expand_envvars(envvars)
-        stdout = self.log if log_output else None
-        stderr = self.log if log_output else None
-        cmd = LXCCommand(
-            self._name, command, *args,
-            path=path, envvars=envvars,
-            stdout=stdout, stderr=stderr,
-            collect_output=collect_output
+    async def _apush_files(self, source: str, dest: str):
+        if self._options['rest_api']:
+            # Like lxc file push -r, the source is put into the destination directory
+            target = os.path.join(dest, os.path.basename(os.path.normpath(source)))
+            files = self._lxd_container.files
+            if os.path.isdir(source):
+                await self._api(files.recursive_put, source, target, True)
+            else:
+                with open(source, 'rb') as file:
+                    await self._api(files.put, target, file.read(), stat.S_IMODE(os.stat(source).st_mode))
+            return
+        dest = dest.lstrip('/')
+        await _utils.check_call(['lxc', 'file', 'push', '-r', source, self._name + '/' + dest])
+
+    async def _apull_files(self, source: str, dest: str):
+        if self._options['rest_api']:
+            if os.path.isdir(dest):
+                dest = os.path.join(dest, os.path.basename(os.path.normpath(source)))
+            await self._api(self._lxd_container.files.recursive_get, source, dest)
+            return
+        source = source.lstrip('/')
+        await _utils.check_call(['lxc', 'file', 'pull', '-r', self._name + '/' + source, dest])
+
+    async def _apush_tar(self, source: str, dest: str):
+        if not self._options['rest_api']:
+            await super()._apush_tar(source, dest)
+            return
+        # Stream a tar archive into the input of a single exec operation
+        untar = 'mkdir -p "$0" && exec tar -x --no-same-owner {} -C "$0"'.format(' '.join(self._tar_options()))
+        size, exit_code = await self._astream_tar(source, lambda chunks: rest.execute(
+            self._lxd, self._name, ['sh', '-c', untar, dest], stdin=chunks
+        ))
+        self._transfer_stats['pushed_bytes'] += size
+        if exit_code:
+            raise subprocess.CalledProcessError(exit_code, 'tar -x')
+
+    async def _apull_tar(self, source: str, dest: str):
+        if not self._options['rest_api']:
+            await super()._apull_tar(source, dest)
+            return
+        source = os.path.normpath(source)
+        untar = subprocess.Popen(
+            ['tar', '-x', '--no-same-owner', *self._tar_options(), '-C', dest], stdin=subprocess.PIPE
         )
-        cmd.run()
-        return cmd.result
 
-    def log(self, *fragments):
-        print(*fragments, end='' if fragments[-1].endswith('\n') else '\n')
+        def write(data: bytes):
+            untar.stdin.write(data)
+            self._transfer_stats['pulled_bytes'] += len(data)
+        try:
+            exit_code = await self._api(
+                functools.partial(rest.execute, stdout=write), self._lxd, self._name,
+                ['tar', '-c', *self._tar_options(), '-C', os.path.dirname(source), os.path.basename(source)]
+            )
+        except BaseException:
+            untar.kill()
+            raise
+        finally:
+            untar.stdin.close()
+            untar.wait()
+        for return_code, argv in ((exit_code, 'tar -c'), (untar.wait(), 'tar -x')):
+            if return_code:
+                raise subprocess.CalledProcessError(return_code, argv)
 
-    def push(self, source: str, dest: str):
-        dest = dest.lstrip('/')
-        subprocess.check_call(['lxc', 'file', 'push', '-r', source, self._name + '/' + dest])
+    def _new_command(self, command: str, *args, **kwargs) -> base.BaseCommand:
+        if self._options['rest_api']:
+            return LXDAPICommand(self._lxd, self.name, command, *args, **kwargs)
+        return super()._new_command(command, *args, **kwargs)
 
-    def pull(self, source: str, dest: str):
-        source = source.lstrip('/')
-        subprocess.check_call(['lxc', 'file', 'pull', '-r', self._name + '/' + source, dest])
+    def _delete(self):
+        container = self._lxd_container or self._lxd.containers.get(self._name)
+        if container.status != 'Stopped':
+            container.stop(force=True, wait=True)
+        # Ephemeral containers are deleted when they are stopped
+        if self._lxd.containers.exists(self._name):
+            container.delete(wait=True)
+
+    async def apublish(self, image: str) -> int:
+        snapshot = '{}/baka-publish'.format(self._name)
+        await _utils.check_call(['lxc', 'snapshot', self._name, 'baka-publish'])
+        try:
+            await _utils.check_call(['lxc', 'publish', snapshot, '--alias', image])
+        finally:
+            await _utils.check_call(['lxc', 'delete', snapshot])
+        return self._lxd.images.get_by_alias(image).size
+
+    @staticmethod
+    def delete_image(image: str):
+        subprocess.check_call(['lxc', 'image', 'delete', image])
+
+    def _image_source(self) -> str:
+        # Local images (e.g. cached snapshots) are not looked up by architecture
+        if ':' not in self._image:
+            return self._image
+        return '{}/{}'.format(self._image, self._arch)
 
-    def _prepare(self):
+    def _exec_argv(self) -> List[str]:
+        return ['lxc', 'exec', self._name, '--']
+
+    async def _prepare(self):
         self.log('Preparing system ...')
-        assert self.exec('mkdir', '-p', '/home/baka').exit_code == 0
+        assert (await self.aexec('mkdir', '-p', '/home/baka')).exit_code == 0
         self.log('Updating and upgrading system ...')
-        assert self.exec('apt-get', 'update').exit_code == 0
-        assert self.exec('apt-get', 'update').exit_code == 0
-
-    def _forgiven_names(self) -> List[str]:
-        names = []
-        containers = self._lxd.containers.all()
-        for c in containers:
-            names.append(c.name)
-        return names
-
-    def _gen_name(self):
-        no = 0
-        forgiven = self._forgiven_names()
-        name = 'baka-builder-0'
-        while name in forgiven:
-            name = 'baka-builder-' + str(no)
-            no += 1
-        return name
+        await self._apt_update()
+
+    @staticmethod
+    def _forgiven_names(endpoint: str = None) -> List[str]:
+        return [c.name for c in pylxd.Client(endpoint=endpoint).containers.all()]
+
+    def _gen_name(self) -> str:
+        return self._inventory.generate_name('baka-builder')
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+from typing import Iterator, List, Union
+
+import io
+import mmap
+import re
+import tempfile
+import threading
+
+
+class OutputBuffer:
+    """Collected output of a command, stored encoded.
+
+    The output is kept in memory up to spill_size bytes and moved to an
+    anonymous temporary file beyond. It is decoded when it is accessed,
+    head, tail, lines and search only decode the parts they return.
+    """
+    def __init__(self, spill_size: int = 8 * 1024 * 1024):
+        self._spill_size = spill_size
+        self._buffer = io.BytesIO()
+        self._file = None
+        self._map = None
+        self._size = 0
+        # Output streams of a command may be fed from different threads
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Size of the encoded output in bytes."""
+        return self._size
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def append(self, text: str):
+        data = text.encode('utf-8')
+        with self._lock:
+            if self._file is None and self._size + len(data) > self._spill_size:
+                self._file = tempfile.TemporaryFile(prefix='baka-output-')
+                self._file.write(self._buffer.getbuffer())
+                self._buffer = None
+            (self._file or self._buffer).write(data)
+            self._size += len(data)
+
+    def text(self) -> str:
+        return self._data()[:].decode('utf-8', errors='replace')
+
+    def lines(self) -> Iterator[str]:
+        """Iterate over the lines of the output, without line endings."""
+        data = self._data()
+        size = len(data)
+        start = 0
+        while start < size:
+            end = data.find(b'\n', start)
+            if end < 0:
+                end = size
+            yield self._decode(data[start:end])
+            start = end + 1
+
+    def head(self, count: int = 10) -> List[str]:
+        lines = []
+        for line in self.lines():
+            if len(lines) == count:
+                break
+            lines.append(line)
+        return lines
+
+    def tail(self, count: int = 10) -> List[str]:
+        data = self._data()
+        if count <= 0 or not len(data):
+            return []
+        end = len(data)
+        if data[end - 1:end] == b'\n':
+            end -= 1
+        # Search backwards for the newline before the first line
+        start = end
+        for _ in range(count):
+            start = data.rfind(b'\n', 0, start)
+            if start < 0:
+                break
+        return [self._decode(line) for line in data[start + 1:end].split(b'\n')]
+
+    def search(self, pattern: Union[str, bytes], flags: int = 0) -> Iterator[str]:
+        """Iterate over the lines matching a regular expression."""
+        if isinstance(pattern, str):
+            pattern = pattern.encode('utf-8')
+        data = self._data()
+        position = 0
+        regex = re.compile(pattern, flags | re.MULTILINE)
+        while True:
+            match = regex.search(data, position)
+            if match is None:
+                break
+            start = data.rfind(b'\n', 0, match.start()) + 1
+            end = data.find(b'\n', match.end())
+            if end < 0:
+                end = len(data)
+            yield self._decode(data[start:end])
+            position = end + 1
+            if position > len(data):
+                break
+
+    def close(self):
+        """Close the spill file, the output stays readable."""
+        with self._lock:
+            if self._file is not None and not self._file.closed:
+                self._map_file()
+                self._file.close()
+
+    def _data(self):
+        # Spilled output is memory-mapped instead of read
+        with self._lock:
+            if self._file is None:
+                return self._buffer.getvalue()
+            if self._map is None or len(self._map) != self._size:
+                self._map_file()
+            return self._map
+
+    def _map_file(self):
+        # Maps handed out earlier are not closed, they may still be read and
+        # are released with their last reference. A map outlives its file.
+        self._file.flush()
+        self._map = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _decode(data: bytes) -> str:
+        # Output of commands with a terminal has windows line endings
+        return data.decode('utf-8', errors='replace').rstrip('\r')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from typing import List
+
+import abc
+
+
+class ProbeError(Exception):
+    pass
+
+
+class ReadinessProbe(metaclass=abc.ABCMeta):
+    """A check run inside the container, it passes with exit code 0."""
+
+    @property
+    @abc.abstractmethod
+    def script(self) -> str:
+        raise NotImplementedError()
+
+    @property
+    @abc.abstractmethod
+    def description(self) -> str:
+        raise NotImplementedError()
+
+
+class RouteProbe(ReadinessProbe):
+    """Passes as soon as a default route exists."""
+    script = 'awk \'$2 == "00000000" { found = 1 } END { exit !found }\' /proc/net/route'
+    description = 'default route'
+
+
+class DNSProbe(ReadinessProbe):
+    """Passes as soon as the host name can be resolved."""
+    def __init__(self, host: str = 'archive.ubuntu.com'):
+        self._host = host
+
+    @property
+    def script(self) -> str:
+        return 'getent hosts {}'.format(self._host)
+
+    @property
+    def description(self) -> str:
+        return 'resolving {}'.format(self._host)
+
+
+class URLProbe(ReadinessProbe):
+    """Passes as soon as the URL can be fetched."""
+    def __init__(self, url: str):
+        self._url = url
+
+    @property
+    def script(self) -> str:
+        return 'python3 -c \'import urllib.request; urllib.request.urlopen("{}", timeout=5)\''.format(self._url)
+
+    @property
+    def description(self) -> str:
+        return 'fetching {}'.format(self._url)
+
+
+class CommandProbe(ReadinessProbe):
+    """Passes as soon as the shell command succeeds."""
+    def __init__(self, command: str):
+        self._command = command
+
+    @property
+    def script(self) -> str:
+        return self._command
+
+    @property
+    def description(self) -> str:
+        return 'running {}'.format(self._command)
+
+
+default_probes = ('route', 'dns')
+
+
+def parse(spec: str) -> ReadinessProbe:
+    """Create a probe from its specification.
+
+    Supported are "route", "dns[:HOST]", "url:URL" and "cmd:COMMAND".
+    """
+    kind, _, argument = spec.partition(':')
+    if kind == 'route':
+        return RouteProbe()
+    if kind == 'dns':
+        return DNSProbe(argument) if argument else DNSProbe()
+    if kind == 'url' and argument:
+        return URLProbe(argument)
+    if kind == 'cmd' and argument:
+        return CommandProbe(argument)
+    raise ProbeError('Invalid network probe "{}".'.format(spec))
+
+
+def parse_all(specs: List[str]=None) -> List[ReadinessProbe]:
+    return [parse(spec) for spec in (specs or default_probes)]
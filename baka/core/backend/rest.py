@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from typing import Callable, Dict, Iterable, List
+
+import threading
+
+import pylxd
+from ws4py.client import WebSocketBaseClient
+
+
+class ExecError(Exception):
+    pass
+
+
+class _ExecSocket(WebSocketBaseClient):
+    """Websocket attached to one file descriptor of an exec operation."""
+    def __init__(self, url: str, resource: str, callback: Callable=None):
+        # LXD rejects the origin ws4py derives from unix socket urls
+        super().__init__(url, exclude_headers=['origin'])
+        self.resource = resource
+        self._callback = callback
+        self._thread = None
+
+    def received_message(self, message):
+        if message.data and self._callback is not None:
+            self._callback(bytes(message.data))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def join(self, timeout: float = None):
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # The output ends with the operation, don't wait for a lingering connection
+            self.close()
+            self._thread.join()
+
+
+def execute(client: pylxd.Client, container: str, command: List[str], envvars: Dict[str, str]=None,
+            stdout: Callable=None, stderr: Callable=None, stdin: Iterable[bytes]=None,
+            interactive: bool = False) -> int:
+    """Run a command in a container through the LXD API and return its exit code.
+
+    Output is passed to the callbacks as it arrives, stdin data is streamed
+    to the command. Interactive commands run in a terminal, their output is
+    passed to stdout only.
+    """
+    response = client.api.containers[container]['exec'].post(json={
+        'command': command,
+        'environment': envvars or {},
+        'wait-for-websocket': True,
+        'interactive': interactive
+    })
+    operation = response.json()['operation']
+    fds = response.json()['metadata']['metadata']['fds']
+
+    def socket(fd: str, callback: Callable=None) -> _ExecSocket:
+        ws = _ExecSocket(client.websocket_url, '{}/websocket?secret={}'.format(operation, fds[fd]), callback)
+        ws.connect()
+        return ws
+
+    # The command is started once all of its file descriptors are attached
+    input_socket = socket('0', stdout if interactive else None)
+    output_sockets = [input_socket] if interactive else [socket('1', stdout), socket('2', stderr)]
+    for ws in output_sockets:
+        ws.start()
+    for data in stdin or ():
+        input_socket.send(data, binary=True)
+    if not interactive:
+        input_socket.close()
+    operation_id = operation.split('/')[-1].split('?')[0]
+    result = client.api.operations[operation_id].wait.get().json()['metadata']
+    for ws in output_sockets:
+        ws.join(timeout=5)
+    if not interactive:
+        input_socket.close_connection()
+    if 'return' not in (result.get('metadata') or {}):
+        raise ExecError('Executing {} failed: {}'.format(command[0], result.get('err') or result.get('status')))
+    return result['metadata']['return']
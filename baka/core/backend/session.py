@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Callable, List
+
+import base64
+import binascii
+import collections
+import itertools
+import json
+import subprocess
+import threading
+
+from . import base
+
+
+# The agent is executed by the container's python3 interpreter.
+# Keep it compatible with Python 3.5 (Ubuntu xenial).
+_AGENT = r'''
+import base64
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+_SHELL = shutil.which('bash') or '/bin/sh'
+_lock = threading.Lock()
+_out = sys.stdout.buffer
+
+
+def _send(message):
+    data = (json.dumps(message) + '\n').encode('utf-8')
+    with _lock:
+        _out.write(data)
+        _out.flush()
+
+
+def _pump(id_, stream, pipe):
+    fd = pipe.fileno()
+    while True:
+        data = os.read(fd, 65536)
+        if not data:
+            break
+        _send({'id': id_, 'stream': stream, 'data': base64.b64encode(data).decode('ascii')})
+    pipe.close()
+
+
+def _run(request):
+    id_ = request['id']
+    env = dict(os.environ)
+    env.update(request.get('env') or {})
+    try:
+        proc = subprocess.Popen(
+            [_SHELL, '-c', request['command']], cwd=request.get('cwd') or None, env=env,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except OSError as e:
+        message = '{}\n'.format(e).encode('utf-8')
+        _send({'id': id_, 'stream': 'stderr', 'data': base64.b64encode(message).decode('ascii')})
+        _send({'id': id_, 'exit': 127})
+        return
+    pumps = [
+        threading.Thread(target=_pump, args=(id_, 'stdout', proc.stdout)),
+        threading.Thread(target=_pump, args=(id_, 'stderr', proc.stderr))
+    ]
+    for t in pumps:
+        t.start()
+    for t in pumps:
+        t.join()
+    _send({'id': id_, 'exit': proc.wait()})
+
+
+def main():
+    _send({'ready': True})
+    while True:
+        line = sys.stdin.buffer.readline()
+        if not line:
+            break
+        request = json.loads(line.decode('utf-8'))
+        threading.Thread(target=_run, args=(request,), daemon=True).start()
+
+
+main()
+'''
+
+
+class SessionError(Exception):
+    pass
+
+
+class _PendingCommand:
+    def __init__(self, stdout: Callable=None, stderr: Callable=None, collect_output: bool = False):
+        self._output = base.OutputBuffer() if collect_output else None
+        self._streams = {
+            'stdout': base.OutputStream(stdout, self._output),
+            'stderr': base.OutputStream(stderr, self._output)
+        }
+        self.exit_code = None
+        self.error = None
+        self.done = threading.Event()
+
+    def feed(self, stream: str, data: bytes, final: bool = False):
+        # A failing output callback must not stop the session's reader
+        try:
+            self._streams[stream].feed(data, final=final)
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+
+    def finish(self, exit_code: int = None):
+        for stream in self._streams:
+            self.feed(stream, b'', final=True)
+        self.exit_code = exit_code
+        self.done.set()
+
+    @property
+    def output(self) -> base.OutputBuffer:
+        return self._output or base.OutputBuffer()
+
+
+class ExecSession:
+    """A long-lived agent process inside a container.
+
+    Many commands are multiplexed over a single attached process, each one
+    with its own exit code, environment, working directory and output streams.
+    """
+    def __init__(self, argv: List[str], python: str = 'python3'):
+        self._argv = list(argv)
+        self._python = python
+        self._proc = None
+        self._reader = None
+        self._pending = {}
+        self._reading = False
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stderr = collections.deque(maxlen=50)
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def open(self, timeout: float = 30):
+        bootstrap = "import base64; exec(base64.b64decode('{}').decode('utf-8'))".format(
+            base64.b64encode(_AGENT.encode('utf-8')).decode('ascii')
+        )
+        self._proc = subprocess.Popen(
+            self._argv + [self._python, '-u', '-c', bootstrap],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self._reading = True
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+        if not self._ready.wait(timeout) or not self.alive:
+            self.close()
+            raise SessionError('Failed to start exec session: {}'.format(self._last_error()))
+
+    def close(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+        if self._reader is not None:
+            self._reader.join()
+        self._proc = None
+
+    def exec(self, command: str, path: str = None, envvars: Dict[str, str]=None,
+             stdout: Callable=None, stderr: Callable=None, collect_output: bool = False) -> base.CommandResult:
+        pending = _PendingCommand(stdout, stderr, collect_output)
+        request = {
+            'command': command,
+            'cwd': path,
+            'env': envvars or {}
+        }
+        with self._lock:
+            if not self.alive or not self._reading:
+                raise SessionError('Exec session is not running: {}'.format(self._last_error()))
+            request['id'] = next(self._ids)
+            self._pending[request['id']] = pending
+            try:
+                self._proc.stdin.write((json.dumps(request) + '\n').encode('utf-8'))
+                self._proc.stdin.flush()
+            except OSError as e:
+                del self._pending[request['id']]
+                raise SessionError('Failed to send command to exec session: {}'.format(e))
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        if pending.exit_code is None:
+            raise SessionError('Exec session terminated unexpectedly: {}'.format(self._last_error()))
+        return base.CommandResult(pending.exit_code, pending.output)
+
+    def _read(self):
+        try:
+            for line in self._proc.stdout:
+                try:
+                    self._handle(json.loads(line.decode('utf-8')))
+                except (ValueError, KeyError, TypeError, binascii.Error):
+                    # Commands may write to the agent's output directly
+                    self._stderr.append('Malformed exec session message: {!r}'.format(line[:200]))
+        finally:
+            # The agent is gone, release everyone still waiting
+            with self._lock:
+                self._reading = False
+                pending_commands = list(self._pending.values())
+                self._pending.clear()
+            self._ready.set()
+            for pending in pending_commands:
+                pending.finish()
+
+    def _handle(self, message: Dict):
+        if 'ready' in message:
+            self._ready.set()
+            return
+        pending = self._pending.get(message['id'])
+        if pending is None:
+            return
+        if 'exit' in message:
+            with self._lock:
+                self._pending.pop(message['id'], None)
+            pending.finish(message['exit'])
+        else:
+            pending.feed(message['stream'], base64.b64decode(message['data']))
+
+    def _read_stderr(self):
+        for line in self._proc.stderr:
+            self._stderr.append(line.decode('utf-8', errors='replace').rstrip())
+
+    def _last_error(self) -> str:
+        return '\n'.join(self._stderr) or 'no error output'
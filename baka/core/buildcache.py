@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List, Optional, Set, Tuple
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from .container import Container
+from .project import Project
+from .job import Job
+from . import paths
+from . import sync
+
+
+class BuildCache:
+    """Skips jobs whose inputs did not change since their last successful build.
+
+    Each job is identified by a fingerprint of its sources, scripts, envvars,
+    the container image and the fingerprints of the jobs it depends on.
+    The artifacts of successful builds are stored by fingerprint and copied
+    back to the artifacts path instead of running the job again.
+    """
+    def __init__(self, root: str = None, rebuild: bool = False):
+        self._root = root or paths.cache_path('builds')
+        self._rebuild = rebuild
+
+    def fingerprints(self, container: Container, project: Project) -> Dict[str, Optional[str]]:
+        """Returns the fingerprint of each job, None if the job can not be cached."""
+        base = {
+            'backend': container.backend_type,
+            'image': container.image,
+            'arch': container.arch,
+            'prepare': container.prepare_fingerprint,
+            'environment': project.environment.scripts if project.environment else {}
+        }
+        fingerprints = {}
+        jobs = {job.name: job for job in project.jobs}
+        for job in project.jobs:
+            self._fingerprint(job, jobs, base, fingerprints)
+        return fingerprints
+
+    def restore(self, project: Project, fingerprints: Dict[str, Optional[str]],
+                skip_jobs: Tuple[str] = None) -> List[str]:
+        """Restore the artifacts of all cached jobs, returns the names of the restored jobs.
+
+        Jobs needed by a job that has to run are not restored but run as well.
+        """
+        if self._rebuild:
+            return []
+        cached = set(
+            job.name for job in project.jobs
+            if fingerprints.get(job.name) and os.path.isfile(self._entry_filename(fingerprints[job.name]))
+        )
+        for job in project.jobs:
+            if job.name not in cached and not self._skipped(job, skip_jobs):
+                cached -= self._required(job, project)
+        restored = []
+        for job in project.jobs:
+            if job.name in cached and not self._skipped(job, skip_jobs):
+                self._restore_job(job, fingerprints[job.name])
+                restored.append(job.name)
+        return restored
+
+    def store(self, project: Project, fingerprints: Dict[str, Optional[str]], skip_jobs: Tuple[str] = None):
+        """Store the artifacts of all jobs built completely."""
+        for job in project.jobs:
+            if fingerprints.get(job.name) and not self._skipped(job, skip_jobs, partially=True):
+                self._store_job(job, fingerprints[job.name])
+
+    def _fingerprint(self, job: Job, jobs: Dict[str, Job], base: Dict, fingerprints: Dict[str, Optional[str]]):
+        if job.name in fingerprints:
+            return fingerprints[job.name]
+        # Prevent endless recursion on circular dependencies, the scheduler reports them
+        fingerprints[job.name] = None
+        depends = {}
+        for dep in job.depends:
+            depends[dep] = self._fingerprint(jobs[dep], jobs, base, fingerprints) if dep in jobs else None
+            if depends[dep] is None:
+                return None
+        source = self._source_fingerprint(job)
+        if source is None:
+            return None
+        data = json.dumps(dict(base, **{
+            'job': '{}.{}'.format(type(job).__module__, type(job).__qualname__),
+            'name': job.name,
+            'source': source,
+            'scripts': job.scripts,
+            'envvars': job.envvars or {},
+            'options': job.options,
+            'depends': depends
+        }), sort_keys=True)
+        fingerprints[job.name] = hashlib.sha256(data.encode()).hexdigest()
+        return fingerprints[job.name]
+
+    def _source_fingerprint(self, job: Job) -> Optional[str]:
+        if job.source_type == 'git':
+            # The fingerprint of a repository is the commit the requested ref points to
+            if job.source_ref and re.match(r'^[0-9a-f]{40}$', job.source_ref):
+                return job.source_ref
+            try:
+                out = subprocess.check_output(
+                    ['git', 'ls-remote', job.source, job.source_ref or 'HEAD'], stderr=subprocess.DEVNULL, timeout=60
+                )
+            except (OSError, subprocess.SubprocessError):
+                return None
+            return out.decode().split('\t')[0] or None
+        exclude = []
+        artifacts_path = os.path.relpath(os.path.abspath(job.artifacts_path), job.source)
+        if not artifacts_path.startswith(os.pardir):
+            # Artifacts written into the source directory are not sources
+            exclude.append(artifacts_path)
+        os.makedirs(os.path.join(self._root, 'sources'), exist_ok=True)
+        manifest_filename = os.path.join(
+            self._root, 'sources', hashlib.sha256(job.source.encode()).hexdigest() + '.json'
+        )
+        previous = None
+        if os.path.isfile(manifest_filename):
+            with open(manifest_filename) as file:
+                previous = json.load(file)
+        manifest = sync.scan(job.source, previous, exclude=exclude)
+        # Matrix builds scan the same sources concurrently
+        tmp_filename = '{}.{}.tmp'.format(manifest_filename, threading.get_ident())
+        with open(tmp_filename, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(tmp_filename, manifest_filename)
+        return hashlib.sha256(json.dumps(
+            {path: entry.get('sha256') or entry.get('link') for path, entry in manifest.items()}, sort_keys=True
+        ).encode()).hexdigest()
+
+    @staticmethod
+    def _skipped(job: Job, skip_jobs: Tuple[str], partially: bool = False) -> bool:
+        skip_jobs = skip_jobs or ()
+        if job.name in skip_jobs:
+            return True
+        return partially and any(
+            '{}.{}'.format(job.name, phase) in skip_jobs for phase in ('setup', 'perform', 'finish')
+        )
+
+    @staticmethod
+    def _required(job: Job, project: Project) -> Set[str]:
+        jobs = {job.name: job for job in project.jobs}
+        required = set()
+        pending = list(job.depends)
+        while pending:
+            name = pending.pop()
+            if name not in required and name in jobs:
+                required.add(name)
+                pending += jobs[name].depends
+        return required
+
+    def _entry_path(self, fingerprint: str) -> str:
+        return os.path.join(self._root, fingerprint)
+
+    def _entry_filename(self, fingerprint: str) -> str:
+        return os.path.join(self._entry_path(fingerprint), 'entry.json')
+
+    def _restore_job(self, job: Job, fingerprint: str):
+        with open(self._entry_filename(fingerprint)) as file:
+            entry = json.load(file)
+        for artifact in entry['artifacts']:
+            filename = os.path.join(job.artifacts_path, artifact)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            shutil.copy2(os.path.join(self._entry_path(fingerprint), 'artifacts', artifact), filename)
+            job._add_artifact(filename)
+
+    def _store_job(self, job: Job, fingerprint: str):
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self._root)
+        try:
+            artifacts = []
+            for filename in job.artifacts:
+                if not os.path.isfile(filename):
+                    continue
+                artifact = os.path.relpath(filename, job.artifacts_path)
+                if artifact.startswith(os.pardir):
+                    artifact = os.path.basename(filename)
+                target = os.path.join(tmp, 'artifacts', artifact)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(filename, target)
+                artifacts.append(artifact)
+            with open(os.path.join(tmp, 'entry.json'), 'w') as file:
+                json.dump({'job': job.name, 'artifacts': artifacts, 'created': time.time()}, file)
+            shutil.rmtree(self._entry_path(fingerprint), ignore_errors=True)
+            os.rename(tmp, self._entry_path(fingerprint))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
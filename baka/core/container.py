@@ -1,14 +1,30 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import contextlib
+import functools
 import os
+import threading
 
 from typing import Callable, Any, Dict, Tuple
 
 from . import project
 from . import backend
+from . import logsink
+from . import scheduler
+from . import tracing
 
 
 def _require_ready(f: Callable[..., Any]):
+    if asyncio.iscoroutinefunction(f):
+        @functools.wraps(f)
+        async def async_wrapper(this, *args, **kwargs):
+            if not this.ready:
+                raise backend.NotReadyError('This container has not yet been initialized.')
+            return await f(this, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(f)
     def wrapper(this, *args, **kwargs):
         if not this.ready:
             raise backend.NotReadyError('This container has not yet been initialized.')
@@ -16,6 +32,20 @@ def _require_ready(f: Callable[..., Any]):
     return wrapper
 
 
+_log_scope = threading.local()
+
+
+@contextlib.contextmanager
+def log_scope(prefix: str):
+    """Prefix the log of all containers created by the current thread in the enclosed block."""
+    previous = getattr(_log_scope, 'prefix', None)
+    _log_scope.prefix = (previous or '') + prefix
+    try:
+        yield
+    finally:
+        _log_scope.prefix = previous
+
+
 class Container:
     def __init__(self, project_: project.Project,
                  backend_type: str = None, backend_options: Dict = None):
@@ -29,6 +59,19 @@ class Container:
                 self._backend_type = 'lxc'
         self._backend_class = backend.by_type(self._backend_type)
         self._backend = self._backend_class(self, backend_options)
+        self._log_context = threading.local()
+        self._log_scope_prefix = getattr(_log_scope, 'prefix', None) or ''
+        self._log_files_scope = logsink.current_scope()
+        # Jobs may need host directories, e.g. for persistent caches
+        mounts = {}
+        for job in self._project.jobs:
+            mounts.update(job.mounts(self))
+        if mounts:
+            self._backend.add_mounts(mounts)
+
+    @property
+    def backend_type(self) -> str:
+        return self._backend_type
 
     @property
     def name(self) -> str:
@@ -50,62 +93,161 @@ class Container:
     def ready(self):
         return self._backend.ready
 
+    @property
+    def prepare_fingerprint(self) -> str:
+        return self._backend.prepare_fingerprint
+
+    def snapshot_image(self, key: str) -> str:
+        return self._backend.snapshot_image(key)
+
     def init(self):
         if self.ready:
             print('Warning: Container already initialized.')
             return
-        self._backend.init()
+        with tracing.span('container.init', 'container', backend=self._backend_type):
+            self._backend.init()
+
+    async def ainit(self):
+        if self.ready:
+            print('Warning: Container already initialized.')
+            return
+        with tracing.span('container.init', 'container', backend=self._backend_type):
+            await self._backend.ainit()
 
     @_require_ready
-    def run(self, skip_jobs: Tuple[str]=None, skip_environment: bool=False):
-        self.setup(skip_jobs=skip_jobs, skip_environment=skip_environment)
-        self.perform(skip_jobs=skip_jobs)
-        self.finish(skip_jobs=skip_jobs)
+    def run(self, skip_jobs: Tuple[str]=None, skip_environment: bool=False, parallel_jobs: int = 1):
+        self.setup(skip_jobs=skip_jobs, skip_environment=skip_environment, parallel_jobs=parallel_jobs)
+        self.perform(skip_jobs=skip_jobs, parallel_jobs=parallel_jobs)
+        self.finish(skip_jobs=skip_jobs, parallel_jobs=parallel_jobs)
 
     @_require_ready
-    def setup(self, skip_jobs: Tuple[str]=None, skip_environment: bool=False):
-        env = self._project.environment
-        if env and not skip_environment:
-            self.log('Setting up the project environment ...')
-            env.setup(self)
+    def setup(self, skip_jobs: Tuple[str]=None, skip_environment: bool=False, parallel_jobs: int = 1):
+        if not skip_environment:
+            self.setup_environment()
         self.log('Setting up jobs ...')
-        for job in self._project.jobs:
-            if not skip_jobs or (job.name not in skip_jobs and job.name + '.setup' not in skip_jobs):
-                job.setup(self)
+        self._run_jobs('setup', skip_jobs, parallel_jobs)
 
     @_require_ready
-    def perform(self, skip_jobs: Tuple[str]=None):
+    def perform(self, skip_jobs: Tuple[str]=None, parallel_jobs: int = 1):
         self.log('Performing jobs ...')
-        for job in self._project.jobs:
-            if not skip_jobs or (job.name not in skip_jobs and job.name + '.perform' not in skip_jobs):
-                job.perform(self)
+        self._run_jobs('perform', skip_jobs, parallel_jobs)
 
     @_require_ready
-    def finish(self, skip_jobs: Tuple[str]=None):
+    def finish(self, skip_jobs: Tuple[str]=None, parallel_jobs: int = 1):
         self.log('Finishing ...')
-        for job in self._project.jobs:
-            if not skip_jobs or (job.name not in skip_jobs and job.name + '.finish' not in skip_jobs):
-                job.finish(self)
+        self._run_jobs('finish', skip_jobs, parallel_jobs)
+
+    @_require_ready
+    def setup_environment(self):
+        env = self._project.environment
+        if env:
+            self.log('Setting up the project environment ...')
+            try:
+                with tracing.span('environment.setup', 'environment'):
+                    env.setup(self)
+            except Exception:
+                logsink.failed(self.log_channel, (self.log_prefix or '') + 'Environment setup failed, last output:')
+                raise
+            # Environment scripts are likely to have changed the container environment
+            self.invalidate_envvars()
+
+    def _run_jobs(self, phase: str, skip_jobs: Tuple[str], parallel_jobs: int):
+        def run_job(job):
+            if skip_jobs and (job.name in skip_jobs or job.name + '.' + phase in skip_jobs):
+                return
+            if parallel_jobs > 1:
+                # Tell apart the output of concurrently running jobs
+                self._log_context.prefix = '[{}] '.format(job.name)
+            self._log_context.channel = os.path.join(self._log_files_scope, job.name, phase)
+            try:
+                with tracing.span('{}.{}'.format(job.name, phase), 'job', job=job.name, phase=phase):
+                    getattr(job, phase)(self)
+            except Exception:
+                logsink.failed(self.log_channel, '{}Job {} failed during {}, last output:'.format(
+                    self._log_scope_prefix, job.name, phase
+                ))
+                raise
+            finally:
+                self._log_context.prefix = None
+                self._log_context.channel = None
+
+        with tracing.span('jobs.' + phase, 'phase'):
+            scheduler.JobScheduler(self._project.jobs, max_workers=parallel_jobs).run(run_job)
 
     @_require_ready
     def destroy(self):
-        self._backend.destroy()
+        with tracing.span('container.destroy', 'container'):
+            self._backend.destroy()
 
     @_require_ready
     def exec(self, command, *args, path: str = None, envvars: Dict[str, str]=None,
-             collect_output: bool = False, log_output: bool = True) -> backend.CommandResult:
+             collect_output: bool = False, log_output: bool = True, use_pty: bool = True) -> backend.CommandResult:
         return self._backend.exec(
             command, *args, path=path, envvars=envvars, collect_output=collect_output,
-            log_output=log_output
+            log_output=log_output, use_pty=use_pty
+        )
+
+    @_require_ready
+    async def aexec(self, command, *args, path: str = None, envvars: Dict[str, str]=None,
+                    collect_output: bool = False, log_output: bool = True,
+                    stdout: Callable=None, stderr: Callable=None) -> backend.CommandResult:
+        return await self._backend.aexec(
+            command, *args, path=path, envvars=envvars, collect_output=collect_output,
+            log_output=log_output, stdout=stdout, stderr=stderr
         )
 
-    def log(self, *fragments):
+    def invalidate_envvars(self):
+        self._backend.invalidate_envvars()
+
+    @property
+    def log_prefix(self) -> str:
+        return (self._log_scope_prefix + (getattr(self._log_context, 'prefix', None) or '')) or None
+
+    @property
+    def log_channel(self) -> str:
+        """Name of the log file of the output, relative to the log directory."""
+        return getattr(self._log_context, 'channel', None) or os.path.join(self._log_files_scope, 'container')
+
+    def log(self, *fragments, prefix: str = None, channel: str = None):
+        if prefix is None:
+            prefix = self.log_prefix
+        sink = logsink.active()
+        if sink is not None:
+            text = ' '.join(str(f) for f in fragments)
+            sink.write(text if text.endswith('\n') else text + '\n', prefix or '', channel or self.log_channel)
+            return
+        if prefix:
+            lines = ' '.join(str(f) for f in fragments).splitlines(keepends=True)
+            fragments = (''.join(prefix + line for line in lines),)
         print(*fragments, end='' if fragments[-1].endswith('\n') else '\n')
 
+    def log_output(self, text: str, prefix: str = None, channel: str = None):
+        """Log a chunk of command output, lines and progress updates may span chunks."""
+        sink = logsink.active()
+        if sink is None:
+            self.log(text, prefix=prefix, channel=channel)
+            return
+        if prefix is None:
+            prefix = self.log_prefix
+        # The sink assembles the lines
+        sink.write(text, prefix or '', channel or self.log_channel)
+
     @_require_ready
     def push(self, source: str, dest: str):
         self._backend.push(source, dest)
 
+    @_require_ready
+    async def apush(self, source: str, dest: str):
+        await self._backend.apush(source, dest)
+
+    @_require_ready
+    def publish(self, image: str) -> int:
+        return self._backend.publish(image)
+
     @_require_ready
     def pull(self, source: str, dest: str):
         self._backend.pull(source, dest)
+
+    @_require_ready
+    async def apull(self, source: str, dest: str):
+        await self._backend.apull(source, dest)
@@ -1,43 +1,110 @@
 # -*- coding: utf-8 -*-
 
-import yaml
-import pykwalify.core
+import hashlib
+import json
 import os.path
 
 from .project import Project
 from .environment import Environment
 from .job import Job
+from . import paths
 from . import sources
 
 from baka import jobs
 
-from typing import Type
+from typing import Dict, Optional, Tuple, Type
+
+
+_schema_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'validation/project_schema.yaml')
+_schema = None  # type: Tuple[Dict, str]
 
 
 def _extended_job(job_name: str) -> Type[Job]:
     return jobs.job_by_declarative_name(job_name)
 
 
-def _validate(source_data: str):
+def _yaml_load(stream):
+    # yaml and pykwalify are imported here, they are slow to import and only needed to load projects
+    import yaml
+    # Use the C implementation of the loader if available
+    return yaml.load(stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def _project_schema() -> Tuple[Dict, str]:
+    """Returns the parsed project schema and its digest, the schema file is only read once."""
+    global _schema
+    if _schema is None:
+        with open(_schema_filename, 'rb') as file:
+            content = file.read()
+        _schema = _yaml_load(content), hashlib.sha256(content).hexdigest()
+    return _schema
+
+
+def _validate(source_data: Dict):
+    import pykwalify.core
     validator = pykwalify.core.Core(
         source_data=source_data,
-        schema_files=[
-            os.path.join(
-                os.path.dirname(os.path.abspath(__file__)),
-                'validation/project_schema.yaml'
-            )
-        ]
+        schema_data=_project_schema()[0]
     )
     validator.validate(raise_exception=True)
 
 
-def load_project(filename: str, artifacts_path: str=None) -> Project:
-    filedir = os.path.dirname(filename)
+def _cache_filename(content: bytes) -> Optional[str]:
+    digest = hashlib.sha256(_project_schema()[1].encode() + content).hexdigest()
+    try:
+        directory = paths.cache_path('projects')
+    except OSError:
+        # The cache is optional, e.g. the cache directory may not be writable
+        return None
+    return os.path.join(directory, digest + '.json')
+
 
-    with open(filename, 'r') as file:
-        data = yaml.load(file)
+def _cached_data(cache_filename: str) -> Optional[Dict]:
+    try:
+        with open(cache_filename, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
 
+
+def _store_data(cache_filename: str, data: Dict):
+    # Only plain data survives the round trip through JSON unchanged
+    if json.loads(json.dumps(data)) != data:
+        return
+    tmp_filename = '{}.{}.tmp'.format(cache_filename, os.getpid())
+    try:
+        with open(tmp_filename, 'w') as file:
+            json.dump(data, file)
+        os.replace(tmp_filename, cache_filename)
+    except OSError:
+        # The cache is optional
+        pass
+
+
+def load_data(filename: str, use_cache: bool = True) -> Dict:
+    """Parse and validate a project file.
+
+    Validated data is cached in the baka cache directory by the hash of
+    the file content, so unchanged files are neither parsed nor validated again.
+    """
+    with open(filename, 'rb') as file:
+        content = file.read()
+    cache_filename = _cache_filename(content) if use_cache else None
+    if cache_filename:
+        data = _cached_data(cache_filename)
+        if data is not None:
+            return data
+    data = _yaml_load(content)
     _validate(data)
+    if cache_filename:
+        _store_data(cache_filename, data)
+    return data
+
+
+def load_project(filename: str, artifacts_path: str=None, use_cache: bool = True) -> Project:
+    filedir = os.path.dirname(filename)
+
+    data = load_data(filename, use_cache=use_cache)
 
     env = None
 
@@ -84,12 +151,40 @@ def load_project(filename: str, artifacts_path: str=None) -> Project:
                     'Use "extends" instead.'
                 )
                 job_extends = data_job['type']
+            job_depends = None
+            if 'depends' in data_job:
+                job_depends = data_job['depends']
+            job_source_sync = 'copy'
+            if 'source-sync' in data_job:
+                job_source_sync = data_job['source-sync']
+            job_source_ref = None
+            if 'source-ref' in data_job:
+                job_source_ref = data_job['source-ref']
+            job_source_depth = None
+            if 'source-depth' in data_job:
+                job_source_depth = data_job['source-depth']
+            job_source_filter = None
+            if 'source-filter' in data_job:
+                job_source_filter = data_job['source-filter']
+            job_source_mirror = True
+            if 'source-mirror' in data_job:
+                job_source_mirror = data_job['source-mirror']
+            job_options = None
+            if 'options' in data_job:
+                job_options = data_job['options']
             job = _extended_job(job_extends)(
                 name=data_job['name'],
                 source=source,
                 scripts=job_scripts,
                 envvars=job_envvars,
-                artifacts_path=artifacts_path
+                artifacts_path=artifacts_path,
+                depends=job_depends,
+                source_sync=job_source_sync,
+                options=job_options,
+                source_ref=job_source_ref,
+                source_depth=job_source_depth,
+                source_filter=job_source_filter,
+                source_mirror=job_source_mirror
             )
             jobs.append(job)
 
@@ -98,6 +193,7 @@ def load_project(filename: str, artifacts_path: str=None) -> Project:
         summary=data['summary'] if 'summary' in data else None,
         description=data['description'] if 'description' in data else None,
         environment=env,
-        jobs=jobs
+        jobs=jobs,
+        matrix=data['matrix'] if 'matrix' in data else None
     )
     return project
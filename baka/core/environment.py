@@ -11,7 +11,7 @@ class Environment(Scriptable):
     path = '/home/baka'
 
     def __init__(self, scripts: Dict[str, str]=None):
-        super().__init__(scripts)
+        super().__init__(scripts, owner='environment')
 
     def setup(self, c: Container):
         self._run_script('setup', c)
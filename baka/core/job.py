@@ -1,19 +1,32 @@
 # -*- coding: utf-8 -*-
 
 import os
+import shlex
+import subprocess
 from typing import List, Dict
 
 from baka.core.scripting import Scriptable
 from .container import Container
+from . import mirrors
+from . import sync
+from . import tracing
 
 
 class Job(Scriptable):
     home_path = '/home/baka'
 
     def __init__(self, name: str, source: str, scripts: Dict[str, str]=None, envvars: Dict[str, str]=None,
-                 artifacts_path: str=None):
-        super().__init__(scripts)
+                 artifacts_path: str=None, depends: List[str]=None, source_sync: str = 'copy', options: Dict=None,
+                 source_ref: str = None, source_depth: int = None, source_filter: str = None,
+                 source_mirror: bool = True):
+        super().__init__(scripts, owner=name)
         self._name = name
+        self._options = options or {}
+        self._depends = depends or []
+        self._source_sync = source_sync
+        self._source_ref = source_ref
+        self._source_depth = source_depth
+        self._source_filter = source_filter
         self._source = source
         self._source_type = 'local'
         self._envvars = envvars
@@ -23,6 +36,9 @@ class Job(Scriptable):
             self._source_type = 'git'
         else:
             self._source_type = 'local'
+        self._mirror = None
+        if self._source_type == 'git' and source_mirror:
+            self._mirror = mirrors.GitMirror(self._source)
         self._artifacts = []
         # Create artifacts dir if it doesn't exist
         if not os.path.isdir(self._artifacts_path):
@@ -32,10 +48,31 @@ class Job(Scriptable):
     def name(self) -> str:
         return self._name
 
+    @property
+    def depends(self) -> List[str]:
+        return self._depends
+
     @property
     def source(self) -> str:
         return self._source
 
+    @property
+    def source_type(self) -> str:
+        return self._source_type
+
+    @property
+    def source_ref(self) -> str:
+        return self._source_ref
+
+    @property
+    def envvars(self) -> Dict[str, str]:
+        return self._envvars
+
+    @property
+    def options(self) -> Dict:
+        """Options of extended jobs, e.g. "parts-cache" for snapcraft."""
+        return self._options
+
     @property
     def artifacts_path(self) -> str:
         return self._artifacts_path
@@ -44,21 +81,34 @@ class Job(Scriptable):
     def artifacts(self) -> List[str]:
         return self._artifacts
 
+    def mounts(self, c: Container) -> Dict[str, str]:
+        """Host directories the job needs mounted into the container, by container path."""
+        mounts = {}
+        if self._mirror:
+            # The mirror itself may not exist before the first clone
+            mounts[self._mirrors_path] = self._mirror.root
+        return mounts
+
     def setup(self, c: Container, run_script=True):
         c.log('Setting up {} ...'.format(self._name))
-        # Default preparation steps
-        c.log('Cleaning up {} ...'.format(self.path))
-        c.exec('rm', '-rf', self.path)
-        # Preparing source
-        if self._source_type == 'git':
-            c.log('Cloning source repository ...')
-            c.exec('git', 'clone', self._source, self.path)
-        elif self._source_type == 'local':
-            c.log('Copying sources to container ...')
-            c.push(self._source, os.path.join(self.path, '..'))
-            source_dir = self._source[self.source.rfind('/')+1:]
-            if self._name != source_dir:
-                c.exec('mv', os.path.join(self.home_path, source_dir), self.path)
+        if self._source_type == 'local' and self._source_sync == 'delta':
+            c.log('Synchronizing sources with container ...')
+            with tracing.span('source.sync', 'source'):
+                sync.DeltaSync(self._source, self.path, self._sync_manifest_path).sync(c)
+        else:
+            # Default preparation steps
+            c.log('Cleaning up {} ...'.format(self.path))
+            c.exec('rm', '-rf', self.path, self._sync_manifest_path)
+            # Preparing source
+            if self._source_type == 'git':
+                self._clone(c)
+            elif self._source_type == 'local':
+                c.log('Copying sources to container ...')
+                with tracing.span('source.copy', 'source'):
+                    c.push(self._source, os.path.join(self.path, '..'))
+                source_dir = self._source[self.source.rfind('/')+1:]
+                if self._name != source_dir:
+                    c.exec('mv', os.path.join(self.home_path, source_dir), self.path)
         # Run script
         if run_script:
             self._run_script('setup', c)
@@ -79,6 +129,41 @@ class Job(Scriptable):
     def path(self) -> str:
         return os.path.join(self.home_path, self._name)
 
+    _mirrors_path = '/var/cache/baka/git'
+
+    @property
+    def _mirror_path(self) -> str:
+        return os.path.join(self._mirrors_path, os.path.basename(self._mirror.path))
+
+    @tracing.traced('source.clone', 'source')
+    def _clone(self, c: Container):
+        url = self._source
+        if self._mirror:
+            try:
+                c.log('Updating git mirror ...')
+                with tracing.span('source.mirror', 'source'):
+                    self._mirror.update()
+            except (OSError, subprocess.CalledProcessError):
+                c.log('Warning: Could not update the git mirror.')
+            else:
+                # Containers created before the mirror existed do not have it mounted
+                if c.exec('test', '-d', self._mirror_path, log_output=False).exit_code == 0:
+                    url = 'file://' + self._mirror_path
+        c.log('Cloning source repository{} ...'.format(' from the mirror' if url != self._source else ''))
+        commands = mirrors.clone_commands(url, self.path, self._source_ref, self._source_depth, self._source_filter)
+        if url != self._source:
+            commands.append(['git', '-C', self.path, 'remote', 'set-url', 'origin', self._source])
+        # The mirror is owned by the host user
+        script = ' && '.join(
+            ' '.join(shlex.quote(arg) for arg in ['git', '-c', 'safe.directory=*'] + command[1:])
+            for command in commands
+        )
+        c.exec('sh', '-c', shlex.quote(script))
+
+    @property
+    def _sync_manifest_path(self) -> str:
+        return os.path.join(self.home_path, '.baka-sync', self._name + '.json')
+
     def _path_join(self, path) -> str:
         return os.path.join(self.path, path)
 
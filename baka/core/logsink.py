@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, IO, List, Optional
+
+import collections
+import contextlib
+import os
+import queue
+import sys
+import threading
+
+
+class _Channel:
+    """Output of one job phase, assembled to lines.
+
+    Carriage return progress updates are collapsed to the last
+    state of the line, as it is shown on a terminal.
+    """
+    def __init__(self, filename: str = None, tail_lines: int = 30):
+        self._filename = filename
+        self._file = None
+        self._partial = ''
+        self.prefix = ''
+        self.tail = collections.deque(maxlen=tail_lines)
+
+    def feed(self, text: str) -> List[str]:
+        text = (self._partial + text).replace('\r\n', '\n')
+        *lines, partial = text.split('\n')
+        # Keep a trailing carriage return, it may be followed by a newline
+        stripped = partial.rstrip('\r')
+        self._partial = stripped.rsplit('\r', 1)[-1] + partial[len(stripped):][:1]
+        lines = [line.rstrip('\r').rsplit('\r', 1)[-1] for line in lines]
+        self.tail.extend(lines)
+        if lines and self._filename:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self._filename), exist_ok=True)
+                self._file = open(self._filename, 'w')
+            self._file.write(''.join(line + '\n' for line in lines))
+        return lines
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> List[str]:
+        lines = self.feed('\n') if self._partial.rstrip('\r') else []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return lines
+
+
+class LogSink:
+    """Writes build output from a background thread.
+
+    Output is queued instead of printed by the thread producing it, a slow
+    console only holds up the build once max_pending chunks are waiting.
+    The output of every job phase is also written to its own log file in
+    the directory. In quiet mode, only the tail of failed jobs is shown.
+    """
+    def __init__(self, directory: str = None, quiet: bool = False, stream: IO[str]=None,
+                 max_pending: int = 4096, tail_lines: int = 30):
+        self._directory = directory
+        self._quiet = quiet
+        self._stream = stream
+        self._tail_lines = tail_lines
+        self._channels = {}  # type: Dict[str, _Channel]
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='baka-log', daemon=True)
+        self._thread.start()
+
+    @property
+    def directory(self) -> Optional[str]:
+        return self._directory
+
+    def write(self, text: str, prefix: str = '', channel: str = 'container'):
+        self._queue.put(('write', channel, text, prefix))
+
+    def failed(self, channel: str, message: str):
+        """Report a failed job, in quiet mode its last lines are shown."""
+        self._queue.put(('failed', channel, message, ''))
+
+    def flush(self):
+        """Wait until all queued output is written."""
+        done = threading.Event()
+        self._queue.put(('flush', None, done, ''))
+        done.wait()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def filename(self, channel: str) -> Optional[str]:
+        if not self._directory:
+            return None
+        return os.path.join(self._directory, channel + '.log')
+
+    def _channel(self, name: str) -> _Channel:
+        if name not in self._channels:
+            self._channels[name] = _Channel(self.filename(name), self._tail_lines)
+        return self._channels[name]
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                # Nothing is waiting, make the output visible
+                self._flush()
+                item = self._queue.get()
+            if item is None:
+                break
+            self._handle(*item)
+        self._close()
+
+    def _handle(self, action: str, channel: str, data, prefix: str):
+        if action == 'write':
+            channel = self._channel(channel)
+            channel.prefix = prefix
+            lines = channel.feed(data)
+            if not self._quiet:
+                self._write([prefix + line for line in lines])
+        elif action == 'failed':
+            if self._quiet:
+                self._write([data] + ['    ' + line for line in self._channel(channel).tail])
+        else:
+            self._flush()
+            data.set()
+
+    def _write(self, lines: List[str]):
+        if lines:
+            (self._stream or sys.stdout).write(''.join(line + '\n' for line in lines))
+
+    def _flush(self):
+        for channel in self._channels.values():
+            channel.flush()
+        (self._stream or sys.stdout).flush()
+
+    def _close(self):
+        for channel in self._channels.values():
+            lines = channel.close()
+            if not self._quiet:
+                self._write([channel.prefix + line for line in lines])
+        (self._stream or sys.stdout).flush()
+
+
+_sink = None  # type: LogSink
+_scope = threading.local()
+
+
+def enable(directory: str = None, quiet: bool = False, **kwargs) -> LogSink:
+    """Send the output of all containers to a new log sink."""
+    global _sink
+    disable()
+    _sink = LogSink(directory, quiet, **kwargs)
+    return _sink
+
+
+def disable():
+    """Write the pending output and stop the log sink."""
+    global _sink
+    sink, _sink = _sink, None
+    if sink is not None:
+        sink.close()
+
+
+def active() -> Optional[LogSink]:
+    return _sink
+
+
+def flush():
+    sink = _sink
+    if sink is not None:
+        sink.flush()
+
+
+def failed(channel: str, message: str):
+    sink = _sink
+    if sink is not None:
+        sink.failed(channel, message)
+
+
+@contextlib.contextmanager
+def scope(subdirectory: str):
+    """Put the log files of containers created by the current thread in the enclosed block into a subdirectory."""
+    previous = current_scope()
+    _scope.subdirectory = os.path.join(previous, subdirectory)
+    try:
+        yield
+    finally:
+        _scope.subdirectory = previous
+
+
+def current_scope() -> str:
+    return getattr(_scope, 'subdirectory', None) or ''
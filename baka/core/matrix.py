@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List, Tuple
+
+import concurrent.futures
+import itertools
+import json
+import os
+import re
+import time
+
+from .container import log_scope
+from .declarative import load_project
+from .snapshots import SnapshotCache
+from .buildcache import BuildCache
+from .run import run
+from . import logsink
+from . import tracing
+
+
+# Keys of the matrix, in the order they are combined
+matrix_keys = ('image', 'arch')
+
+
+class MatrixResult:
+    """Outcome of building one combination of the matrix."""
+    def __init__(self, combination: Dict[str, str], artifacts_path: str):
+        self.combination = combination
+        self.artifacts_path = artifacts_path
+        self.artifacts = []
+        self.success = False
+        self.error = None
+        self.duration = 0.0
+
+    @property
+    def label(self) -> str:
+        return '/'.join(self.combination[key] for key in matrix_keys if key in self.combination) or 'default'
+
+    def to_dict(self) -> Dict:
+        return {
+            'combination': self.combination,
+            'success': self.success,
+            'error': self.error,
+            'duration': self.duration,
+            'artifacts_path': self.artifacts_path,
+            'artifacts': self.artifacts
+        }
+
+
+def combinations(matrix: Dict[str, List[str]]) -> List[Dict[str, str]]:
+    """All combinations of the matrix values, a single empty combination for an empty matrix."""
+    keys = [key for key in matrix_keys if matrix.get(key)]
+    return [dict(zip(keys, values)) for values in itertools.product(*(matrix[key] for key in keys))]
+
+
+def _subdirectory(combination: Dict[str, str]) -> str:
+    return re.sub(r'[^\w.-]', '_', '-'.join(combination[key] for key in matrix_keys if key in combination))
+
+
+def run_matrix(filename: str, matrix: Dict[str, List[str]]=None, backend_type: str = None,
+               backend_options: Dict=None, skip_jobs: Tuple[str] = None, skip_environment: bool = True,
+               artifacts_path: str = None, parallel_jobs: int = 1, max_parallel: int = 2,
+               snapshots: SnapshotCache = None, build_cache: BuildCache = None) -> List[MatrixResult]:
+    """Build the project once for each combination of the matrix.
+
+    The matrix of the project file is used, entries of the given matrix replace it.
+    Up to max_parallel combinations are built concurrently, each in its own
+    container and with its own artifacts subdirectory. A JSON report of all
+    combinations is written to matrix-report.json in the artifacts directory.
+    """
+    artifacts_path = artifacts_path or '/tmp/baka'
+    project_matrix = dict(load_project(filename, artifacts_path=artifacts_path).matrix)
+    project_matrix.update(matrix or {})
+    results = []
+    for combination in combinations(project_matrix):
+        subdirectory = _subdirectory(combination)
+        results.append(MatrixResult(combination, os.path.join(artifacts_path, subdirectory)))
+
+    def build(result: MatrixResult):
+        options = dict(backend_options or {}, **result.combination)
+        if options.get('name'):
+            # Every combination needs its own container
+            options['name'] = '{}-{}'.format(options['name'], _subdirectory(result.combination))
+        os.makedirs(result.artifacts_path, exist_ok=True)
+        start = time.perf_counter()
+        try:
+            with log_scope('[{}] '.format(result.label)), logsink.scope(_subdirectory(result.combination)), \
+                    tracing.span('matrix.' + result.label, 'matrix'):
+                project = load_project(filename, artifacts_path=result.artifacts_path)
+                run(project, backend_type, options, skip_jobs, skip_environment, parallel_jobs,
+                    snapshots=snapshots, build_cache=build_cache)
+            result.success = True
+            result.artifacts = [artifact for job in project.jobs for artifact in job.artifacts]
+        except Exception as e:
+            result.error = '{}: {}'.format(type(e).__name__, e)
+        result.duration = time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+        list(executor.map(build, results))
+    write_report(results, os.path.join(artifacts_path, 'matrix-report.json'))
+    return results
+
+
+def format_report(results: List[MatrixResult]) -> str:
+    lines = ['{:<32} {:<8} {:>9} {:>9}'.format('Combination', 'Result', 'Duration', 'Artifacts')]
+    for result in results:
+        lines.append('{:<32} {:<8} {:>8.1f}s {:>9}'.format(
+            result.label[:32], 'success' if result.success else 'failed', result.duration, len(result.artifacts)
+        ))
+        if result.error:
+            lines.append('    {}'.format(result.error))
+    failed = sum(1 for result in results if not result.success)
+    lines.append('{} of {} combinations succeeded'.format(len(results) - failed, len(results)))
+    return '\n'.join(lines)
+
+
+def write_report(results: List[MatrixResult], filename: str):
+    with open(filename, 'w') as file:
+        json.dump([result.to_dict() for result in results], file, indent=2)
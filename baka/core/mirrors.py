@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from typing import List
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+
+from . import paths
+
+
+class GitMirror:
+    """Bare mirror of a git repository on the host.
+
+    The mirror is cloned once and fetched incrementally afterwards,
+    containers clone from the mirror instead of the remote repository.
+    """
+    def __init__(self, url: str, root: str = None):
+        self._url = url
+        self._root = root or paths.cache_path('git')
+        name = re.sub(r'[^\w.-]', '_', os.path.basename(url.rstrip('/')))
+        key = hashlib.sha256(url.encode()).hexdigest()[:16]
+        self._path = os.path.join(self._root, '{}-{}'.format(key, name))
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def root(self) -> str:
+        """Directory of all mirrors, it exists before any mirror is cloned."""
+        os.makedirs(self._root, exist_ok=True)
+        return self._root
+
+    def update(self):
+        """Clone or fetch the mirror, only new objects are transferred."""
+        with self._lock():
+            if os.path.isfile(os.path.join(self._path, 'HEAD')):
+                self._git('-C', self._path, 'remote', 'update', '--prune')
+                return
+            # Not a repository, e.g. an empty directory created by a container mount
+            shutil.rmtree(self._path, ignore_errors=True)
+            # Leftovers of an interrupted clone
+            shutil.rmtree(self._path + '.tmp', ignore_errors=True)
+            self._git('clone', '--mirror', self._url, self._path + '.tmp')
+            # Allow shallow and partial clones of any commit from the mirror
+            for key in ('uploadpack.allowFilter', 'uploadpack.allowAnySHA1InWant'):
+                self._git('-C', self._path + '.tmp', 'config', key, 'true')
+            os.rename(self._path + '.tmp', self._path)
+
+    @contextlib.contextmanager
+    def _lock(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with open(self._path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    @staticmethod
+    def _git(*args):
+        subprocess.check_call(['git'] + list(args), stdout=subprocess.DEVNULL)
+
+
+def clone_commands(url: str, path: str, ref: str = None, depth: int = None,
+                   filter_spec: str = None) -> List[List[str]]:
+    """Commands cloning url into path at the given ref (branch, tag or full commit id)."""
+    options = []
+    if depth:
+        options += ['--depth', str(depth)]
+    if filter_spec:
+        options += ['--filter', filter_spec]
+    if ref and re.match(r'^[0-9a-f]{40}$', ref):
+        # Commits can not be cloned directly, fetch them instead
+        return [
+            ['git', 'init', '-q', path],
+            ['git', '-C', path, 'remote', 'add', 'origin', url],
+            ['git', '-C', path, 'fetch'] + options + ['origin', ref],
+            ['git', '-C', path, 'checkout', '-q', 'FETCH_HEAD']
+        ]
+    if ref:
+        options += ['--branch', ref]
+    return [['git', 'clone'] + options + [url, path]]
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+
+def cache_path(*parts: str) -> str:
+    """Path inside the baka cache directory, the directory is created if necessary.
+
+    The location can be changed with $BAKA_CACHE_DIR, it defaults to $XDG_CACHE_HOME/baka.
+    """
+    if 'BAKA_CACHE_DIR' in os.environ:
+        root = os.environ['BAKA_CACHE_DIR']
+    else:
+        root = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'baka')
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List
+
+import hashlib
+import os
+import threading
+import uuid
+
+from .container import Container
+from .project import Project
+from . import paths
+from . import statefile
+
+
+class ContainerPool:
+    """Keeps initialized and prepared containers ready for builds.
+
+    Containers are grouped by (backend, image, arch). The pool state is
+    stored in the baka cache directory and shared between baka processes.
+    After a build a container is either cleaned up and handed back to
+    the pool (recycle) or destroyed. Pooled containers are replaced in the
+    background while the next build runs.
+    """
+    _home_path = '/home/baka'
+
+    def __init__(self, backend_type: str = None, backend_options: Dict=None,
+                 size: int = 1, recycle: bool = False, state_path: str = None):
+        self._backend_type = backend_type or os.environ.get('BAKA_DEFAULT_BACKEND', 'lxc')
+        self._backend_options = dict(backend_options or {})
+        self._size = size
+        self._recycle = recycle
+        self._state_path = state_path or os.path.join(paths.cache_path(), 'pool.json')
+        # Resolve the default image and arch of the backend
+        self._probe = self._container(Project(), name='baka-pool')
+        self._key = '{}:{}:{}'.format(self._backend_type, self._probe.image, self._probe.arch)
+        self._filling = None  # type: threading.Thread
+        # Containers of this process created outside of the pool
+        self._unpooled = set()
+
+    @property
+    def key(self) -> str:
+        return self._key
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def containers(self) -> Dict[str, Dict[str, List[str]]]:
+        with self._state() as state:
+            return state
+
+    def acquire(self, project: Project) -> Container:
+        """Hand out an initialized container, a new one is created if the pool is empty.
+
+        Pooled containers lack the host directories jobs mount, projects
+        with such jobs always get a new container.
+        """
+        name = None
+        if not self._job_mounts(project):
+            with self._state() as state:
+                entry = self._entry(state)
+                name = entry['idle'].pop(0) if entry['idle'] else None
+                if name:
+                    entry['busy'].append(name)
+            self._fill_in_background()
+        if name:
+            container = self._container(project, name=name, prepare=False)
+            container.log('Using pooled container {} ...'.format(name))
+        else:
+            name = self._reserve('busy')
+            container = self._container(project, name=name)
+            if self._job_mounts(project):
+                self._unpooled.add(name)
+        try:
+            container.init()
+        except Exception:
+            self._forget(name)
+            raise
+        return container
+
+    def release(self, container: Container, failed: bool = False):
+        """Hand back a container after a build and top up the pool."""
+        if self._recycle and not failed and container.name not in self._unpooled:
+            container.log('Recycling container ...')
+            result = container.exec(
+                'sh', '-c', "'rm -rf {0} && mkdir -p {0}'".format(self._home_path), log_output=False
+            )
+            if result.exit_code == 0:
+                with self._state() as state:
+                    entry = self._entry(state)
+                    # The container is destroyed if the pool lost track of it, e.g. by drain
+                    recycled = container.name in entry['busy']
+                    if recycled:
+                        entry['busy'].remove(container.name)
+                        entry['idle'].append(container.name)
+                if recycled:
+                    return
+        container.destroy()
+        self._forget(container.name)
+        self._unpooled.discard(container.name)
+
+    def fill(self):
+        """Create containers until the configured number of containers is idle."""
+        while True:
+            with self._state() as state:
+                entry = self._entry(state)
+                if len(entry['idle']) + len(entry['creating']) >= self._size:
+                    return
+            name = self._reserve('creating')
+            try:
+                self._container(Project(), name=name).init()
+            except Exception:
+                self._forget(name)
+                raise
+            with self._state() as state:
+                entry = self._entry(state)
+                entry['creating'].remove(name)
+                entry['idle'].append(name)
+
+    def wait(self):
+        """Wait until the pool is filled in the background."""
+        if self._filling is not None:
+            self._filling.join()
+
+    def drain(self):
+        """Destroy all idle containers."""
+        with self._state() as state:
+            entry = self._entry(state)
+            names = entry['idle']
+            entry['idle'] = []
+        for name in names:
+            container = self._container(Project(), name=name, prepare=False)
+            container.init()
+            container.destroy()
+
+    def _fill_in_background(self):
+        # Not a daemon thread, a container being created is not left half done at exit
+        if self._filling is None or not self._filling.is_alive():
+            self._filling = threading.Thread(target=self.fill, name='baka-pool-fill')
+            self._filling.start()
+
+    def _job_mounts(self, project: Project) -> Dict[str, str]:
+        mounts = {}
+        for job in project.jobs:
+            mounts.update(job.mounts(self._probe))
+        return mounts
+
+    def _container(self, project: Project, name: str, prepare: bool = True) -> Container:
+        options = dict(self._backend_options, name=name, ephemeral=False, prepare=prepare)
+        return Container(project, backend_type=self._backend_type, backend_options=options)
+
+    def _reserve(self, status: str) -> str:
+        digest = hashlib.sha1(self._key.encode()).hexdigest()[:8]
+        name = 'baka-pool-{}-{}'.format(digest, uuid.uuid4().hex[:6])
+        with self._state() as state:
+            self._entry(state)[status].append(name)
+        return name
+
+    def _forget(self, name: str):
+        with self._state() as state:
+            for names in self._entry(state).values():
+                if name in names:
+                    names.remove(name)
+
+    def _entry(self, state: Dict) -> Dict[str, List[str]]:
+        entry = state.setdefault(self._key, {})
+        for status in ('idle', 'busy', 'creating'):
+            entry.setdefault(status, [])
+        return entry
+
+    def _state(self):
+        return statefile.locked_state(self._state_path)
@@ -5,19 +5,79 @@ from typing import Tuple, Dict
 from .declarative import load_project
 from .container import Container
 from .project import Project
+from .pool import ContainerPool
+from .snapshots import SnapshotCache
+from .buildcache import BuildCache
+from . import tracing
 
 
+def _cached_container(container: Container, project: Project, backend_type: str, backend_options: Dict,
+                      snapshots: SnapshotCache, skip_environment: bool) -> Tuple[Container, str, bool]:
+    key = snapshots.key(container, project, skip_environment=skip_environment)
+    image = snapshots.lookup(key)
+    if not image:
+        return container, key, False
+    container.log('Using cached container snapshot {} ...'.format(image))
+    options = dict(backend_options or {}, name=container.name, image=image, prepare=False)
+    return Container(project, backend_type=backend_type, backend_options=options), key, True
+
+
+@tracing.traced('run', 'run')
 def run(project: Project, backend_type: str = None, backend_options: Dict = None,
-        skip_jobs: Tuple[str] = None, skip_environment: bool = True):
-    container = Container(project, backend_type=backend_type, backend_options=backend_options)
-    container.init()
-    container.run(skip_jobs=skip_jobs, skip_environment=skip_environment)
-    if container.ephemeral:
+        skip_jobs: Tuple[str] = None, skip_environment: bool = True, parallel_jobs: int = 1,
+        pool: ContainerPool = None, snapshots: SnapshotCache = None, build_cache: BuildCache = None):
+    container = None
+    if not pool:
+        container = Container(project, backend_type=backend_type, backend_options=backend_options)
+    if build_cache:
+        probe = container or Container(project, backend_type=backend_type, backend_options=backend_options)
+        with tracing.span('cache.restore', 'cache'):
+            fingerprints = build_cache.fingerprints(probe, project)
+            restored = build_cache.restore(project, fingerprints, skip_jobs)
+        for name in restored:
+            probe.log('Using cached build of {} ...'.format(name))
+        skip_jobs = tuple(skip_jobs or ()) + tuple(restored)
+        if all(job.name in skip_jobs for job in project.jobs):
+            probe.log('All jobs are up to date.')
+            return
+    if pool:
+        with tracing.span('pool.acquire', 'pool'):
+            container = pool.acquire(project)
+    elif snapshots:
+        container, key, hit = _cached_container(
+            container, project, backend_type, backend_options, snapshots, skip_environment
+        )
+        container.init()
+        if not hit:
+            if not skip_environment:
+                container.setup_environment()
+            with tracing.span('snapshot.store', 'cache'):
+                snapshots.store(key, container)
+        # The environment is part of the snapshot
+        skip_environment = True
+    else:
+        container.init()
+    try:
+        container.run(skip_jobs=skip_jobs, skip_environment=skip_environment, parallel_jobs=parallel_jobs)
+    except Exception:
+        if pool:
+            pool.release(container, failed=True)
+        raise
+    if build_cache:
+        with tracing.span('cache.store', 'cache'):
+            build_cache.store(project, fingerprints, skip_jobs)
+    if pool:
+        with tracing.span('pool.release', 'pool'):
+            pool.release(container)
+    elif container.ephemeral:
         container.destroy()
 
 
 def run_declarative(filename: str, backend_type: str = None, backend_options: Dict=None,
                     skip_jobs: Tuple[str] = None, skip_environment: bool = True,
-                    artifacts_path: str = None):
-    project = load_project(filename, artifacts_path=artifacts_path)
-    run(project, backend_type, backend_options, skip_jobs, skip_environment)
+                    artifacts_path: str = None, parallel_jobs: int = 1, pool: ContainerPool = None,
+                    snapshots: SnapshotCache = None, build_cache: BuildCache = None):
+    with tracing.span('project.load', 'project'):
+        project = load_project(filename, artifacts_path=artifacts_path)
+    run(project, backend_type, backend_options, skip_jobs, skip_environment, parallel_jobs,
+        pool=pool, snapshots=snapshots, build_cache=build_cache)
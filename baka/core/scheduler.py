@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from typing import Callable, Dict, List
+
+import concurrent.futures
+
+
+class DependencyError(Exception):
+    pass
+
+
+def _dependencies(jobs: List) -> Dict[str, List[str]]:
+    names = set(job.name for job in jobs)
+    dependencies = {}
+    for job in jobs:
+        for dep in job.depends:
+            if dep not in names:
+                raise DependencyError('Job "{}" depends on unknown job "{}".'.format(job.name, dep))
+        dependencies[job.name] = list(job.depends)
+    return dependencies
+
+
+def execution_order(jobs: List) -> List:
+    """Order jobs topologically while keeping the declared order where possible."""
+    dependencies = _dependencies(jobs)
+    done = set()
+    order = []
+    remaining = list(jobs)
+    while remaining:
+        for job in remaining:
+            if all(dep in done for dep in dependencies[job.name]):
+                break
+        else:
+            raise DependencyError('Circular job dependencies between {}.'.format(
+                ', '.join('"{}"'.format(job.name) for job in remaining)
+            ))
+        remaining.remove(job)
+        done.add(job.name)
+        order.append(job)
+    return order
+
+
+class JobScheduler:
+    """Runs a function for each job, respecting the job dependencies.
+
+    Independent jobs are run concurrently by up to max_workers threads.
+    After the first failure no further jobs are started and the
+    exception is raised once the running jobs have finished.
+    """
+    def __init__(self, jobs: List, max_workers: int = 1):
+        self._jobs = execution_order(jobs)
+        self._dependencies = _dependencies(jobs)
+        self._max_workers = max(1, max_workers)
+
+    def run(self, f: Callable):
+        if self._max_workers == 1:
+            for job in self._jobs:
+                f(job)
+            return
+        done = set()
+        pending = list(self._jobs)
+        running = {}
+        error = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    for job in list(pending):
+                        if all(dep in done for dep in self._dependencies[job.name]):
+                            pending.remove(job)
+                            running[executor.submit(f, job)] = job
+                else:
+                    # Fail fast: cancel everything that has not been started yet
+                    pending.clear()
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    job = running.pop(future)
+                    if future.exception() is not None:
+                        if error is None:
+                            error = future.exception()
+                    else:
+                        done.add(job.name)
+        if error is not None:
+            raise error
@@ -1,22 +1,79 @@
-from typing import Dict, Iterable, Optional
-from distutils.version import StrictVersion
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-import collections
+import functools
+import re
 import sys
 
-RunResult = collections.namedtuple(
-    'RunResult', ('output', 'exit_code')
-)
+
+class RunResult:
+    """Result of baka.box.run, the output is only decoded when it is accessed.
+
+    It behaves like the former named tuple of (output, exit_code).
+    """
+    def __init__(self, result):
+        self._result = result
+
+    @property
+    def output(self) -> str:
+        return self._result.output
+
+    @property
+    def exit_code(self) -> int:
+        return self._result.exit_code
+
+    def head(self, count: int = 10) -> List[str]:
+        return self._result.head(count)
+
+    def tail(self, count: int = 10) -> List[str]:
+        return self._result.tail(count)
+
+    def lines(self) -> Iterator[str]:
+        return self._result.lines()
+
+    def search(self, pattern: str, flags: int = 0) -> Iterator[str]:
+        return self._result.search(pattern, flags)
+
+    def __iter__(self):
+        return iter((self.output, self.exit_code))
+
+    def __getitem__(self, index):
+        return (self.output, self.exit_code)[index]
+
+    def __len__(self) -> int:
+        return 2
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (tuple, RunResult)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(tuple(self))
+
+    def __repr__(self) -> str:
+        return 'RunResult(output={!r}, exit_code={!r})'.format(self.output, self.exit_code)
 
 
 class APIError(Exception):
     pass
 
 
+@functools.lru_cache(maxsize=64)
+def parse_version(version: str) -> Tuple[int, ...]:
+    """Parse a version like "0.1.0" into a tuple of three integers, "0.1" is the same as "0.1.0"."""
+    if not re.match(r'^\d+(\.\d+){0,2}$', version):
+        raise APIError('Invalid version {}'.format(repr(version)))
+    parts = tuple(int(part) for part in version.split('.'))
+    return parts + (0,) * (3 - len(parts))
+
+
 def since(version: str):
+    required = parse_version(version)
+
     def _since(f):
+        @functools.wraps(f)
         def wrapper(self, *args, **kwargs):
-            if StrictVersion(self._version) < StrictVersion(version):
+            if self._version_info < required:
                 raise APIError(
                     'Method baka.{} is not supported in {}'.format(
                         f.__name__, repr(self._version)
@@ -39,6 +96,7 @@ class BaseAPI:
                     repr(version), repr(self._module_name)
                 ))
         self._version = version
+        self._version_info = parse_version(version)
 
 
 class ContainerAPI(BaseAPI):
@@ -71,17 +129,18 @@ class ContainerAPI(BaseAPI):
 
     @since('0.1.0')
     def run(self, command, *args, path: str = None, envvars: Dict[str, str] = None,
-            collect_output: bool = False, log_output: bool = True) -> RunResult:
+            collect_output: bool = False, log_output: bool = True, use_pty: bool = True) -> RunResult:
         if not path:
             path = self.job_path
         cmd_result = self._container.exec(
-            command, *args, path=path, envvars=envvars, collect_output=collect_output, log_output=log_output
-        )
-        run_result = RunResult(
-            output=cmd_result.output,
-            exit_code=cmd_result.exit_code
+            command, *args, path=path, envvars=envvars, collect_output=collect_output, log_output=log_output,
+            use_pty=use_pty
         )
-        return run_result
+        return RunResult(cmd_result)
+
+    @since('0.1.0')
+    def invalidate_envvars(self):
+        self._container.invalidate_envvars()
 
 
 class HostAPI(BaseAPI):
@@ -120,10 +179,10 @@ class API(BaseAPI):
 def require(module: str, min_version: str, max_version: str = None, backend: dict = None) -> Optional[API]:
     if module == 'python':
         python_version_str = '{}.{}.{}'.format(*sys.version_info[0:3])
-        if StrictVersion(python_version_str) < StrictVersion(min_version):
+        if sys.version_info[0:3] < parse_version(min_version):
             raise APIError('Python version {} is not supported'.format(python_version_str))
         if max_version:
-            if StrictVersion(python_version_str) >= StrictVersion(max_version):
+            if sys.version_info[0:3] >= parse_version(max_version):
                 raise APIError('Python version {} is not supported'.format(python_version_str))
         return
     if module != 'baka':
@@ -2,16 +2,35 @@
 
 from typing import Dict
 
+import functools
+import linecache
+
 from . import _api
+from .. import tracing
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(source: str, filename: str):
+    # Register the source, so tracebacks can show the script lines
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    return compile(source, filename, 'exec')
 
 
 class Scriptable:
-    def __init__(self, scripts: Dict[str, str]=None):
+    def __init__(self, scripts: Dict[str, str]=None, owner: str = 'scriptable'):
         self._scripts = scripts or {}
+        # Compile scripts right away, syntax errors are reported before any container is started
+        self._code = {
+            name: _compile(script, '<baka {}:{}>'.format(owner, name))
+            for name, script in self._scripts.items()
+        }
+
+    @property
+    def scripts(self) -> Dict[str, str]:
+        return self._scripts
 
     def _run_script(self, name: str, container):
-        if name in self._scripts:
-            script = self._scripts[name]
+        if name in self._code:
             backend = {
                 'job': self,
                 'container': container
@@ -22,4 +41,5 @@ class Scriptable:
                     module, min_version, max_version, backend=backend
                 )
 
-            exec(script, {}, {'require': require_wrapper})
+            with tracing.span('script.' + name, 'script'):
+                exec(self._code[name], {}, {'require': require_wrapper})
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List, Optional
+
+import hashlib
+import json
+import os
+import subprocess
+import time
+
+from .container import Container
+from .project import Project
+from . import backend
+from . import paths
+from . import statefile
+
+
+class SnapshotCache:
+    """Content-addressed cache of prepared containers.
+
+    The state of a container after the prepare steps and the environment
+    setup is stored as a local image (an LXD image or a committed Docker image).
+    It is keyed by a hash of everything that led to this state, so
+    containers can be launched from the image on later runs.
+    """
+    def __init__(self, index_path: str = None):
+        self._index_path = index_path or os.path.join(paths.cache_path(), 'snapshots.json')
+
+    @staticmethod
+    def key(container: Container, project: Project, skip_environment: bool = False) -> str:
+        env_scripts = {}
+        if project.environment and not skip_environment:
+            env_scripts = project.environment.scripts
+        data = json.dumps({
+            'backend': container.backend_type,
+            'image': container.image,
+            'arch': container.arch,
+            'prepare': container.prepare_fingerprint,
+            'environment': env_scripts
+        }, sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Returns the cached image for the key, if any."""
+        with self._index() as index:
+            if key not in index:
+                return None
+            index[key]['last_used'] = time.time()
+            return index[key]['image']
+
+    def store(self, key: str, container: Container):
+        image = container.snapshot_image(key)
+        container.log('Caching container snapshot as {} ...'.format(image))
+        size = container.publish(image)
+        with self._index() as index:
+            index[key] = {
+                'backend': container.backend_type,
+                'image': image,
+                'base_image': container.image,
+                'arch': container.arch,
+                'size': size,
+                'created': time.time(),
+                'last_used': time.time()
+            }
+
+    def entries(self) -> Dict[str, Dict]:
+        with self._index() as index:
+            return index
+
+    def prune(self, max_age: float = None, max_size: int = None) -> List[str]:
+        """Remove snapshots unused for longer than max_age seconds and
+        the least recently used ones until the total size fits into max_size bytes.
+
+        Without limits all snapshots are removed.
+        """
+        removed = []
+        with self._index() as index:
+            entries = sorted(index.items(), key=lambda item: item[1]['last_used'])
+            now = time.time()
+            total_size = sum(entry['size'] for _, entry in entries)
+            for key, entry in entries:
+                if max_age is None and max_size is None:
+                    expired = True
+                else:
+                    expired = max_age is not None and now - entry['last_used'] > max_age
+                    expired = expired or (max_size is not None and total_size > max_size)
+                if expired:
+                    try:
+                        backend.by_type(entry['backend']).delete_image(entry['image'])
+                    except subprocess.CalledProcessError:
+                        # Already removed by other means
+                        pass
+                    total_size -= entry['size']
+                    del index[key]
+                    removed.append(key)
+        return removed
+
+    def _index(self):
+        return statefile.locked_state(self._index_path)
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import fcntl
+import json
+import os
+
+
+@contextlib.contextmanager
+def locked_state(path: str):
+    """Load a JSON state file exclusively, changes to the yielded dict are written back."""
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = {}
+        if os.path.isfile(path):
+            with open(path) as file:
+                state = json.load(file)
+        yield state
+        with open(path + '.tmp', 'w') as file:
+            json.dump(state, file, indent=2)
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List, Optional, Set, Tuple
+
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import stat
+import tempfile
+
+
+def _sha256(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan(source: str, previous: Dict[str, Dict]=None, exclude: List[str]=None) -> Dict[str, Dict]:
+    """Describe all files below source by their relative path.
+
+    Files whose size and mtime match the previous manifest are not hashed again.
+    Relative paths listed in exclude are skipped, including their contents.
+    """
+    previous = previous or {}
+    exclude = set(os.path.normpath(path) for path in exclude or ())
+    manifest = {}
+    for root, dirs, files in os.walk(source):
+        dirs[:] = sorted(d for d in dirs if os.path.relpath(os.path.join(root, d), source) not in exclude)
+        for name in sorted(files) + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            filename = os.path.join(root, name)
+            path = os.path.relpath(filename, source)
+            if path in exclude:
+                continue
+            status = os.lstat(filename)
+            if os.path.islink(filename):
+                manifest[path] = {'link': os.readlink(filename)}
+                continue
+            entry = {'size': status.st_size, 'mtime': status.st_mtime, 'mode': stat.S_IMODE(status.st_mode)}
+            old = previous.get(path)
+            if old and old.get('size') == entry['size'] and old.get('mtime') == entry['mtime']:
+                entry['sha256'] = old['sha256']
+            else:
+                entry['sha256'] = _sha256(filename)
+            manifest[path] = entry
+    return manifest
+
+
+def diff(previous: Dict[str, Dict], current: Dict[str, Dict]) -> Tuple[List[str], List[str]]:
+    """Returns the changed and the removed paths."""
+    changed = []
+    for path, entry in current.items():
+        old = previous.get(path)
+        if old is None or any(old.get(key) != entry.get(key) for key in ('sha256', 'link', 'mode')):
+            changed.append(path)
+    removed = [path for path in previous if path not in current]
+    return changed, removed
+
+
+def _directories(manifest: Dict[str, Dict]) -> Set[str]:
+    directories = set()
+    for path in manifest:
+        parent = os.path.dirname(path)
+        while parent and parent not in directories:
+            directories.add(parent)
+            parent = os.path.dirname(parent)
+    return directories
+
+
+class DeltaSync:
+    """Incrementally synchronizes a local directory with a container directory.
+
+    A manifest of the transferred files is kept inside the container, only
+    changed files are pushed and files removed locally are deleted.
+    """
+    def __init__(self, source: str, dest: str, manifest_path: str):
+        self._source = source
+        self._dest = dest
+        self._manifest_path = manifest_path
+
+    def sync(self, c) -> Tuple[int, int]:
+        """Returns the number of transferred and removed files."""
+        previous = self._load_manifest(c)
+        current = scan(self._source, previous)
+        if previous is None:
+            c.log('No synchronization manifest found, copying all sources ...')
+            c.exec('rm', '-rf', self._dest)
+            self._push_all(c)
+            changed, removed = list(current), []
+        else:
+            changed, removed = diff(previous, current)
+            # Directories without files are removed as well. Removing comes first,
+            # a file can not be extracted over a directory or the other way round
+            self._remove(c, removed + sorted(_directories(previous) - _directories(current)))
+            if changed:
+                self._push_changed(c, changed)
+        self._store_manifest(c, current)
+        c.log('Synchronized sources: {} changed, {} removed'.format(len(changed), len(removed)))
+        return len(changed), len(removed)
+
+    def _push_all(self, c):
+        parent = os.path.dirname(self._dest)
+        c.exec('mkdir', '-p', parent)
+        c.push(self._source, parent)
+        source_dir = os.path.basename(os.path.normpath(self._source))
+        if source_dir != os.path.basename(self._dest):
+            c.exec('mv', os.path.join(parent, source_dir), self._dest)
+
+    def _remove(self, c, paths: List[str]):
+        for i in range(0, len(paths), 100):
+            c.exec('rm', '-rf', *(shlex.quote(os.path.join(self._dest, path)) for path in paths[i:i + 100]))
+
+    def _push_changed(self, c, changed: List[str]):
+        with tempfile.TemporaryDirectory(prefix='baka-sync-') as tmp:
+            # Stage the changed files with the same layout as the destination
+            staged = os.path.join(tmp, os.path.basename(self._dest))
+            for path in changed:
+                target = os.path.join(staged, path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(os.path.join(self._source, path), target, follow_symlinks=False)
+            c.push(staged, os.path.dirname(self._dest))
+
+    def _load_manifest(self, c) -> Optional[Dict[str, Dict]]:
+        result = c.exec(
+            'sh', '-c', shlex.quote('test -d {} && cat {}'.format(self._dest, self._manifest_path)),
+            collect_output=True, log_output=False, use_pty=False
+        )
+        if result.exit_code != 0:
+            return None
+        try:
+            return json.loads(result.output)
+        except ValueError:
+            return None
+
+    def _store_manifest(self, c, manifest: Dict[str, Dict]):
+        manifest_dir = os.path.dirname(self._manifest_path)
+        with tempfile.TemporaryDirectory(prefix='baka-sync-') as tmp:
+            staged = os.path.join(tmp, os.path.basename(manifest_dir))
+            os.mkdir(staged)
+            with open(os.path.join(staged, os.path.basename(self._manifest_path)), 'w') as file:
+                json.dump(manifest, file)
+            c.exec('mkdir', '-p', manifest_dir)
+            c.push(staged, os.path.dirname(manifest_dir))
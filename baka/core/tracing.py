@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Callable, Dict, List, Optional
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+
+class Span:
+    """A timed section of a build, spans opened inside are nested in it."""
+    def __init__(self, tracer: 'Tracer', name: str, category: str, args: Dict[str, Any]):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._start = None
+        self.args = args
+
+    def __enter__(self) -> 'Span':
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self._tracer._record(self._name, self._category, self._start, time.perf_counter(), self.args)
+
+
+class _NullSpan:
+    """Used while tracing is disabled."""
+    def __init__(self):
+        self.args = {}
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class Tracer:
+    """Records spans and counters of a build.
+
+    The recording can be exported in the Chrome trace event format
+    (chrome://tracing, Perfetto) or summarized as a table.
+    """
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._events = []  # type: List[Dict]
+        self._counters = {}  # type: Dict[str, int]
+        self._threads = {}  # type: Dict[int, str]
+        self._lock = threading.Lock()
+
+    def span(self, name: str, category: str = 'baka', **args) -> Span:
+        return Span(self, name, category, args)
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    @property
+    def events(self) -> List[Dict]:
+        with self._lock:
+            return list(self._events)
+
+    def chrome_trace(self) -> Dict:
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+            counters = dict(self._counters)
+        pid = os.getpid()
+        trace_events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in threads.items()
+        ]
+        for event in events:
+            trace_events.append({
+                'name': event['name'],
+                'cat': event['category'],
+                'ph': 'X',
+                'pid': pid,
+                'tid': event['thread'],
+                'ts': event['start'] * 1e6,
+                'dur': event['duration'] * 1e6,
+                'args': event['args']
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms', 'otherData': {'counters': counters}}
+
+    def write_chrome_trace(self, filename: str):
+        with open(filename, 'w') as file:
+            json.dump(self.chrome_trace(), file, default=str)
+
+    def summary(self) -> List[Dict]:
+        """Count, total, mean and maximum duration of the spans by name, longest total first."""
+        totals = {}
+        for event in self.events:
+            entry = totals.setdefault(event['name'], {'name': event['name'], 'count': 0, 'total': 0, 'max': 0})
+            entry['count'] += 1
+            entry['total'] += event['duration']
+            entry['max'] = max(entry['max'], event['duration'])
+        for entry in totals.values():
+            entry['mean'] = entry['total'] / entry['count']
+        return sorted(totals.values(), key=lambda entry: -entry['total'])
+
+    def format_summary(self, limit: int = 30) -> str:
+        lines = ['{:<40} {:>6} {:>10} {:>10} {:>10}'.format('Span', 'Count', 'Total', 'Mean', 'Max')]
+        for entry in self.summary()[:limit]:
+            lines.append('{:<40} {:>6} {:>9.2f}s {:>9.2f}s {:>9.2f}s'.format(
+                entry['name'][:40], entry['count'], entry['total'], entry['mean'], entry['max']
+            ))
+        for name, value in sorted(self.counters.items()):
+            lines.append('{:<40} {:>6}'.format(name, value))
+        return '\n'.join(lines)
+
+    def _record(self, name: str, category: str, start: float, end: float, args: Dict[str, Any]):
+        thread = threading.current_thread()
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self._events.append({
+                'name': name,
+                'category': category,
+                'thread': thread.ident,
+                'start': start - self._origin,
+                'duration': end - start,
+                'args': args
+            })
+
+
+_tracer = None  # type: Tracer
+
+
+def enable() -> Tracer:
+    """Start recording, returns the new tracer."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def active() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: str, category: str = 'baka', **args):
+    """Time the enclosed block, does nothing while tracing is disabled."""
+    tracer = _tracer
+    if tracer is None:
+        return _NullSpan()
+    return tracer.span(name, category, **args)
+
+
+def count(name: str, value: int = 1):
+    tracer = _tracer
+    if tracer is not None:
+        tracer.count(name, value)
+
+
+def traced(name: str, category: str = 'baka'):
+    """Decorator recording each call of a function or coroutine function as a span."""
+    def _traced(f: Callable):
+        if inspect.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, category):
+                    return await f(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return f(*args, **kwargs)
+        return wrapper
+
+    return _traced
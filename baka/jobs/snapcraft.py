@@ -1,27 +1,65 @@
 # -*- coding: utf-8 -*-
 
+from typing import Dict
+
+import hashlib
+import json
 import os.path
+import re
+import shlex
 
 from baka.core import Job
 from baka.core import Container
+from baka.core import paths
 
 
 class SnapcraftJob(Job):
+    """Builds a snap with snapcraft.
+
+    With the "parts-cache" option the snapcraft downloads and the
+    parts, stage and prime directories are kept on the host between builds,
+    so only changed parts are pulled and built again.
+    """
+    _cache_path = '/var/cache/baka/snapcraft'
+    _state_dirs = ('parts', 'stage', 'prime')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._snap_filename = 'snapcraft_{}.snap'.format(self.name)
+        self._parts_cache = bool(self.options.get('parts-cache', False))
+
+    def mounts(self, c: Container) -> Dict[str, str]:
+        mounts = super().mounts(c)
+        if self._parts_cache:
+            # Parts are built for a specific release and architecture
+            platform = re.sub(r'[^\w.-]', '_', '{}-{}'.format(c.image, c.arch))
+            key = hashlib.sha256(json.dumps([self.source, self.name, platform]).encode()).hexdigest()[:16]
+            mounts[self._cache_path] = paths.cache_path('snapcraft', 'downloads', platform)
+            mounts[self._parts_path] = paths.cache_path('snapcraft', 'parts', key)
+        return mounts
 
     def setup(self, c: Container, run_script: bool=True):
         super().setup(c, run_script=False)
-        c.log('Installing snapcraft ...')
-        c.exec('apt-get', 'install', '-y', 'snapcraft')
+        if self._snapcraft_up_to_date(c):
+            c.log('Snapcraft is already installed and up to date')
+        else:
+            c.log('Installing snapcraft ...')
+            c.exec('apt-get', 'install', '-y', 'snapcraft')
         # Run script
         if run_script:
             self._run_script('setup', c)
 
     def perform(self, c: Container, run_script: bool=True):
         super().perform(c, run_script=False)
-        c.exec('snapcraft', 'snap', '-o', self._snap_filename, path=self.path, envvars=self._envvars)
+        envvars = self._envvars
+        if self._parts_cache:
+            c.log('Restoring snapcraft parts ...')
+            self._copy_state(c, self._parts_path, self.path)
+            envvars = dict(envvars or {}, XDG_CACHE_HOME=self._cache_path)
+        result = c.exec('snapcraft', 'snap', '-o', self._snap_filename, path=self.path, envvars=envvars)
+        if self._parts_cache and result.exit_code == 0:
+            c.log('Caching snapcraft parts ...')
+            self._copy_state(c, self.path, self._parts_path)
         # Run script
         if run_script:
             self._run_script('perform', c)
@@ -34,3 +72,24 @@ class SnapcraftJob(Job):
         # Run script
         if run_script:
             self._run_script('finish', c)
+
+    @property
+    def _parts_path(self) -> str:
+        return os.path.join('/var/cache/baka/snapcraft-parts', self.name)
+
+    def _copy_state(self, c: Container, source: str, dest: str):
+        script = ' && '.join(
+            'rm -rf {1} && if [ -d {0} ]; then cp -a {0} {1}; fi'.format(
+                shlex.quote(os.path.join(source, name)), shlex.quote(os.path.join(dest, name))
+            ) for name in self._state_dirs
+        )
+        c.exec('sh', '-c', shlex.quote(script), log_output=False)
+
+    def _snapcraft_up_to_date(self, c: Container) -> bool:
+        # Installed and the same version apt would install
+        script = (
+            'installed=$(dpkg-query -W -f \'${Version}\' snapcraft 2>/dev/null) && '
+            '[ "$installed" = "$(apt-cache policy snapcraft | awk \'/Candidate:/ { print $2 }\')" ]'
+        )
+        result = c.exec('sh', '-c', shlex.quote(script), log_output=False, use_pty=False)
+        return result.exit_code == 0
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+from baka.core import Container, Project, run_declarative
+
+
+_assets_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'core', 'assets')
+_line = 'Unpacking ünïcödé-package (1.0-1) ... ✓'
+
+
+def _report(title: str, results: dict, unit: str):
+    print()
+    print(title)
+    for name, value in results.items():
+        print('{:>12}: {:8.2f} {}'.format(name, value, unit))
+
+
+class TestLocalBackend:
+    def _container(self, tmpdir, **options) -> Container:
+        options = dict({'name': 'benchmark', 'root': str(tmpdir.join('containers'))}, **options)
+        c = Container(Project(), backend_type='local', backend_options=options)
+        c.init()
+        return c
+
+    def test_exec_latency(self, tmpdir):
+        count = 50
+        results = {}
+        for mode, session in (('pty', False), ('pipe', False), ('session', True)):
+            c = self._container(tmpdir, session=session)
+            start = time.perf_counter()
+            for _ in range(count):
+                assert c.exec('true', log_output=False, use_pty=mode == 'pty').exit_code == 0
+            results[mode] = (time.perf_counter() - start) / count * 1000
+            c.destroy()
+        _report('Exec latency', results, 'ms')
+
+    def test_output_throughput(self, tmpdir):
+        size = len(_line.encode() + b'\n') * 200000
+        c = self._container(tmpdir)
+        results = {}
+        for mode in ('pty', 'pipe'):
+            start = time.perf_counter()
+            result = c.exec('yes', "'{}'".format(_line), '|', 'head', '-c', str(size),
+                            collect_output=True, log_output=False, use_pty=mode == 'pty')
+            duration = time.perf_counter() - start
+            assert result.output.startswith(_line)
+            results[mode] = size / duration / 1024 / 1024
+        c.destroy()
+        _report('Output throughput', results, 'MiB/s')
+
+    def test_transfer_throughput(self, tmpdir):
+        source = tmpdir.mkdir('source')
+        for i in range(200):
+            source.join('file{}.bin'.format(i)).write_binary(os.urandom(64 * 1024))
+        size = 200 * 64 * 1024
+        results = {}
+        for mode, bulk_transfer in (('tar', True), ('files', False)):
+            c = self._container(tmpdir, bulk_transfer=bulk_transfer)
+            start = time.perf_counter()
+            c.push(str(source), '/home/baka/')
+            results['push ' + mode] = size / (time.perf_counter() - start) / 1024 / 1024
+            dest = tmpdir.mkdir('pulled-' + mode)
+            start = time.perf_counter()
+            c.pull('/home/baka/source', str(dest))
+            results['pull ' + mode] = size / (time.perf_counter() - start) / 1024 / 1024
+            assert len(dest.join('source').listdir()) == 200
+            c.destroy()
+        _report('Transfer throughput', results, 'MiB/s')
+
+    def test_run_declarative(self, tmpdir):
+        results = {}
+        for name, skip_environment in (('jobs', True), ('environment', False)):
+            start = time.perf_counter()
+            run_declarative(
+                os.path.join(_assets_path, 'project_base.yaml'), backend_type='local',
+                backend_options={'name': 'benchmark', 'root': str(tmpdir.join('containers'))},
+                skip_environment=skip_environment, artifacts_path=str(tmpdir.join('artifacts'))
+            )
+            results[name] = (time.perf_counter() - start) * 1000
+        _report('run_declarative overhead', results, 'ms')
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import os
+import pty
+import select
+import subprocess
+import time
+
+from baka.core.backend.base import BaseCommand
+
+
+_line = 'Unpacking ünïcödé-package (1.0-1) ... ✓'
+_output_size = len(_line.encode() + b'\n') * 500000
+
+
+class HostCommand(BaseCommand):
+    def _build_command(self) -> str:
+        return ' '.join([self._command] + self._args)
+
+
+def _legacy_run(cmd: str) -> str:
+    # The read loop BaseCommand.run used before the output engine rework
+    output = ''
+    masters, slaves = zip(pty.openpty(), pty.openpty())
+    proc = subprocess.Popen(cmd, shell=True, stdin=slaves[0], stdout=slaves[0], stderr=slaves[1])
+    for fd in slaves:
+        os.close(fd)
+    readable = {masters[0]: None, masters[1]: None}
+    while readable:
+        for fd in select.select(readable, [], [])[0]:
+            try:
+                data = os.read(fd, 1024)
+            except OSError as e:
+                if e.errno != errno.EIO:
+                    raise
+                del readable[fd]
+            else:
+                if not data:
+                    del readable[fd]
+                else:
+                    try:
+                        output += data.decode()
+                    except UnicodeDecodeError:
+                        pass
+    for fd in masters:
+        os.close(fd)
+    proc.wait()
+    return output
+
+
+class TestOutputThroughput:
+    _args = ('yes', "'{}'".format(_line), '|', 'head', '-c', str(_output_size))
+
+    def _measure(self, f, exact: bool = True) -> float:
+        start = time.perf_counter()
+        output = f()
+        duration = time.perf_counter() - start
+        # Terminals translate line endings
+        output = output.replace('\r\n', '\n')
+        assert output.startswith(_line + '\n')
+        if exact:
+            assert len(output.encode()) == _output_size
+        return _output_size / duration / 1024 / 1024
+
+    def _run(self, use_pty: bool) -> str:
+        cmd = HostCommand('host', *self._args, collect_output=True, use_pty=use_pty)
+        cmd.run()
+        assert cmd.exit_code == 0
+        return cmd.output
+
+    def test_throughput(self):
+        results = {
+            # The legacy loop drops chunks with split multibyte sequences
+            'legacy': self._measure(lambda: _legacy_run(' '.join(self._args)), exact=False),
+            'pty': self._measure(lambda: self._run(use_pty=True)),
+            'pipe': self._measure(lambda: self._run(use_pty=False))
+        }
+        print()
+        for mode, rate in results.items():
+            print('{:>8}: {:8.1f} MiB/s'.format(mode, rate))
+        assert results['pipe'] > results['legacy']
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import time
+
+import baka
+
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(baka.__file__)))
+_heavy_modules = ('pylxd', 'yaml', 'pykwalify', 'distutils')
+
+_check_modules = """
+import sys
+{}
+loaded = [m for m in {!r} if m in sys.modules]
+assert not loaded, 'Imported at startup: {{}}'.format(', '.join(loaded))
+"""
+
+
+class TestStartup:
+    def _python(self, *args) -> float:
+        env = dict(os.environ, PYTHONPATH=_root)
+        start = time.perf_counter()
+        subprocess.check_call((sys.executable,) + args, env=env, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+    def _check(self, code: str, heavy_modules=_heavy_modules) -> float:
+        return self._python('-c', _check_modules.format(code, heavy_modules))
+
+    def test_imports(self):
+        results = {
+            'python': self._python('-c', 'pass'),
+            'help': self._python(os.path.join(_root, 'bin', 'baka'), '--help'),
+            'cli': self._check('import baka.cli'),
+            # Only the Docker backend is loaded, pylxd is not needed
+            'docker': self._check(
+                "import baka.core; baka.core.backend.by_type('docker')", heavy_modules=('pylxd', 'yaml')
+            ),
+            # Backend classes are still importable from the package
+            'lazy': self._check(
+                "from baka.core.backend import DockerBackend; assert DockerBackend.__name__ == 'DockerBackend'",
+                heavy_modules=('pylxd', 'yaml')
+            )
+        }
+        print()
+        for name, duration in results.items():
+            print('{:>8}: {:6.0f} ms'.format(name, duration * 1000))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import os
+
+from baka.core import BuildCache, Job, Project
+
+
+_Container = collections.namedtuple('Container', ('backend_type', 'image', 'arch', 'prepare_fingerprint'))
+
+
+class TestBuildCache:
+    _container = _Container('lxc', 'ubuntu:xenial', 'amd64', 'prepare')
+
+    def _write(self, path, content: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(content)
+
+    def _project(self, tmpdir, perform: str = 'pass') -> Project:
+        source = str(tmpdir.join('src'))
+        artifacts = str(tmpdir.join('src', '.baka'))
+        return Project(jobs=[
+            Job('lib', source, scripts={'perform': perform}, artifacts_path=artifacts),
+            Job('app', source, artifacts_path=artifacts, depends=['lib'], envvars={'A': '1'}),
+        ])
+
+    def test_fingerprints(self, tmpdir):
+        cache = BuildCache(str(tmpdir.join('cache')))
+        self._write(str(tmpdir.join('src', 'a.txt')), 'a')
+        project = self._project(tmpdir)
+        fingerprints = cache.fingerprints(self._container, project)
+        assert fingerprints['lib'] != fingerprints['app']
+        # Artifacts inside the source directory do not change the fingerprint
+        self._write(str(tmpdir.join('src', '.baka', 'lib.snap')), 'snap')
+        assert cache.fingerprints(self._container, project) == fingerprints
+        # Changed scripts also change the fingerprints of dependent jobs
+        changed = cache.fingerprints(self._container, self._project(tmpdir, perform='print(1)'))
+        assert changed['lib'] != fingerprints['lib']
+        assert changed['app'] != fingerprints['app']
+        self._write(str(tmpdir.join('src', 'a.txt')), 'changed')
+        assert cache.fingerprints(self._container, project)['lib'] != fingerprints['lib']
+
+    def test_restore(self, tmpdir):
+        cache = BuildCache(str(tmpdir.join('cache')))
+        self._write(str(tmpdir.join('src', 'a.txt')), 'a')
+        project = self._project(tmpdir)
+        fingerprints = cache.fingerprints(self._container, project)
+        assert cache.restore(project, fingerprints) == []
+        artifact = str(tmpdir.join('src', '.baka', 'lib.snap'))
+        self._write(artifact, 'snap')
+        project.jobs[0]._add_artifact(artifact)
+        cache.store(project, fingerprints)
+        os.remove(artifact)
+
+        project = self._project(tmpdir)
+        assert cache.restore(project, fingerprints) == ['lib', 'app']
+        assert project.jobs[0].artifacts == [artifact]
+        with open(artifact) as file:
+            assert file.read() == 'snap'
+        assert BuildCache(str(tmpdir.join('cache')), rebuild=True).restore(project, fingerprints) == []
+
+    def test_restore_required(self, tmpdir):
+        cache = BuildCache(str(tmpdir.join('cache')))
+        self._write(str(tmpdir.join('src', 'a.txt')), 'a')
+        project = self._project(tmpdir)
+        fingerprints = cache.fingerprints(self._container, project)
+        cache.store(project, fingerprints, skip_jobs=('app.finish',))
+        # The dependency has to run again for the job which is not cached
+        assert cache.restore(project, fingerprints) == []
+        assert cache.restore(project, fingerprints, skip_jobs=('app',)) == ['lib']
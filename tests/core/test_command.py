@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from baka.core.backend.base import BaseCommand, CommandResult
+from baka.core.backend.output import OutputBuffer
+
+
+class HostCommand(BaseCommand):
+    def _build_command(self) -> str:
+        return ' '.join([self._command] + self._args)
+
+
+class TestCommand:
+    def test_run(self):
+        for use_pty in (True, False):
+            stdout, stderr = [], []
+            cmd = HostCommand(
+                'host', 'printf', "'ü%.0s'", '$(seq 5000)', '&&', 'echo', 'oops', '>&2',
+                stdout=stdout.append, stderr=stderr.append, collect_output=True, use_pty=use_pty
+            )
+            cmd.run()
+            assert cmd.exit_code == 0
+            assert ''.join(stdout) == 'ü' * 5000
+            assert ''.join(stderr).replace('\r\n', '\n') == 'oops\n'
+            assert len(cmd.output) == 5000 + len(''.join(stderr))
+
+    def test_arun(self):
+        loop = asyncio.new_event_loop()
+        stdout = []
+        commands = [
+            HostCommand('host', 'echo', str(no), '&&', 'exit', str(no), stdout=stdout.append, collect_output=True)
+            for no in range(20)
+        ]
+
+        async def run_all():
+            await asyncio.gather(*(cmd.arun() for cmd in commands))
+
+        loop.run_until_complete(run_all())
+        loop.close()
+        for no, cmd in enumerate(commands):
+            assert cmd.exit_code == no
+            assert cmd.output == '{}\n'.format(no)
+        assert sorted(stdout) == sorted('{}\n'.format(no) for no in range(20))
+
+
+class TestOutputBuffer:
+    def test_access(self):
+        for spill_size in (1024 * 1024, 16):
+            output = OutputBuffer(spill_size)
+            output.append('first\r\nsecönd\r\n')
+            output.append('error: third\nlast')
+            assert output.spilled == (spill_size == 16)
+            assert output.size == len('first\r\nsecönd\r\nerror: third\nlast'.encode())
+            assert output.text() == 'first\r\nsecönd\r\nerror: third\nlast'
+            assert list(output.lines()) == ['first', 'secönd', 'error: third', 'last']
+            assert output.head(2) == ['first', 'secönd']
+            assert output.tail(2) == ['error: third', 'last']
+            assert output.tail(10) == output.head(10)
+            assert list(output.search(r'^(error|sec)')) == ['secönd', 'error: third']
+            output.close()
+
+        empty = OutputBuffer()
+        assert empty.text() == ''
+        assert empty.head() == empty.tail() == list(empty.lines()) == []
+
+    def test_close(self):
+        output = OutputBuffer(spill_size=16)
+        output.append(''.join('line {}\n'.format(no) for no in range(100)))
+        assert output.spilled
+        lines = output.lines()
+        assert next(lines) == 'line 0'
+        output.close()
+        # Spilled output is kept readable after closing, also by readers started before
+        assert next(lines) == 'line 1'
+        assert output.head(1) == ['line 0']
+        assert output.tail(1) == ['line 99']
+        assert output.text().count('\n') == 100
+        output.close()
+        assert output.tail(1) == ['line 99']
+
+    def test_spill(self):
+        cmd = HostCommand('host', 'seq', '100000', collect_output=True, use_pty=False)
+        cmd._output = OutputBuffer(spill_size=4096)
+        cmd.run()
+        result = cmd.result
+        assert cmd._output.spilled
+        assert result.output_size == len(''.join('{}\n'.format(no) for no in range(1, 100001)))
+        assert result.head(3) == ['1', '2', '3']
+        assert result.tail(2) == ['99999', '100000']
+        assert list(result.search('^9999[0-9]$')) == [str(no) for no in range(99990, 100000)]
+        assert sum(1 for _ in result.lines()) == 100000
+        assert CommandResult(0, 'a\nb\n').tail(1) == ['b']
@@ -2,9 +2,12 @@
 
 import os.path
 
+import pytest
+
 from baka.core import Container
 from baka.core import Environment
 from baka.core import load_project
+from baka.core import declarative
 
 
 class TestDeclarative:
@@ -36,3 +39,35 @@ class TestDeclarative:
         c.finish()
         c.exec('rm', '/home/baka/job_finish')
         c.destroy()
+
+    def test_load_cached(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('BAKA_CACHE_DIR', str(tmpdir))
+        filename = os.path.join(self._assets_path, 'project_base.yaml')
+        data = declarative.load_data(filename)
+        assert len(tmpdir.join('projects').listdir()) == 1
+
+        def fail(*args):
+            raise AssertionError('The cached project data should be used.')
+        monkeypatch.setattr(declarative, '_yaml_load', fail)
+        assert declarative.load_data(filename) == data
+        p = load_project(filename)
+        assert p.name == 'test-project'
+        assert p.jobs[0].name == 'job0'
+        with pytest.raises(AssertionError):
+            declarative.load_data(filename, use_cache=False)
+
+    def test_load_invalid(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('BAKA_CACHE_DIR', str(tmpdir.join('cache')))
+        filename = tmpdir.join('baka.yml')
+        filename.write('summary: Missing name\n')
+        for _ in range(2):
+            with pytest.raises(Exception):
+                load_project(str(filename))
+        assert tmpdir.join('cache', 'projects').listdir() == []
+
+    def test_load_unwritable_cache(self, tmpdir, monkeypatch):
+        # The cache directory can not be created below a file
+        tmpdir.join('file').write('')
+        monkeypatch.setenv('BAKA_CACHE_DIR', str(tmpdir.join('file', 'cache')))
+        p = load_project(os.path.join(self._assets_path, 'project_base.yaml'))
+        assert p.name == 'test-project'
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+import http.server
+import io
+import json
+import os
+import socketserver
+import struct
+import subprocess
+import tarfile
+import threading
+import urllib.parse
+
+import pytest
+
+from baka.core import Container, Project
+from baka.core.backend.engine import EngineClient, EngineError, split_image
+
+
+class _FakeEngineHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_HEAD(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def do_PUT(self):
+        self._dispatch()
+
+    def do_DELETE(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        url = urllib.parse.urlparse(self.path)
+        assert url.path.startswith('/v1.25/')
+        parts = url.path.split('/')[2:]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        body = self._read_body()
+        engine = self.server
+        if parts == ['containers', 'json']:
+            return self._json(200, [{'Id': name, 'Names': ['/' + name]} for name in engine.containers])
+        if parts == ['containers', 'create']:
+            if json.loads(body.decode())['Image'] not in engine.images:
+                return self._json(404, {'message': 'No such image'})
+            engine.containers[query['name']] = engine.root(query['name'])
+            os.makedirs(engine.containers[query['name']])
+            return self._json(201, {'Id': query['name']})
+        if parts == ['images', 'create']:
+            engine.images.add('{}:{}'.format(query['fromImage'], query['tag']))
+            return self._json(200, {'status': 'Downloaded'})
+        if parts[0] == 'containers' and parts[1] not in engine.containers:
+            return self._json(404, {'message': 'No such container: ' + parts[1]})
+        if parts[0] == 'containers' and len(parts) == 2 and self.command == 'DELETE':
+            del engine.containers[parts[1]]
+            return self._empty(204)
+        if parts[0] == 'containers' and parts[2] == 'start':
+            return self._empty(204)
+        if parts[0] == 'containers' and parts[2] == 'exec':
+            exec_id = str(len(engine.execs))
+            engine.execs[exec_id] = dict(json.loads(body.decode()), Container=parts[1])
+            return self._json(201, {'Id': exec_id})
+        if parts[0] == 'containers' and parts[2] == 'archive':
+            return self._archive(engine.containers[parts[1]] + query['path'], body)
+        if parts[0] == 'exec' and parts[2] == 'start':
+            return self._exec_start(engine.execs[parts[1]], json.loads(body.decode())['Tty'])
+        if parts[0] == 'exec' and parts[2] == 'json':
+            return self._json(200, {'ExitCode': engine.execs[parts[1]]['ExitCode']})
+        if parts == ['commit']:
+            engine.images.add('{}:{}'.format(query['repo'], query['tag']))
+            return self._json(201, {'Id': 'sha256:0'})
+        if parts[0] == 'images' and parts[2] == 'json':
+            return self._json(200, {'Size': 1024})
+        return self._json(404, {'message': 'page not found'})
+
+    def _exec_start(self, exec_, tty: bool):
+        root = self.server.containers[exec_['Container']]
+        # Container paths are moved below the root of the fake container
+        cmd = [arg.replace('/home/baka', root + '/home/baka') for arg in exec_['Cmd']]
+        env = dict(os.environ, **dict(var.split('=', 1) for var in exec_['Env']))
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        exec_['ExitCode'] = proc.returncode
+        self.send_response(101)
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Upgrade', 'tcp')
+        self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+        self.end_headers()
+        if tty:
+            self.wfile.write(proc.stdout + proc.stderr)
+        else:
+            for stream, data in ((1, proc.stdout), (2, proc.stderr)):
+                if data:
+                    self.wfile.write(struct.pack('>BxxxL', stream, len(data)) + data)
+        self.close_connection = True
+
+    def _archive(self, path: str, body: bytes):
+        if not os.path.exists(path):
+            return self._json(404, {'message': 'Could not find the file ' + path})
+        if self.command == 'HEAD':
+            return self._empty(200)
+        if self.command == 'PUT':
+            self.server.archives.append(body)
+            with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+                tar.extractall(path)
+            return self._empty(200)
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w') as tar:
+            tar.add(path, arcname=os.path.basename(path))
+        self._send(200, data.getvalue(), 'application/x-tar')
+
+    def _read_body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    return body
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _json(self, status: int, data):
+        self._send(status, json.dumps(data).encode(), 'application/json')
+
+    def _empty(self, status: int):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send(self, status: int, data: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+
+class FakeEngine(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Stand-in for the Docker daemon, containers are directories on the host."""
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, root: str):
+        super().__init__(socket_path, _FakeEngineHandler)
+        self._root = root
+        self.connections = 0
+        self.containers = {}
+        self.images = {'ubuntu:xenial'}
+        self.execs = {}
+        self.archives = []
+
+    def root(self, name: str) -> str:
+        return os.path.join(self._root, name)
+
+
+@pytest.fixture
+def fake_engine(tmpdir):
+    socket_path = str(tmpdir.join('docker.sock'))
+    engine = FakeEngine(socket_path, str(tmpdir.mkdir('containers')))
+    thread = threading.Thread(target=engine.serve_forever, daemon=True)
+    thread.start()
+    yield engine
+    engine.shutdown()
+    engine.server_close()
+
+
+class TestEngineClient:
+    def _client(self, engine: FakeEngine) -> EngineClient:
+        client = EngineClient(engine.server_address)
+        client.create_container('test-case-container', 'ubuntu:xenial')
+        return client
+
+    def test_connection_reuse(self, fake_engine):
+        client = self._client(fake_engine)
+        for _ in range(10):
+            assert client.containers()[0]['Names'] == ['/test-case-container']
+        assert client.connections == 1
+        assert fake_engine.connections == 1
+
+    def test_exec(self, fake_engine):
+        client = self._client(fake_engine)
+        stdout, stderr = [], []
+        exec_id = client.exec_create('test-case-container', ['bash', '-c', 'echo out; echo err >&2; exit 3'],
+                                     {'VALUE': 'a b'})
+        client.exec_start(exec_id, stdout=stdout.append, stderr=stderr.append)
+        assert b''.join(stdout) == b'out\n'
+        assert b''.join(stderr) == b'err\n'
+        assert client.exec_exit_code(exec_id) == 3
+
+        # Values are passed as they are, without a shell in between
+        exec_id = client.exec_create('test-case-container', ['bash', '-c', 'echo $VALUE'], {'VALUE': 'a  $b'}, tty=True)
+        client.exec_start(exec_id, tty=True, stdout=stdout.append)
+        assert stdout[-1] == b'a $b\n'
+        # Hijacked connections are not reused, the others are
+        assert client.connections == 3
+
+    def test_errors(self, fake_engine):
+        client = self._client(fake_engine)
+        with pytest.raises(EngineError) as e:
+            client.exec_create('missing', ['true'])
+        assert e.value.status == 404
+        assert 'No such container: missing' in str(e.value)
+        assert not client.archive_exists('test-case-container', '/missing')
+        # The connection is still usable after an error
+        assert client.containers()
+        assert client.connections == 1
+
+    def test_create_pulls_image(self, fake_engine):
+        client = EngineClient(fake_engine.server_address)
+        client.create_container('test-case-container', 'ubuntu:bionic')
+        assert 'ubuntu:bionic' in fake_engine.images
+        assert 'test-case-container' in fake_engine.containers
+
+    def test_split_image(self):
+        assert split_image('ubuntu:xenial') == ('ubuntu', 'xenial')
+        assert split_image('ubuntu') == ('ubuntu', 'latest')
+        assert split_image('localhost:5000/ubuntu') == ('localhost:5000/ubuntu', 'latest')
+        assert split_image('localhost:5000/ubuntu:xenial') == ('localhost:5000/ubuntu', 'xenial')
+
+
+class TestDockerEngineBackend:
+    def test_run(self, fake_engine, tmpdir):
+        c = Container(Project(), backend_type='docker', backend_options={
+            'name': 'test-case-container',
+            'image': 'ubuntu:bionic',
+            'engine_api': True,
+            'docker_socket': fake_engine.server_address,
+            'prepare': False,
+            'network_probes': ['cmd:true']
+        })
+        c.init()
+        assert c.ready
+        root = fake_engine.containers['test-case-container']
+        assert c.exec('mkdir', '-p', '/home/baka').exit_code == 0
+        result = c.exec('echo', '$HOME', envvars={'HOME': '/home/baka'}, collect_output=True, log_output=False)
+        assert result.output.strip() == '/home/baka'
+
+        # Push & pull through archives
+        source = tmpdir.mkdir('source')
+        source.join('a.txt').write('a')
+        c.push(str(source), '/home/baka/sources')
+        assert open(os.path.join(root, 'home', 'baka', 'sources', 'source', 'a.txt')).read() == 'a'
+        assert c._backend.transfer_stats['pushed_bytes'] > 0
+        pulled = tmpdir.mkdir('pulled')
+        c.pull('/home/baka/sources/source', str(pulled))
+        assert pulled.join('source', 'a.txt').read() == 'a'
+        c.pull('/home/baka/sources/source/a.txt', str(pulled.join('b.txt')))
+        assert pulled.join('b.txt').read() == 'a'
+
+        assert c.publish('baka-cache:test') == 1024
+        c.destroy()
+        assert 'test-case-container' not in fake_engine.containers
+
+    def test_compressed_push(self, fake_engine, tmpdir):
+        c = Container(Project(), backend_type='docker', backend_options={
+            'name': 'test-case-container',
+            'image': 'ubuntu:xenial',
+            'engine_api': True,
+            'docker_socket': fake_engine.server_address,
+            'prepare': False,
+            'network_probes': ['cmd:true'],
+            'transfer_compression': 'gz'
+        })
+        c.init()
+        root = fake_engine.containers['test-case-container']
+        source = tmpdir.mkdir('source')
+        source.join('a.txt').write('a')
+        c.push(str(source), '/home/baka/sources')
+        assert open(os.path.join(root, 'home', 'baka', 'sources', 'source', 'a.txt')).read() == 'a'
+        # The archive endpoint receives a gzip stream
+        assert fake_engine.archives[-1][:2] == b'\x1f\x8b'
+        c.destroy()
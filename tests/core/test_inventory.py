@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from baka.core import Container, Project
+from baka.core.backend import inventory
+
+
+class TestInventory:
+    def _inventory(self, names, ttl: float = 60):
+        calls = []
+
+        def list_names():
+            calls.append(1)
+            return names
+        return inventory.Inventory(list_names, ttl=ttl), calls
+
+    def test_cached(self):
+        inv, calls = self._inventory(['a', 'b'])
+        assert inv.exists('a')
+        assert not inv.exists('c')
+        assert inv.names() == {'a', 'b'}
+        assert len(calls) == 1
+        inv.invalidate()
+        assert inv.exists('b')
+        assert len(calls) == 2
+
+    def test_expiry(self):
+        inv, calls = self._inventory(['a'], ttl=0)
+        inv.exists('a')
+        inv.exists('a')
+        assert len(calls) == 2
+
+    def test_generate_name(self):
+        inv, calls = self._inventory(['baka-builder-0', 'baka-builder-1', 'baka-builder-3'])
+        assert inv.generate_name('baka-builder') == 'baka-builder-2'
+        # Reserved names are not handed out twice
+        assert inv.generate_name('baka-builder') == 'baka-builder-4'
+        inv.discard('baka-builder-2')
+        assert inv.generate_name('baka-builder') == 'baka-builder-2'
+        assert len(calls) == 1
+
+    def test_add_discard(self):
+        inv, calls = self._inventory(['a'])
+        inv.exists('a')
+        inv.add('b')
+        assert inv.names() == {'a', 'b'}
+        inv.discard('a')
+        assert inv.names() == {'b'}
+        assert len(calls) == 1
+
+    def test_shared(self):
+        assert inventory.get('test', 'a', list) is inventory.get('test', 'a', list)
+        # Container hosts of the same backend type have their own inventory
+        assert inventory.get('test', 'a', list) is not inventory.get('test', 'b', list)
+
+    def test_local_roots(self, tmpdir):
+        tmpdir.mkdir('first').mkdir('baka-local-0')
+        tmpdir.mkdir('second')
+        names = []
+        for root in ('first', 'second'):
+            c = Container(Project(), backend_type='local', backend_options={'root': str(tmpdir.join(root))})
+            names.append(c.name)
+        assert names == ['baka-local-1', 'baka-local-0']
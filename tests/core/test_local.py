@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import threading
+import time
+
+import pytest
+
+from baka.core import Container, Environment, NetworkError, Project, run_declarative
+from baka.core.backend import _utils
+
+
+class TestLocal:
+    _assets_path = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def _options(self, tmpdir, **options):
+        return dict({'name': 'test-case-container', 'root': str(tmpdir.join('containers'))}, **options)
+
+    def test_run(self, tmpdir):
+        c = Container(Project(), backend_type='local', backend_options=self._options(tmpdir))
+        assert c.name == 'test-case-container'
+        c.init()
+        assert c.ready
+        root = str(tmpdir.join('containers', 'test-case-container'))
+        assert os.path.isdir(os.path.join(root, 'home', 'baka'))
+
+        # Container paths are moved below the root
+        assert c.exec('touch', '/home/baka/test.txt').exit_code == 0
+        assert os.path.isfile(os.path.join(root, 'home', 'baka', 'test.txt'))
+        result = c.exec('pwd', path='/home/baka', collect_output=True, log_output=False, use_pty=False)
+        assert result.output.strip() == os.path.join(root, 'home', 'baka')
+        result = c.exec('sh', '-c', "'echo $VALUE'", envvars={'VALUE': '/home/baka/x'},
+                        collect_output=True, log_output=False, use_pty=False)
+        assert result.output.strip() == os.path.join(root, 'home', 'baka', 'x')
+
+        # Push & pull
+        source = tmpdir.mkdir('source')
+        source.join('a.txt').write('a')
+        c.push(str(source), '/home/baka/')
+        assert os.path.isfile(os.path.join(root, 'home', 'baka', 'source', 'a.txt'))
+        pulled = tmpdir.mkdir('pulled')
+        c.pull('/home/baka/source', str(pulled))
+        assert pulled.join('source', 'a.txt').read() == 'a'
+
+        c.destroy()
+        assert not c.ready
+        assert not os.path.exists(root)
+
+    def test_mounts(self, tmpdir):
+        shared = tmpdir.mkdir('shared')
+        c = Container(Project(), backend_type='local', backend_options=self._options(
+            tmpdir, mounts={'/var/cache/baka/shared': str(shared)}
+        ))
+        c.init()
+        assert c.exec('touch', '/var/cache/baka/shared/file').exit_code == 0
+        assert shared.join('file').check()
+        c.destroy()
+        assert shared.join('file').check()
+
+    def test_apt_cache(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('BAKA_CACHE_DIR', str(tmpdir.join('cache')))
+
+        def mounts(**options):
+            c = Container(Project(), backend_type='local', backend_options=self._options(tmpdir, **options))
+            return c._backend._mounts()
+        # Every image and architecture has its own archives directory
+        xenial = mounts(apt_cache=True, image='ubuntu:xenial', arch='amd64')['/var/cache/apt/archives']
+        assert xenial == str(tmpdir.join('cache', 'apt', 'ubuntu_xenial-amd64'))
+        assert os.path.isdir(xenial)
+        assert mounts(apt_cache=True, image='ubuntu:bionic', arch='amd64')['/var/cache/apt/archives'] != xenial
+        assert mounts(apt_cache=True, image='ubuntu:xenial', arch='arm64')['/var/cache/apt/archives'] != xenial
+        assert mounts(apt_cache=str(tmpdir.join('apt'))) == {'/var/cache/apt/archives': str(tmpdir.join('apt'))}
+        assert mounts() == {}
+
+    def test_apt_lock(self, tmpdir, monkeypatch):
+        # Commands of the local backend run on the host, record the installs instead
+        bin_path = tmpdir.mkdir('bin')
+        bin_path.join('apt-get').write('#!/bin/sh\necho start >> {0}\nsleep 0.2\necho end >> {0}\n'.format(
+            tmpdir.join('apt.log')
+        ))
+        bin_path.join('apt-get').chmod(0o755)
+        monkeypatch.setenv('PATH', '{}:{}'.format(bin_path, os.environ['PATH']))
+
+        def build(name):
+            options = self._options(tmpdir, name=name, apt_cache=str(tmpdir.join('apt')))
+            c = Container(Project(), backend_type='local', backend_options=options)
+            c.init()
+            assert c.exec('apt-get', 'install', '-y', 'snapcraft').exit_code == 0
+            c.destroy()
+        # Containers sharing the archives wait for each other
+        threads = [threading.Thread(target=build, args=('apt-{}'.format(i),)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert tmpdir.join('apt.log').read().split() == ['start', 'end', 'start', 'end']
+
+    def test_apt_update(self, tmpdir, monkeypatch):
+        # Commands of the local backend run on the host, record the updates instead
+        bin_path = tmpdir.mkdir('bin')
+        bin_path.join('apt-get').write('#!/bin/sh\necho "$@" >> {}\n'.format(tmpdir.join('apt.log')))
+        bin_path.join('apt-get').chmod(0o755)
+        monkeypatch.setenv('PATH', '{}:{}'.format(bin_path, os.environ['PATH']))
+        c = Container(Project(), backend_type='local', backend_options=self._options(tmpdir, apt_update_ttl=60))
+        c.init()
+        stamp = tmpdir.join('containers', 'test-case-container', 'var', 'cache', 'baka', 'apt-update-stamp')
+        _utils.run_sync(c._backend._apt_update())
+        assert tmpdir.join('apt.log').read() == 'update\n'
+        assert stamp.check()
+        # Skipped while the stamp is fresh
+        _utils.run_sync(c._backend._apt_update())
+        assert tmpdir.join('apt.log').read() == 'update\n'
+        stamp.setmtime(stamp.mtime() - 61 * 60)
+        _utils.run_sync(c._backend._apt_update())
+        assert tmpdir.join('apt.log').read() == 'update\nupdate\n'
+        c.destroy()
+
+    def test_envvars(self, tmpdir, monkeypatch):
+        c = Container(Project(environment=Environment(scripts={'setup': 'pass'})), backend_type='local',
+                      backend_options=self._options(tmpdir))
+        c.init()
+
+        def value(envvars):
+            result = c.exec('sh', '-c', "'echo $VALUE'", envvars=envvars,
+                            collect_output=True, log_output=False, use_pty=False)
+            return result.output.strip()
+        # Commands of the local backend see the environment of the host
+        monkeypatch.setenv('ENVVARS_TEST', 'first')
+        assert value({'VALUE': '$ENVVARS_TEST'}) == 'first'
+        monkeypatch.setenv('ENVVARS_TEST', 'second')
+        # The captured environment is reused, changed envvars are expanded with it
+        assert value({'VALUE': '$ENVVARS_TEST'}) == 'first'
+        assert value({'VALUE': '$ENVVARS_TEST-$OTHER', 'OTHER': 'other'}) == 'first-other'
+        c.invalidate_envvars()
+        assert value({'VALUE': '$ENVVARS_TEST'}) == 'second'
+        # Environment setup scripts may change the environment
+        monkeypatch.setenv('ENVVARS_TEST', 'third')
+        c.setup_environment()
+        assert value({'VALUE': '$ENVVARS_TEST'}) == 'third'
+        c.destroy()
+
+    @staticmethod
+    def _children():
+        pids = []
+        for pid in filter(str.isdigit, os.listdir('/proc')):
+            try:
+                with open(os.path.join('/proc', pid, 'stat')) as file:
+                    stat = file.read()
+            except OSError:
+                continue
+            # The parent pid follows the command name in parentheses and the state
+            if int(stat.rsplit(')', 1)[1].split()[1]) == os.getpid():
+                pids.append(int(pid))
+        return pids
+
+    def test_session(self, tmpdir):
+        c = Container(Project(), backend_type='local', backend_options=self._options(tmpdir, session=True))
+        c.init()
+        root = str(tmpdir.join('containers', 'test-case-container'))
+        # Session commands set HOME to the requested path like plain ones
+        result = c.exec('sh', '-c', "'echo $HOME'", path='/home/baka', collect_output=True, log_output=False)
+        assert result.output.strip() == os.path.join(root, 'home', 'baka')
+        c.destroy()
+
+    def test_tar_transfer(self, tmpdir):
+        c = Container(Project(), backend_type='local', backend_options=self._options(
+            tmpdir, transfer_compression='gz'
+        ))
+        c.init()
+        source = tmpdir.mkdir('source')
+        source.join('sub').mkdir().join('a.txt').write('a' * 100000)
+        c.push(str(source), '/home/baka/pushed')
+        assert tmpdir.join('containers', 'test-case-container', 'home', 'baka', 'pushed', 'source', 'sub',
+                           'a.txt').read() == 'a' * 100000
+        c.pull('/home/baka/pushed/source', str(tmpdir.mkdir('pulled')))
+        assert tmpdir.join('pulled', 'source', 'sub', 'a.txt').read() == 'a' * 100000
+        # Compressed transfers are smaller than the files
+        assert 0 < c._backend.transfer_stats['pushed_bytes'] < 100000
+        assert 0 < c._backend.transfer_stats['pulled_bytes'] < 100000
+        c.destroy()
+
+    def test_tar_failure(self, tmpdir):
+        c = Container(Project(), backend_type='local', backend_options=self._options(tmpdir))
+        c.init()
+        children = self._children()
+        # The archive is larger than the pipe buffers, the extracting end fails right away
+        source = tmpdir.mkdir('source')
+        source.join('data').write_binary(os.urandom(4 * 1024 * 1024))
+        assert c.exec('touch', '/home/baka/file').exit_code == 0
+        with pytest.raises(subprocess.CalledProcessError) as e:
+            c.push(str(source), '/home/baka/file/dest')
+        assert e.value.cmd == 'tar -x'
+        with pytest.raises(subprocess.CalledProcessError) as e:
+            c.pull('/home/baka/missing', str(tmpdir.mkdir('pulled')))
+        assert e.value.cmd == 'tar -c'
+        # Both ends were stopped and reaped
+        assert self._children() == children
+        c.destroy()
+
+    def test_network_timeout(self, tmpdir):
+        attempts = tmpdir.join('attempts')
+        c = Container(Project(), backend_type='local', backend_options=self._options(
+            tmpdir, network_probes=['cmd:echo >> {}; false'.format(attempts)], network_timeout=1
+        ))
+        c.init()
+        start = time.monotonic()
+        with pytest.raises(NetworkError):
+            _utils.run_sync(c._backend._wait_for_network())
+        assert time.monotonic() - start < 5
+        # The failing probe is retried with a growing delay until the deadline passes
+        assert 1 < len(attempts.readlines()) < 10
+        c.destroy()
+
+    def test_run_declarative(self, tmpdir):
+        run_declarative(
+            os.path.join(self._assets_path, 'project_base.yaml'), backend_type='local',
+            backend_options=self._options(tmpdir, ephemeral=False), artifacts_path=str(tmpdir.join('artifacts'))
+        )
+        home = tmpdir.join('containers', 'test-case-container', 'home', 'baka')
+        for name in ('job_setup', 'job_perform', 'job_finish'):
+            assert home.join(name).check()
+        assert home.join('job0', 'project_base.yaml').check()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+import pytest
+
+from baka.core import Container, Project, logsink, run_declarative
+
+
+_project = '''name: log-project
+jobs:
+  - name: job0
+    scripts:
+      perform: |
+        baka = require('baka', '0.1.0')
+        baka.box.run('printf', "'downloading 10%%\\\\rdownloading 100%%\\\\n'")
+        baka.log('performed')
+  - name: job1
+    depends: [job0]
+    scripts:
+      perform: |
+        baka = require('baka', '0.1.0')
+        baka.log('about to fail')
+        raise RuntimeError('failing job')
+'''
+
+
+class TestLogSink:
+    def teardown_method(self):
+        logsink.disable()
+
+    def test_carriage_returns(self, tmpdir):
+        stream = io.StringIO()
+        sink = logsink.LogSink(str(tmpdir), stream=stream)
+        # Progress updates may be split across chunks
+        for chunk in ('progress 10%\rprogress', ' 50%\r', 'progress 100%\r', '\ndone\r\n', 'partial'):
+            sink.write(chunk, '[job] ', 'job/perform')
+        sink.write('other\n')
+        sink.flush()
+        assert stream.getvalue() == '[job] progress 100%\n[job] done\nother\n'
+        sink.close()
+        assert stream.getvalue().endswith('[job] partial\n')
+        assert tmpdir.join('job', 'perform.log').read() == 'progress 100%\ndone\npartial\n'
+        assert tmpdir.join('container.log').read() == 'other\n'
+
+    def test_quiet(self, tmpdir):
+        stream = io.StringIO()
+        sink = logsink.LogSink(str(tmpdir), quiet=True, stream=stream, tail_lines=2)
+        sink.write('first\nsecond\nthird\n', channel='job/perform')
+        sink.flush()
+        assert stream.getvalue() == ''
+        sink.failed('job/perform', 'Job job failed:')
+        sink.close()
+        assert stream.getvalue() == 'Job job failed:\n    second\n    third\n'
+        assert tmpdir.join('job', 'perform.log').read() == 'first\nsecond\nthird\n'
+
+    def test_bounded(self):
+        stream = io.StringIO()
+        sink = logsink.LogSink(stream=stream, max_pending=1)
+        for i in range(100):
+            sink.write('{}\n'.format(i))
+        sink.close()
+        assert stream.getvalue().split() == [str(i) for i in range(100)]
+
+    def test_split_output(self, tmpdir):
+        stream = io.StringIO()
+        logsink.enable(str(tmpdir.join('logs')), stream=stream)
+        c = Container(Project(), backend_type='local', backend_options={
+            'name': 'log-container', 'root': str(tmpdir.join('containers'))
+        })
+        c.init()
+        # Progress updates and a line arrive in separate chunks
+        script = "printf 'Downloading 10%%\\r'; sleep 0.1; printf 'Downloading 100%%\\n'; sleep 0.1; " \
+                 "printf 'hello wo'; sleep 0.1; printf 'rld\\n'"
+        assert c.exec('sh', '-c', '"{}"'.format(script), use_pty=False).exit_code == 0
+        c.destroy()
+        logsink.disable()
+        lines = tmpdir.join('logs', 'container.log').read().splitlines()
+        assert lines[-3:] == ['Downloading 100%', 'hello world', 'Destroying ...']
+        assert 'Downloading 10%' not in lines
+        assert stream.getvalue().splitlines()[-3:] == lines[-3:]
+
+    def test_run(self, tmpdir, capsys):
+        project = tmpdir.join('baka.yml')
+        project.write(_project)
+        logs = tmpdir.join('logs')
+        logsink.enable(str(logs), quiet=True)
+        with pytest.raises(RuntimeError):
+            run_declarative(
+                str(project), backend_type='local',
+                backend_options={'name': 'log-project', 'root': str(tmpdir.join('containers'))},
+                artifacts_path=str(tmpdir.mkdir('artifacts'))
+            )
+        logsink.disable()
+        assert logs.join('job0', 'perform.log').read() == 'Performing job0 ...\ndownloading 100%\nperformed\n'
+        assert logs.join('job1', 'perform.log').read() == 'Performing job1 ...\nabout to fail\n'
+        assert 'Performing jobs ...' in logs.join('container.log').read()
+        # Only the failed job is shown
+        assert capsys.readouterr().out == (
+            'Job job1 failed during perform, last output:\n    Performing job1 ...\n    about to fail\n'
+        )
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+from baka.core import run_matrix, format_report
+from baka.core.matrix import combinations
+
+
+_project = '''name: matrix-project
+matrix:
+  image: [first, second]
+  arch: [amd64]
+jobs:
+  - name: job0
+    scripts:
+      perform: |
+        import os
+        baka = require('baka', '0.1.0')
+        if baka.box.image == 'broken':
+            raise RuntimeError('broken image')
+        with open(os.path.join(baka.host.artifacts_path, 'built'), 'w') as f:
+            f.write(baka.box.image + '/' + baka.box.arch)
+'''
+
+
+# Every combination waits until the other one is running as well
+_concurrent_project = '''name: matrix-project
+matrix:
+  image: [first, second]
+  arch: [amd64]
+jobs:
+  - name: job0
+    scripts:
+      perform: |
+        import os
+        import time
+        baka = require('baka', '0.1.0')
+        shared = os.path.dirname(baka.host.artifacts_path)
+        open(os.path.join(shared, baka.box.image + '.running'), 'w').close()
+        deadline = time.time() + 30
+        for image in ('first', 'second'):
+            while not os.path.exists(os.path.join(shared, image + '.running')):
+                if time.time() > deadline:
+                    raise RuntimeError('combinations did not run concurrently')
+                time.sleep(0.05)
+        output, exit_code = baka.box.run('echo', baka.box.image, collect_output=True)
+        with open(os.path.join(baka.host.artifacts_path, 'built'), 'w') as f:
+            f.write(output.strip())
+'''
+
+
+class TestMatrix:
+    def _run(self, tmpdir, matrix=None, content=_project, **kwargs):
+        project = tmpdir.join('baka.yml')
+        project.write(content)
+        return run_matrix(
+            str(project), matrix, backend_type='local',
+            backend_options={'name': 'matrix', 'root': str(tmpdir.join('containers'))},
+            artifacts_path=str(tmpdir.mkdir('artifacts')), **kwargs
+        )
+
+    def test_combinations(self):
+        assert combinations({}) == [{}]
+        assert combinations({'image': ['a', 'b'], 'arch': ['amd64', 'arm64']}) == [
+            {'image': 'a', 'arch': 'amd64'}, {'image': 'a', 'arch': 'arm64'},
+            {'image': 'b', 'arch': 'amd64'}, {'image': 'b', 'arch': 'arm64'}
+        ]
+        assert combinations({'image': [], 'arch': ['i386']}) == [{'arch': 'i386'}]
+
+    def test_run(self, tmpdir):
+        results = self._run(tmpdir, max_parallel=2)
+        assert [result.label for result in results] == ['first/amd64', 'second/amd64']
+        assert all(result.success for result in results)
+        artifacts = tmpdir.join('artifacts')
+        assert artifacts.join('first-amd64', 'built').read() == 'first/amd64'
+        assert artifacts.join('second-amd64', 'built').read() == 'second/amd64'
+        # Every combination had its own container, both are gone
+        assert not tmpdir.join('containers').listdir()
+
+        report = json.loads(artifacts.join('matrix-report.json').read())
+        assert [entry['combination'] for entry in report] == [
+            {'image': 'first', 'arch': 'amd64'}, {'image': 'second', 'arch': 'amd64'}
+        ]
+        assert report[0]['artifacts_path'] == os.path.join(str(artifacts), 'first-amd64')
+        assert '2 of 2 combinations succeeded' in format_report(results)
+
+    def test_concurrent(self, tmpdir):
+        # Both workers run subprocesses of their own event loops at the same time
+        results = self._run(tmpdir, content=_concurrent_project, max_parallel=2)
+        assert [result.error for result in results] == [None, None]
+        artifacts = tmpdir.join('artifacts')
+        assert artifacts.join('first-amd64', 'built').read() == 'first'
+        assert artifacts.join('second-amd64', 'built').read() == 'second'
+
+    def test_failure(self, tmpdir):
+        results = self._run(tmpdir, matrix={'image': ['first', 'broken']})
+        assert [result.success for result in results] == [True, False]
+        assert 'broken image' in results[1].error
+        assert tmpdir.join('artifacts', 'first-amd64', 'built').check()
+        report = format_report(results)
+        assert 'failed' in report
+        assert '1 of 2 combinations succeeded' in report
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+
+from baka.core import Job, Project, mirrors, run
+
+
+class TestMirrors:
+    def _git(self, *args) -> str:
+        return subprocess.check_output(
+            ['git', '-c', 'user.name=baka', '-c', 'user.email=baka@localhost'] + list(args)
+        ).decode().strip()
+
+    def _commit(self, work: str, content: str) -> str:
+        with open(os.path.join(work, 'file.txt'), 'w') as file:
+            file.write(content)
+        self._git('-C', work, 'add', 'file.txt')
+        self._git('-C', work, 'commit', '-q', '-m', content)
+        self._git('-C', work, 'push', '-q', 'origin', 'HEAD:master')
+        return self._git('-C', work, 'rev-parse', 'HEAD')
+
+    def _clone(self, url: str, path: str, **kwargs):
+        for command in mirrors.clone_commands(url, path, **kwargs):
+            subprocess.check_call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with open(os.path.join(path, 'file.txt')) as file:
+            return file.read()
+
+    def test_mirror(self, tmpdir):
+        remote = str(tmpdir.join('remote.git'))
+        work = str(tmpdir.join('work'))
+        self._git('init', '-q', '--bare', '-b', 'master', remote)
+        self._git('clone', '-q', remote, work)
+        first = self._commit(work, 'first')
+
+        mirror = mirrors.GitMirror(remote, root=str(tmpdir.join('mirrors')))
+        mirror.update()
+        assert os.path.isdir(mirror.path)
+        second = self._commit(work, 'second')
+        mirror.update()
+        assert self._git('-C', mirror.path, 'rev-parse', 'master') == second
+
+        url = 'file://' + mirror.path
+        assert self._clone(url, str(tmpdir.join('full'))) == 'second'
+        assert self._clone(url, str(tmpdir.join('branch')), ref='master', depth=1) == 'second'
+        assert self._git('-C', str(tmpdir.join('branch')), 'rev-list', '--count', 'HEAD') == '1'
+        assert self._clone(url, str(tmpdir.join('pinned')), ref=first, depth=1) == 'first'
+
+    def test_build_without_mirror(self, tmpdir, monkeypatch, capsys):
+        monkeypatch.setenv('BAKA_CACHE_DIR', str(tmpdir.join('cache')))
+        remote = str(tmpdir.join('remote.git'))
+        work = str(tmpdir.join('work'))
+        self._git('init', '-q', '--bare', '-b', 'master', remote)
+        self._git('clone', '-q', remote, work)
+        self._commit(work, 'first')
+        # A directory left by a container mount is not a mirror
+        job = Job('app', remote, artifacts_path=str(tmpdir.mkdir('artifacts')))
+        os.makedirs(job._mirror.path)
+
+        # The mirror is created after the container
+        run(Project(jobs=[job]), 'local', {'name': 'mirror', 'root': str(tmpdir.join('containers'))})
+        assert os.path.isfile(os.path.join(job._mirror.path, 'HEAD'))
+        out = capsys.readouterr().out
+        assert 'Cloning source repository from the mirror' in out
+        assert 'Could not update the git mirror' not in out
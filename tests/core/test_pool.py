@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from baka.core import ContainerPool, Job, Project
+
+
+class TestContainerPool:
+    def _pool(self, tmpdir, **kwargs) -> ContainerPool:
+        return ContainerPool(
+            'local', {'root': str(tmpdir.join('containers'))},
+            state_path=str(tmpdir.join('pool.json')), **kwargs
+        )
+
+    def _entry(self, pool: ContainerPool):
+        return pool.containers()[pool.key]
+
+    def test_acquire(self, tmpdir):
+        pool = self._pool(tmpdir)
+        container = pool.acquire(Project())
+        # The pool is filled while the build runs
+        pool.wait()
+        idle = self._entry(pool)['idle']
+        assert len(idle) == 1
+        assert self._entry(pool)['busy'] == [container.name]
+        pool.release(container)
+        # Released containers are not replaced synchronously
+        assert self._entry(pool) == {'idle': idle, 'busy': [], 'creating': []}
+        assert sorted(os.listdir(str(tmpdir.join('containers')))) == idle
+
+        container = pool.acquire(Project())
+        pool.wait()
+        assert container.name == idle[0]
+        assert len(self._entry(pool)['idle']) == 1
+        pool.release(container)
+        pool.drain()
+        assert not tmpdir.join('containers').listdir()
+
+    def test_recycle(self, tmpdir):
+        pool = self._pool(tmpdir, recycle=True)
+        container = pool.acquire(Project())
+        pool.wait()
+        container.exec('touch', '/home/baka/leftover')
+        pool.release(container)
+        assert container.name in self._entry(pool)['idle']
+        assert not tmpdir.join('containers', container.name, 'home', 'baka', 'leftover').check()
+
+        # Containers the pool lost track of are destroyed
+        container = pool.acquire(Project())
+        pool.wait()
+        pool._forget(container.name)
+        pool.release(container)
+        assert container.name not in self._entry(pool)['idle']
+        assert not tmpdir.join('containers', container.name).check()
+        pool.drain()
+
+    def test_mounts(self, tmpdir):
+        pool = self._pool(tmpdir, recycle=True)
+        pool.fill()
+        idle = self._entry(pool)['idle']
+        job = Job('app', 'https://example.com/app.git', artifacts_path=str(tmpdir.mkdir('artifacts')))
+        # Pooled containers do not have the git mirror mounted
+        container = pool.acquire(Project(jobs=[job]))
+        assert container.name not in idle
+        assert tmpdir.join('containers', container.name, 'var', 'cache', 'baka', 'git').check(link=1)
+        pool.release(container)
+        assert self._entry(pool)['idle'] == idle
+        assert not tmpdir.join('containers', container.name).check()
+        pool.drain()
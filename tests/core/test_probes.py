@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+import subprocess
+
+import pytest
+
+from baka.core.backend import probes
+
+
+class TestProbes:
+    def test_parse(self):
+        assert isinstance(probes.parse('route'), probes.RouteProbe)
+        assert probes.parse('dns').script == 'getent hosts archive.ubuntu.com'
+        assert probes.parse('dns:example.com').script == 'getent hosts example.com'
+        assert 'http://10.0.0.1/' in probes.parse('url:http://10.0.0.1/').script
+        assert probes.parse('cmd:ping -c1 gateway').script == 'ping -c1 gateway'
+        assert [type(p) for p in probes.parse_all()] == [probes.RouteProbe, probes.DNSProbe]
+        for spec in ('foo', 'url', 'cmd:'):
+            with pytest.raises(probes.ProbeError):
+                probes.parse(spec)
+
+    def test_scripts(self):
+        assert subprocess.call(['sh', '-c', probes.parse('cmd:true').script]) == 0
+        assert subprocess.call(['sh', '-c', probes.parse('cmd:false').script]) != 0
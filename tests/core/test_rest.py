@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import socketserver
+import subprocess
+import threading
+import urllib.parse
+import uuid
+
+import pylxd
+import pytest
+from ws4py.websocket import WebSocket
+
+from baka.core import Container, Project
+from baka.core.backend import rest
+
+
+class _ExecSocket(WebSocket):
+    def __init__(self, sock, operation: dict, fd: str):
+        super().__init__(sock)
+        self._operation = operation
+        self._fd = fd
+
+    def received_message(self, message):
+        # Input may arrive before the last file descriptor is attached
+        self._operation['started'].wait()
+        self._operation['process'].stdin.write(message.data)
+
+    def closed(self, code, reason=None):
+        if self._fd == '0' and not self._operation['interactive']:
+            self._operation['started'].wait()
+            self._operation['process'].stdin.close()
+
+
+class _FakeLXDHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def do_PUT(self):
+        self._dispatch()
+
+    def do_DELETE(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        url = urllib.parse.urlparse(self.path)
+        parts = url.path.strip('/').split('/')[1:]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        lxd = self.server
+        if not parts:
+            return self._sync({'auth': 'trusted', 'api_extensions': [], 'environment': {}})
+        if parts in (['containers'], ['instances']):
+            return self._sync(['/1.0/{}/{}'.format(parts[0], name) for name in lxd.containers])
+        if parts[0] == 'operations':
+            return self._operation(lxd.operations[parts[1]], parts[2:], query)
+        container = lxd.containers.get(parts[1])
+        if container is None:
+            return self._send(404, {'type': 'error', 'error': 'not found', 'error_code': 404})
+        if len(parts) == 2 and self.command == 'GET':
+            return self._sync({key: container[key] for key in ('name', 'config', 'devices', 'ephemeral', 'status')})
+        if len(parts) == 2 and self.command == 'PUT':
+            data = json.loads(body.decode())
+            container['config'], container['devices'] = data['config'], data['devices']
+            lxd.updates += 1
+            return self._sync({})
+        if len(parts) == 2 and self.command == 'DELETE':
+            del lxd.containers[parts[1]]
+            return self._async(lxd.operation())
+        if parts[2] == 'state':
+            action = json.loads(body.decode())['action']
+            container['status'] = 'Running' if action == 'start' else 'Stopped'
+            if action == 'stop' and container['ephemeral']:
+                del lxd.containers[parts[1]]
+            return self._async(lxd.operation())
+        if parts[2] == 'files':
+            return self._files(container['root'] + query['path'], body)
+        if parts[2] == 'exec':
+            data = json.loads(body.decode())
+            operation = lxd.operation(container=container, done=False, **data)
+            fds = ['0', 'control'] if data['interactive'] else ['0', '1', '2', 'control']
+            operation['fds'] = {fd: uuid.uuid4().hex for fd in fds}
+            return self._async(operation, {'fds': operation['fds']})
+
+    def _operation(self, operation: dict, parts, query):
+        if parts == ['websocket']:
+            fd = next(fd for fd, secret in operation['fds'].items() if secret == query['secret'])
+            return self._websocket(operation, fd)
+        if parts == ['wait']:
+            operation['finished'].wait()
+        return self._sync({
+            'id': operation['id'], 'status': 'Success', 'status_code': 200,
+            'metadata': {'return': operation.get('return')}
+        })
+
+    def _websocket(self, operation: dict, fd: str):
+        accept = base64.b64encode(hashlib.sha1(
+            self.headers['Sec-WebSocket-Key'].encode() + b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+        ).digest()).decode()
+        ws = _ExecSocket(self.connection, operation, fd)
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        operation['sockets'][fd] = ws
+        if len(operation['sockets']) == len(operation['fds']) - 1:
+            # All file descriptors but the control one are attached
+            self.server.start(operation)
+        ws.run()
+        self.close_connection = True
+
+    def _files(self, path: str, body: bytes):
+        if self.command == 'POST':
+            if self.headers.get('X-LXD-type') == 'directory':
+                os.makedirs(path, exist_ok=True)
+            else:
+                with open(path, 'wb') as file:
+                    file.write(body)
+            return self._sync({})
+        if os.path.isdir(path):
+            data = json.dumps({'type': 'sync', 'metadata': os.listdir(path)}).encode()
+            file_type = 'directory'
+        else:
+            with open(path, 'rb') as file:
+                data = file.read()
+            file_type = 'file'
+        self.send_response(200)
+        self.send_header('X-LXD-type', file_type)
+        self.send_header('X-LXD-mode', '0755')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _sync(self, metadata):
+        self._send(200, {'type': 'sync', 'status': 'Success', 'status_code': 200, 'metadata': metadata})
+
+    def _async(self, operation: dict, metadata: dict=None):
+        self._send(202, {
+            'type': 'async', 'status': 'Operation created', 'status_code': 100,
+            'operation': '/1.0/operations/' + operation['id'],
+            'metadata': {'id': operation['id'], 'metadata': metadata}
+        })
+
+    def _send(self, status: int, data: dict):
+        data = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeLXD(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Stand-in for the LXD daemon, containers are directories on the host."""
+    daemon_threads = True
+
+    def __init__(self, root: str):
+        super().__init__(('127.0.0.1', 0), _FakeLXDHandler)
+        self._root = root
+        self.connections = 0
+        self.updates = 0
+        self.containers = {}
+        self.operations = {}
+
+    @property
+    def endpoint(self) -> str:
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def add_container(self, name: str, ephemeral: bool = True):
+        root = os.path.join(self._root, name)
+        os.makedirs(os.path.join(root, 'home', 'baka'))
+        self.containers[name] = {
+            'name': name, 'config': {}, 'devices': {}, 'ephemeral': ephemeral, 'status': 'Running', 'root': root
+        }
+
+    def operation(self, done: bool = True, **data) -> dict:
+        operation = dict(data, id=uuid.uuid4().hex, started=threading.Event(), finished=threading.Event(), sockets={})
+        if done:
+            operation['finished'].set()
+        self.operations[operation['id']] = operation
+        return operation
+
+    def start(self, operation: dict):
+        root = operation['container']['root']
+        # Container paths are moved below the root of the fake container
+        command = [arg.replace('/home/baka', root + '/home/baka') for arg in operation['command']]
+        env = dict(os.environ, **operation['environment'])
+        env['HOME'] = root + env.get('HOME', '/root')
+        interactive = operation['interactive']
+        process = subprocess.Popen(
+            command, env=env, cwd=env['HOME'] if os.path.isdir(env['HOME']) else root,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if interactive else subprocess.PIPE
+        )
+        operation['process'] = process
+        operation['started'].set()
+        outputs = [(process.stdout, '0')] if interactive else [(process.stdout, '1'), (process.stderr, '2')]
+
+        def forward(pipe, fd: str):
+            for data in iter(lambda: pipe.read1(65536), b''):
+                operation['sockets'][fd].send(data, binary=True)
+            operation['sockets'][fd].close()
+
+        def run():
+            threads = [threading.Thread(target=forward, args=output) for output in outputs]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            operation['return'] = process.wait()
+            operation['finished'].set()
+        threading.Thread(target=run, daemon=True).start()
+
+
+@pytest.fixture
+def fake_lxd(tmpdir):
+    lxd = FakeLXD(str(tmpdir.mkdir('containers')))
+    thread = threading.Thread(target=lxd.serve_forever, daemon=True)
+    thread.start()
+    yield lxd
+    lxd.shutdown()
+    lxd.server_close()
+
+
+class TestRest:
+    def _client(self, lxd: FakeLXD) -> pylxd.Client:
+        lxd.add_container('test-case-container')
+        return pylxd.Client(endpoint=lxd.endpoint)
+
+    def test_execute(self, fake_lxd):
+        client = self._client(fake_lxd)
+        stdout, stderr = [], []
+        exit_code = rest.execute(
+            client, 'test-case-container', ['sh', '-c', 'echo out; echo "$VALUE" >&2; exit 3'], {'VALUE': 'a  $b'},
+            stdout=stdout.append, stderr=stderr.append
+        )
+        assert exit_code == 3
+        assert b''.join(stdout) == b'out\n'
+        assert b''.join(stderr) == b'a  $b\n'
+
+    def test_execute_stdin(self, fake_lxd):
+        client = self._client(fake_lxd)
+        stdout = []
+        exit_code = rest.execute(
+            client, 'test-case-container', ['cat'], stdout=stdout.append, stdin=[b'first ', b'second']
+        )
+        assert exit_code == 0
+        assert b''.join(stdout) == b'first second'
+
+    def test_execute_interactive(self, fake_lxd):
+        client = self._client(fake_lxd)
+        stdout = []
+        exit_code = rest.execute(
+            client, 'test-case-container', ['sh', '-c', 'echo out; echo err >&2'], stdout=stdout.append,
+            interactive=True
+        )
+        assert exit_code == 0
+        assert b''.join(stdout) == b'out\nerr\n'
+
+
+class TestLXDAPIBackend:
+    def test_run(self, fake_lxd, tmpdir):
+        fake_lxd.add_container('test-case-container')
+        c = Container(Project(), backend_type='lxc', backend_options={
+            'name': 'test-case-container',
+            'rest_api': True,
+            'lxd_endpoint': fake_lxd.endpoint,
+            'prepare': False,
+            'network_probes': ['cmd:true'],
+            'mounts': {'/var/cache/baka/shared': str(tmpdir)}
+        })
+        c.init()
+        assert c.ready
+        container = fake_lxd.containers['test-case-container']
+        # The configuration is applied in one update
+        assert fake_lxd.updates == 1
+        assert container['config']['raw.idmap'] == 'both 1000 0'
+        assert container['devices']['baka-var-cache-baka-shared'] == {
+            'type': 'disk', 'source': str(tmpdir), 'path': '/var/cache/baka/shared'
+        }
+        result = c.exec('pwd', path='/home/baka', collect_output=True, log_output=False)
+        assert result.output.strip() == container['root'] + '/home/baka'
+
+        # Push & pull through the file API and through tar archives
+        source = tmpdir.mkdir('source')
+        source.join('a.txt').write('a')
+        source.mkdir('sub').join('b.txt').write('b')
+        for bulk_transfer in (True, False):
+            c._backend.options['bulk_transfer'] = bulk_transfer
+            dest = '/home/baka/{}'.format(bulk_transfer)
+            c.push(str(source), dest)
+            assert open(os.path.join(container['root'], 'home', 'baka', str(bulk_transfer), 'source', 'sub',
+                                     'b.txt')).read() == 'b'
+            pulled = tmpdir.mkdir('pulled-{}'.format(bulk_transfer))
+            c.pull(dest + '/source', str(pulled))
+            assert pulled.join('source', 'a.txt').read() == 'a'
+            assert pulled.join('source', 'sub', 'b.txt').read() == 'b'
+        assert c._backend.transfer_stats['pushed_bytes'] > 0
+        assert c._backend.transfer_stats['pulled_bytes'] > 0
+
+        # Regular requests share a connection, every exec attaches websockets
+        connections = fake_lxd.connections
+        c.exec('true', log_output=False)
+        assert fake_lxd.connections == connections + 1
+        result = asyncio.get_event_loop().run_until_complete(
+            c.aexec('echo out; echo err >&2', collect_output=True, log_output=False)
+        )
+        assert result.exit_code == 0
+        assert sorted(result.output.split()) == ['err', 'out']
+        assert fake_lxd.connections == connections + 4
+
+        c.destroy()
+        assert 'test-case-container' not in fake_lxd.containers
+        shutil.rmtree(container['root'])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import pytest
+
+from baka.core import Job, DependencyError
+from baka.core.scheduler import JobScheduler
+
+
+class TestScheduler:
+    def _jobs(self, tmpdir, depends):
+        return [
+            Job(name, '.', depends=deps, artifacts_path=str(tmpdir))
+            for name, deps in depends
+        ]
+
+    def test_order(self, tmpdir):
+        jobs = self._jobs(tmpdir, (('a', ['c']), ('b', None), ('c', ['b'])))
+        order = []
+        JobScheduler(jobs).run(lambda job: order.append(job.name))
+        assert order == ['b', 'c', 'a']
+
+    def test_parallel(self, tmpdir):
+        jobs = self._jobs(tmpdir, (('a', None), ('b', None), ('c', ['a', 'b'])))
+        started = {}
+        barrier = threading.Barrier(2, timeout=5)
+
+        def run(job):
+            started[job.name] = time.monotonic()
+            if job.name != 'c':
+                # Only passes if a and b run at the same time
+                barrier.wait()
+            else:
+                assert 'a' in started and 'b' in started
+
+        JobScheduler(jobs, max_workers=2).run(run)
+        assert set(started) == {'a', 'b', 'c'}
+
+    def test_fail_fast(self, tmpdir):
+        jobs = self._jobs(tmpdir, (('a', None), ('b', ['a'])))
+        ran = []
+
+        def run(job):
+            ran.append(job.name)
+            raise RuntimeError(job.name)
+
+        with pytest.raises(RuntimeError):
+            JobScheduler(jobs, max_workers=2).run(run)
+        assert ran == ['a']
+
+    def test_invalid(self, tmpdir):
+        with pytest.raises(DependencyError):
+            JobScheduler(self._jobs(tmpdir, (('a', ['missing']),)))
+        with pytest.raises(DependencyError):
+            JobScheduler(self._jobs(tmpdir, (('a', ['b']), ('b', ['a']))))
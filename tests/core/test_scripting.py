@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import traceback
+
+import pytest
+
+from baka.core import Environment
+from baka.core.backend import CommandResult
+from baka.core.scripting import _api
+
+
+class TestScripting:
+    def test_parse_version(self):
+        assert _api.parse_version('0.1.0') == (0, 1, 0)
+        assert _api.parse_version('3.6') == (3, 6, 0)
+        for version in ('', '1.x', '1.2.3.4'):
+            with pytest.raises(_api.APIError):
+                _api.parse_version(version)
+
+    def test_since(self):
+        class TestAPI(_api.BaseAPI):
+            _supported_versions = ('0.1.0', '0.2.0')
+
+            @_api.since('0.2.0')
+            def new_method(self):
+                return True
+        assert TestAPI('0.2.0').new_method()
+        assert TestAPI.new_method.__name__ == 'new_method'
+        with pytest.raises(_api.APIError):
+            TestAPI('0.1.0').new_method()
+
+    def test_require_python(self):
+        assert _api.require('python', '3.0') is None
+        with pytest.raises(_api.APIError):
+            _api.require('python', '3.0', '3.1')
+        with pytest.raises(_api.APIError):
+            _api.require('python', '99.0')
+
+    def test_run_result(self):
+        result = _api.RunResult(CommandResult(2, 'a\nb\nc\n'))
+        assert result.exit_code == 2
+        assert result.tail(2) == ['b', 'c']
+        assert list(result.search('[ab]')) == ['a', 'b']
+        output, exit_code = result
+        assert (output, exit_code) == ('a\nb\nc\n', 2)
+        # Compatible with the former named tuple
+        assert result == ('a\nb\nc\n', 2) and ('a\nb\nc\n', 2) == result
+        assert result != ('a\nb\nc\n', 0)
+        assert (result[0], result[1], result[-1], len(result)) == ('a\nb\nc\n', 2, 2, 2)
+        assert result[:1] == ('a\nb\nc\n',)
+        assert repr(result) == "RunResult(output='a\\nb\\nc\\n', exit_code=2)"
+
+    def test_compile(self):
+        # Syntax errors are reported when the scripts are loaded
+        with pytest.raises(SyntaxError) as e:
+            Environment(scripts={'setup': 'x = ('})
+        assert e.value.filename == '<baka environment:setup>'
+
+    def test_traceback(self):
+        env = Environment(scripts={'setup': 'x = 1\nraise ValueError(x)\n'})
+        with pytest.raises(ValueError) as e:
+            env.setup(None)
+        lines = traceback.format_tb(e.value.__traceback__)
+        assert 'File "<baka environment:setup>", line 2' in lines[-1]
+        assert 'raise ValueError(x)' in lines[-1]
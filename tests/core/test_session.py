@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+
+import pytest
+
+from baka.core.backend import ExecSession
+
+
+class TestExecSession:
+    def _session(self) -> ExecSession:
+        # Run the agent on the host instead of inside a container
+        session = ExecSession([], python=sys.executable)
+        session.open()
+        return session
+
+    def test_exec(self, tmpdir):
+        session = self._session()
+        stdout, stderr = [], []
+        result = session.exec(
+            'echo $GREETING; pwd; echo oops >&2; exit 3', path=str(tmpdir), envvars={'GREETING': 'hello'},
+            stdout=stdout.append, stderr=stderr.append, collect_output=True
+        )
+        session.close()
+        assert result.exit_code == 3
+        assert ''.join(stdout) == 'hello\n{}\n'.format(tmpdir)
+        assert ''.join(stderr) == 'oops\n'
+        assert 'hello' in result.output and 'oops' in result.output
+
+    def test_multiplexing(self):
+        session = self._session()
+        results = {}
+
+        def run(no):
+            results[no] = session.exec('echo {0}; exit {0}'.format(no), collect_output=True)
+
+        threads = [threading.Thread(target=run, args=(no,)) for no in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        session.close()
+        for no in range(10):
+            assert results[no].exit_code == no
+            assert results[no].output == '{}\n'.format(no)
+
+    def test_failures(self):
+        session = self._session()
+
+        def fail(text):
+            raise RuntimeError('callback failed')
+        # The error of the callback is raised by its command only
+        with pytest.raises(RuntimeError):
+            session.exec('echo first', stdout=fail)
+        # Commands writing to the session channel do not break it
+        result = session.exec('echo garbage > /proc/$PPID/fd/1; echo second', collect_output=True)
+        assert (result.exit_code, result.output) == (0, 'second\n')
+        assert session.exec('exit 4').exit_code == 4
+        session.close()
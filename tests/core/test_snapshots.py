@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from baka.core import Container, Environment, Project, SnapshotCache, run
+from baka.core.backend.local import LocalBackend
+
+
+# The environment setup counts how often it runs on the host
+_setup = '''
+baka = require('baka', '0.1.0')
+with open({!r}, 'a') as f:
+    f.write('{}\\n')
+'''
+
+
+class TestSnapshotCache:
+    def _project(self, tmpdir, marker: str = 'setup') -> Project:
+        script = _setup.format(str(tmpdir.join('setups')), marker)
+        return Project(name='snapshots', environment=Environment(scripts={'setup': script}))
+
+    def _run(self, tmpdir, cache: SnapshotCache, project: Project):
+        run(project, 'local', {'root': str(tmpdir.join('containers'))}, skip_environment=False, snapshots=cache)
+
+    def _setups(self, tmpdir):
+        return tmpdir.join('setups').read().split()
+
+    def test_hit(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('BAKA_CACHE_DIR', str(tmpdir.join('cache')))
+        cache = SnapshotCache(str(tmpdir.join('snapshots.json')))
+        project = self._project(tmpdir)
+        self._run(tmpdir, cache, project)
+        assert self._setups(tmpdir) == ['setup']
+        assert len(cache.entries()) == 1
+        # The environment is restored from the snapshot
+        self._run(tmpdir, cache, project)
+        assert self._setups(tmpdir) == ['setup']
+        assert len(cache.entries()) == 1
+
+    def test_miss(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('BAKA_CACHE_DIR', str(tmpdir.join('cache')))
+        cache = SnapshotCache(str(tmpdir.join('snapshots.json')))
+        self._run(tmpdir, cache, self._project(tmpdir))
+        self._run(tmpdir, cache, self._project(tmpdir, marker='changed'))
+        assert self._setups(tmpdir) == ['setup', 'changed']
+        assert len(cache.entries()) == 2
+
+    def test_invalidation(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('BAKA_CACHE_DIR', str(tmpdir.join('cache')))
+        cache = SnapshotCache(str(tmpdir.join('snapshots.json')))
+        project = self._project(tmpdir)
+        self._run(tmpdir, cache, project)
+        # Changed prepare steps invalidate existing snapshots
+        monkeypatch.setattr(LocalBackend, '_prepare_version', LocalBackend._prepare_version + 1)
+        self._run(tmpdir, cache, project)
+        assert self._setups(tmpdir) == ['setup', 'setup']
+        assert len(cache.entries()) == 2
+
+    def test_key(self):
+        project = Project(name='snapshots')
+
+        def key(**options):
+            container = Container(project, backend_type='local', backend_options=dict(options, name='snapshot'))
+            return SnapshotCache.key(container, project)
+        assert key() == key()
+        assert key(apt_cache=True) != key()
+        assert key(prepare=False) != key()
+        assert key(image='other') != key()
+        assert key(arch='arm64') != key()
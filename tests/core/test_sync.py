@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from baka.core import Container, Project, sync
+
+
+class TestSync:
+    def _write(self, path, content: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(content)
+
+    def test_diff(self, tmpdir):
+        source = str(tmpdir)
+        self._write(os.path.join(source, 'a.txt'), 'a')
+        self._write(os.path.join(source, 'sub', 'b.txt'), 'b')
+        self._write(os.path.join(source, 'c.txt'), 'c')
+        self._write(os.path.join(source, 'e.txt'), 'e')
+        os.chmod(os.path.join(source, 'e.txt'), 0o644)
+        previous = sync.scan(source)
+        assert set(previous) == {'a.txt', os.path.join('sub', 'b.txt'), 'c.txt', 'e.txt'}
+
+        # Touching a file without changing it is not a change
+        os.utime(os.path.join(source, 'a.txt'), (0, 0))
+        self._write(os.path.join(source, 'sub', 'b.txt'), 'changed')
+        os.remove(os.path.join(source, 'c.txt'))
+        self._write(os.path.join(source, 'd.txt'), 'd')
+        # Permissions are part of a file
+        os.chmod(os.path.join(source, 'e.txt'), 0o755)
+        current = sync.scan(source, previous)
+        changed, removed = sync.diff(previous, current)
+        assert sorted(changed) == ['d.txt', 'e.txt', os.path.join('sub', 'b.txt')]
+        assert removed == ['c.txt']
+
+    def test_sync(self, tmpdir):
+        c = Container(Project(), backend_type='local', backend_options={
+            'name': 'sync-container', 'root': str(tmpdir.join('containers'))
+        })
+        c.init()
+        source = str(tmpdir.join('source'))
+        dest = str(tmpdir.join('containers', 'sync-container', 'home', 'baka', 'dest'))
+        delta = sync.DeltaSync(source, '/home/baka/dest', '/home/baka/.sync/dest.json')
+        self._write(os.path.join(source, 'a.txt'), 'a')
+        self._write(os.path.join(source, 'file', 'b.txt'), 'b')
+        self._write(os.path.join(source, 'dir'), 'dir')
+        self._write(os.path.join(source, 'removed', 'c.txt'), 'c')
+        assert delta.sync(c) == (4, 0)
+        assert sorted(os.listdir(dest)) == ['a.txt', 'dir', 'file', 'removed']
+
+        # Directories and files swap places, whole directories are removed
+        os.remove(os.path.join(source, 'file', 'b.txt'))
+        os.rmdir(os.path.join(source, 'file'))
+        self._write(os.path.join(source, 'file'), 'file')
+        os.remove(os.path.join(source, 'dir'))
+        self._write(os.path.join(source, 'dir', 'd.txt'), 'd')
+        os.remove(os.path.join(source, 'removed', 'c.txt'))
+        os.rmdir(os.path.join(source, 'removed'))
+        assert delta.sync(c) == (2, 3)
+        assert sorted(os.listdir(dest)) == ['a.txt', 'dir', 'file']
+        with open(os.path.join(dest, 'file')) as file:
+            assert file.read() == 'file'
+        with open(os.path.join(dest, 'dir', 'd.txt')) as file:
+            assert file.read() == 'd'
+        assert delta.sync(c) == (0, 0)
+
+        os.chmod(os.path.join(source, 'a.txt'), 0o755)
+        assert delta.sync(c) == (1, 0)
+        assert os.stat(os.path.join(dest, 'a.txt')).st_mode & 0o777 == 0o755
+        c.destroy()
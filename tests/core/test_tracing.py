@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from baka.core import Environment
+from baka.core import tracing
+from baka.core.backend import _utils
+
+
+class TestTracing:
+    def teardown_method(self):
+        tracing.disable()
+
+    def test_disabled(self):
+        with tracing.span('nothing') as span:
+            span.args['ignored'] = True
+        tracing.count('exec')
+        assert tracing.active() is None
+
+    def test_spans(self, tmpdir):
+        tracer = tracing.enable()
+
+        @tracing.traced('coroutine')
+        async def coroutine():
+            with tracing.span('inner', 'test', value=1):
+                tracing.count('exec')
+            return 42
+
+        with tracing.span('outer', 'test') as span:
+            assert _utils.run_sync(coroutine()) == 42
+            span.args['bytes'] = 10
+        with pytest.raises(ValueError):
+            with tracing.span('failing'):
+                raise ValueError()
+        Environment(scripts={'setup': 'pass'}).setup(None)
+
+        events = {event['name']: event for event in tracer.events}
+        assert set(events) == {'outer', 'coroutine', 'inner', 'failing', 'script.setup'}
+        outer, inner = events['outer'], events['inner']
+        assert outer['start'] <= inner['start']
+        assert inner['start'] + inner['duration'] <= outer['start'] + outer['duration']
+        assert outer['args'] == {'bytes': 10}
+        assert events['failing']['args'] == {'error': 'ValueError'}
+        assert tracer.counters == {'exec': 1}
+
+        filename = str(tmpdir.join('trace.json'))
+        tracer.write_chrome_trace(filename)
+        with open(filename) as file:
+            trace = json.load(file)
+        complete = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+        assert len(complete) == 5
+        assert all(event['dur'] >= 0 for event in complete)
+        assert trace['otherData']['counters'] == {'exec': 1}
+
+        summary = tracer.summary()
+        assert summary[0]['name'] == 'outer'
+        assert summary[0]['count'] == 1
+        assert 'outer' in tracer.format_summary()
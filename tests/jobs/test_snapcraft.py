@@ -2,7 +2,8 @@
 
 import os.path
 
-from baka.core import run_declarative
+from baka.core import Container, Project, run_declarative
+from baka.jobs import SnapcraftJob
 
 
 class TestSnapcraft:
@@ -18,3 +19,21 @@ class TestSnapcraft:
             os.path.join(project_path, 'baka.yml'),
             backend_options=self._test_backend_options
         )
+
+    def test_parts_cache_mounts(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('BAKA_CACHE_DIR', str(tmpdir))
+        job = SnapcraftJob(
+            'snap', str(tmpdir), artifacts_path=str(tmpdir.join('artifacts')), options={'parts-cache': True}
+        )
+        c = Container(
+            Project(jobs=[job]), backend_type='docker',
+            backend_options={'name': 'test-case-container', 'arch': 'amd64'}
+        )
+        mounts = c._backend._mounts()
+        assert set(mounts) == {'/var/cache/baka/snapcraft', '/var/cache/baka/snapcraft-parts/snap'}
+        for source in mounts.values():
+            assert os.path.isdir(source)
+            assert source.startswith(str(tmpdir))
+        # Without the option nothing is mounted
+        job = SnapcraftJob('snap', str(tmpdir), artifacts_path=str(tmpdir.join('artifacts')))
+        assert job.mounts(c) == {}